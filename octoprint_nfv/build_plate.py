@@ -1,6 +1,6 @@
 from typing import Any, Union, Dict, List
 
-from octoprint_nfv.db import get_db
+from octoprint_nfv.db import commit_change, get_db
 
 
 def get_filament_types():
@@ -81,7 +81,7 @@ class build_plate:
                     # Otherwise, insert the nozzle size into the database
                     cursor.execute("INSERT INTO build_plates (name, compatible_filaments) VALUES (?, ?)",
                                    (str(name), str(compatible_filaments)))
-                    con.commit()
+                    commit_change(self.data_folder, con)
             else:
 
                 cursor.execute("SELECT id FROM build_plates WHERE id = ?", (str(id),))
@@ -93,7 +93,7 @@ class build_plate:
                 else:
                     cursor.execute("INSERT INTO build_plates (name, compatible_filaments, id) VALUES (?, ?, ?)",
                                    (str(name), str(compatible_filaments), int(id)))
-                con.commit()
+                commit_change(self.data_folder, con)
         except Exception as e:
             self._logger.error(f"Error adding build plate to the database: {e}")
             raise
@@ -108,7 +108,7 @@ class build_plate:
         cursor = con.cursor()
         cursor.execute("UPDATE current_selections SET selection = ? WHERE id = 'build_plate'",
                        (int(selected_build_plate_id),))  # Assuming there's only one current nozzle
-        con.commit()
+        commit_change(self.data_folder, con)
 
     def get_current_build_plate_name(self) -> Union[str, None]:
         """
@@ -188,7 +188,6 @@ class build_plate:
         build_plate_id = int(build_plate_id)
         current_build_plate_id = self.get_current_build_plate_id()
         cursor.execute("DELETE FROM build_plates WHERE id = ?", (build_plate_id,))
-        con.commit()
 
         # If the selected plate was removed, select the first remaining plate
         # instead of leaving a dangling selection.
@@ -197,7 +196,7 @@ class build_plate:
             replacement = cursor.fetchone()
             cursor.execute("UPDATE current_selections SET selection = ? WHERE id = 'build_plate'",
                            (replacement[0] if replacement else None,))
-            con.commit()
+        commit_change(self.data_folder, con)
 
     def get_build_plate_name_by_id(self, build_plate_id: int) -> Union[str, None]:
         """
@@ -10,5 +10,38 @@ class alert_types:
     tmp_danger = "tmp_danger"
     success = "success"
     reload = "reload"
+    state_delta = "state_delta"
+    library_validation = "library_validation"
+    printability = "printability"
     switch_spools = "switch_spools"
     validation_prompt = "validation_prompt"
+
+
+class validation_gate:
+    """
+    Class to handle the states of the pre-print validation gate
+    """
+    idle = "idle"
+    pending = "pending"
+    passed = "passed"
+    blocked = "blocked"
+
+
+class circuit_state:
+    """
+    Class to handle the states of a circuit breaker
+    """
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class library_validation_state:
+    """
+    Class to handle the states of a library validation job
+    """
+    queued = "queued"
+    running = "running"
+    done = "done"
+    cancelled = "cancelled"
+    failed = "failed"
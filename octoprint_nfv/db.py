@@ -1,22 +1,307 @@
+import contextlib
 import logging
 import os
 import sqlite3
+import threading
 import time
+from typing import Any, Callable, Dict, Iterator
 
 
-def get_db(path: str) -> sqlite3.Connection:
+DATABASE_FILE = "nozzle_filament_database.db"
+# Milliseconds a connection waits for a lock held by another connection before raising
+BUSY_TIMEOUT_MS = 5000
+# Seconds waited for the write lock that are counted as a lock wait
+LOCK_WAIT_THRESHOLD = 0.01
+
+
+class connection_manager:
+    """
+    Class to handle the connections to one database file, each thread reuses its own idle connections
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = BUSY_TIMEOUT_MS) -> None:
+        """
+        Constructor
+        :param db_path: the path to the database file
+        :param busy_timeout_ms: the milliseconds a connection waits for a locked database
+        """
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (thread, connection) of every open connection, connections of finished threads are closed on the next open
+        self._connections = []
+        self.opened = 0
+        self.transactions = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.max_lock_wait_seconds = 0.0
+        self._subscribers = []
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Borrow an idle connection of the calling thread, opening one when all of them are borrowed
+        Every borrower has its own connection, so its transaction is isolated like that of a new connection.
+        :return: the sqlite3 connection, give it back with release
+        """
+        idle = getattr(self._local, "idle", None)
+        if idle:
+            return idle.pop()
+
+        # The connection is only used by this thread, close_all may close it from another one
+        con = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        con.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        con.execute("PRAGMA journal_mode = WAL")
+        with self._lock:
+            self._close_finished_threads()
+            self._connections.append((threading.current_thread(), con))
+            self.opened += 1
+        return con
+
+    def release(self, con: sqlite3.Connection) -> None:
+        """
+        Give a borrowed connection back, its uncommitted changes are discarded as if it was closed
+        :param con: the connection returned by acquire
+        """
+        with self._lock:
+            # Connections closed by close_all are not reused
+            if not any(open_con is con for _, open_con in self._connections):
+                return
+        if con.in_transaction:
+            con.rollback()
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        idle.append(con)
+
+    def _close_finished_threads(self) -> None:
+        open_connections = []
+        for thread, con in self._connections:
+            if thread.is_alive():
+                open_connections.append((thread, con))
+            else:
+                con.close()
+        self._connections = open_connections
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Run a write transaction, the write lock is taken up front and waited for instead of failing midway
+        :return: a cursor of the transaction, committed on success and rolled back on error
+        """
+        # A connection of its own, so pending writes of other borrowers on this thread are left alone
+        con = self.acquire()
+        try:
+            start = time.monotonic()
+            con.execute("BEGIN IMMEDIATE")
+            waited = time.monotonic() - start
+            with self._lock:
+                self.transactions += 1
+                self.lock_wait_seconds += waited
+                self.max_lock_wait_seconds = max(self.max_lock_wait_seconds, waited)
+                if waited >= LOCK_WAIT_THRESHOLD:
+                    self.lock_waits += 1
+            try:
+                yield con.cursor()
+            except BaseException:
+                con.rollback()
+                raise
+            con.commit()
+        finally:
+            self.release(con)
+
+    def subscribe(self, callback: Callable[[int], None]) -> Callable[[], None]:
+        """
+        Call a function with the new generation after every committed change
+        :param callback: the function to call
+        :return: a function that ends the subscription
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def notify(self, generation: int) -> None:
+        """
+        Tell the subscribers about a committed change
+        :param generation: the generation of the change
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(generation)
+            except Exception:
+                # The change is committed, a failing subscriber must not fail the write
+                logging.getLogger(__name__).exception("State change subscriber failed")
+
+    def close_all(self) -> None:
+        """
+        Close the connections of all threads
+        """
+        with self._lock:
+            for _, con in self._connections:
+                con.close()
+            self._connections = []
+        # Threads that use the manager again open a new connection
+        self._local = threading.local()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the connection and lock wait counters
+        :return: the counters
+        """
+        with self._lock:
+            return {
+                "open_connections": sum(1 for thread, _ in self._connections if thread.is_alive()),
+                "opened_connections": self.opened,
+                "transactions": self.transactions,
+                "lock_waits": self.lock_waits,
+                "lock_wait_seconds": round(self.lock_wait_seconds, 6),
+                "max_lock_wait_seconds": round(self.max_lock_wait_seconds, 6),
+            }
+
+
+class pooled_connection:
+    """
+    Class to handle a borrowed connection, closing it gives it back to the thread's idle connections
+    """
+
+    def __init__(self, manager: connection_manager, connection: sqlite3.Connection) -> None:
+        self._manager = manager
+        self._connection = connection
+        self._closed = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def __enter__(self) -> "pooled_connection":
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> Any:
+        return self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        """
+        Give the connection back, uncommitted changes are discarded as if the connection was closed
+        """
+        if not self._closed:
+            self._closed = True
+            self._manager.release(self._connection)
+
+    def __del__(self) -> None:
+        # Borrowers that never call close give the connection back when they drop it, like an unclosed connection
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_managers_lock = threading.Lock()
+_managers: Dict[str, connection_manager] = {}
+
+
+def get_manager(path: str, file_name: str = DATABASE_FILE) -> connection_manager:
+    """
+    Get the connection manager of a database file
+    :param path: path to db
+    :param file_name: the name of the database file in the data folder
+    :return: the connection manager
     """
-    Get the database connection
+    db_path = os.path.join(path, file_name)
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            manager = _managers[db_path] = connection_manager(db_path)
+        return manager
+
+
+def get_db(path: str, file_name: str = DATABASE_FILE) -> pooled_connection:
+    """
+    Get the database connection of the calling thread
     :param path: path to db
+    :param file_name: the name of the database file in the data folder
     :return: the sqlite3 connection
     """
-    data_folder = path
-    if not os.path.exists(data_folder):
-        os.makedirs(data_folder)
+    manager = get_manager(path, file_name)
+    return pooled_connection(manager, manager.acquire())
+
+
+def bump_generation(cursor: sqlite3.Cursor) -> int:
+    """
+    Increase the state generation, within the transaction of the write it belongs to
+    :param cursor: a cursor of the write transaction
+    :return: the new generation
+    """
+    cursor.execute("UPDATE state_generation SET generation = generation + 1 WHERE id = 1")
+    cursor.execute("SELECT generation FROM state_generation WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def commit_change(path: str, con: Any) -> int:
+    """
+    Commit a write to the hardware tables together with a new state generation and notify the subscribers
+    :param path: path to db
+    :param con: the connection holding the uncommitted write
+    :return: the new generation
+    """
+    generation = bump_generation(con.cursor())
+    con.commit()
+    get_manager(path).notify(generation)
+    return generation
+
+
+def get_generation(path: str) -> int:
+    """
+    Get the state generation, it increases with every change to the hardware tables
+    :param path: path to db
+    :return: the generation
+    """
+    con = get_db(path)
+    try:
+        row = con.execute("SELECT generation FROM state_generation WHERE id = 1").fetchone()
+    finally:
+        con.close()
+    return row[0] if row else 0
+
+
+def subscribe(path: str, callback: Callable[[int], None]) -> Callable[[], None]:
+    """
+    Call a function with the new generation after every change to the hardware tables
+    :param path: path to db
+    :param callback: the function to call
+    :return: a function that ends the subscription
+    """
+    return get_manager(path).subscribe(callback)
+
+
+def close_all() -> None:
+    """
+    Close the connections to all database files
+    """
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close_all()
+
 
-    # Construct the path to the SQLite database file
-    db_path = os.path.join(data_folder, "nozzle_filament_database.db")
-    return sqlite3.connect(db_path)
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Get the counters of every database file
+    :return: the counters by database file name
+    """
+    with _managers_lock:
+        managers = list(_managers.values())
+    return {os.path.basename(manager.db_path): manager.stats() for manager in managers}
 
 
 def init_db(path: str) -> None:
@@ -47,40 +332,23 @@ def check_and_insert_to_db(data_path: str, logger: logging.Logger, row: str, val
     :param row: the row to check
     :param value: the value to insert
     """
-    conn = get_db(data_path)
     try:
-        retry = 0
-        index = conn.cursor()
-
-        # Check if the table already exists in the table schema
-        index.execute("SELECT COUNT(*) FROM current_selections WHERE id = ?",
-                      (str(row),))
-        exists = index.fetchone()[0]
-
-        if not exists:
-            while retry < 3:
-                try:
-                    index.execute("INSERT INTO current_selections (id, selection) VALUES (?, ?)",
-                                  (row, value))
-                    conn.commit()
-                    break
-                except sqlite3.OperationalError as error:
-                    logger.warning(f"Database operation failed: {error}")
-                    logger.warning("Retrying...")
-                    retry += 1
-                    time.sleep(1)  # Wait for 1 second before retrying
-
-            if retry == 3:
-                logger.error(
-                    "Failed to insert row into current_selections after multiple attempts. Plugin "
-                    "initialization may be incomplete.")
+        # The write lock is taken up front, a busy database is waited for by busy_timeout
+        manager = get_manager(data_path)
+        with manager.transaction() as cursor:
+            cursor.execute("INSERT OR IGNORE INTO current_selections (id, selection) VALUES (?, ?)", (row, value))
+            generation = bump_generation(cursor) if cursor.rowcount else None
+        if generation is not None:
+            manager.notify(generation)
+    except sqlite3.OperationalError as error:
+        logger.error(f"Failed to insert row into current_selections: {error}. Plugin initialization may be "
+                     "incomplete.")
     except Exception as error:
         logger.error(f"Error adding nozzle to the database: {error}")
-    conn.close()
 
 
 def add_row_to_db(data_path: str, logger: logging.Logger, table: str, insert_function: callable, params: tuple,
-                  num_rows: int = 0, num_retries: int = 3) -> None:
+                  num_rows: int = 0) -> None:
     """
     Add a row to a database.
     :param data_path: the path to the database dir
@@ -89,30 +357,17 @@ def add_row_to_db(data_path: str, logger: logging.Logger, table: str, insert_fun
     :param insert_function: the function to insert the row
     :param params: the parameters to pass to the insert function
     :param num_rows: the number of rows that should be in the table
-    :param num_retries: the number of times to retry adding the row
     """
     conn = get_db(data_path)
 
     try:
-        retries = 0
         cursor = conn.cursor()
         cursor.execute(f"SELECT COUNT(*) FROM {table}")
         count = cursor.fetchone()[0]
         if int(count) < num_rows or num_rows == 0 and int(count) == 0:
-            while retries < num_retries:
-                try:
-                    insert_function(*params)
-                    break
-                except sqlite3.OperationalError as e:
-                    logger.warning(f"Database operation failed: {e}")
-                    logger.warning("Retrying...")
-                    retries += 1
-                    time.sleep(1)  # Wait for 1 second before retrying
-
-            if retries == 3:
-                logger.error(
-                    f"Failed to insert row into {table} after multiple attempts. Plugin initialization may "
-                    "be incomplete.")
+            insert_function(*params)
+    except sqlite3.OperationalError as e:
+        logger.error(f"Failed to insert row into {table}: {e}. Plugin initialization may be incomplete.")
     except Exception as e:
         logger.error(f"Error adding to the database: {e}")
     conn.close()
@@ -1,7 +1,8 @@
 import logging
 from typing import Any, List, Dict
 
-from octoprint_nfv.db import get_db
+from octoprint_nfv.db import bump_generation, commit_change, get_db, get_manager
+from octoprint_nfv.printer_profile import build_profile_view, printer_profile_view
 
 
 class extruders:
@@ -10,19 +11,21 @@ class extruders:
     """
 
     def __init__(self, nozzle: Any, data_folder: str, logger: logging.Logger,
-                 _printer_profile_manager: Any) -> None:
+                 _printer_profile_manager: Any, printer_profile: Any = None) -> None:
         """
         Constructor
         :param nozzle:
         :param data_folder:
         :param logger:
         :param _printer_profile_manager:
+        :param printer_profile: the printer profile cache, the profile is parsed on every read without it
         """
         super().__init__()
         self.data_folder = data_folder
         self._logger = logger
         self._nozzle = nozzle
         self._printer_profile_manager = _printer_profile_manager
+        self._printer_profile = printer_profile
 
     def fetch_extruders_from_database(self) -> List[Dict[str, Any]]:
         """
@@ -51,7 +54,7 @@ class extruders:
             cursor.execute("INSERT INTO extruders (nozzle_id, extruder_position) VALUES (?, ?)",
                            (int(nozzle_id), int(extruder_position)))
 
-            con.commit()
+            commit_change(self.data_folder, con)
 
         except Exception as e:
             self._logger.error(f"Error adding extruder to the database: {e}")
@@ -69,7 +72,7 @@ class extruders:
                 cursor.execute("DELETE FROM extruders WHERE id = ?", (int(extruder_id),))
             elif extruder_position is not None:
                 cursor.execute("DELETE FROM extruders WHERE extruder_position = ?", (int(extruder_position),))
-            con.commit()
+            commit_change(self.data_folder, con)
 
         except Exception as e:
             self._logger.error(f"Error removing extruder from the database: {e}")
@@ -121,7 +124,7 @@ class extruders:
         cursor = con.cursor()
         cursor.execute("UPDATE extruders SET nozzle_id = ? WHERE extruder_position = ?",
                        (nozzle_id, extruder_position))
-        con.commit()
+        commit_change(self.data_folder, con)
 
     def set_extruder_position(self, db_id: int, extruder_position: int) -> None:
         """
@@ -133,7 +136,7 @@ class extruders:
         con = get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("UPDATE extruders SET extruder_position = ? WHERE id = ?", (extruder_position, db_id))
-        con.commit()
+        commit_change(self.data_folder, con)
 
     def is_multi_tool_head(self) -> bool:
         """
@@ -141,17 +144,23 @@ class extruders:
         :return: true if the printer has multiple tool heads
         """
         # check if the printer has multiple tool heads using the octoprint API and make sure they use different nozzles
-        printer_profile = self._printer_profile_manager.get_current_or_default()
-        printer_profile_tool_count = printer_profile['extruder']['count']
-        shared_nozzle = printer_profile['extruder']["sharedNozzle"]
-        return printer_profile_tool_count > 1 and not shared_nozzle
+        return self.get_printer_profile().is_multi_tool_head
 
     def get_number_of_extruders(self) -> int:
         """
         Get the number of extruders
         :return: the number of extruders
         """
-        return self._printer_profile_manager.get_current_or_default()['extruder']['count']
+        return self.get_printer_profile().tool_count
+
+    def get_printer_profile(self) -> printer_profile_view:
+        """
+        Get the parsed current printer profile
+        :return: the parsed profile
+        """
+        if self._printer_profile is not None:
+            return self._printer_profile.get()
+        return build_profile_view(self._printer_profile_manager.get_current_or_default())
 
     def update_extruder(self, db_id: int = None, nozzle_id: int = 1, extruder_position: int = None) -> None:
         """
@@ -180,7 +189,7 @@ class extruders:
                                (nozzle_id, extruder_position))
             elif db_id is not None:
                 cursor.execute("UPDATE extruders SET nozzle_id = ? WHERE id != ?", (nozzle_id, db_id))
-        con.commit()
+        commit_change(self.data_folder, con)
 
     def get_extruder_info(self, extruder_position: int) -> List[Dict[str, Any]]:
         """
@@ -197,23 +206,29 @@ class extruders:
 
     def update_data(self) -> None:
         """
-        Update the data in the database
+        Reconcile the extruders in the database with the printer profile in one transaction
         """
-        num_extruders_in_db = len(self.fetch_extruders_from_database())
         num_extruders_in_profile = self.get_number_of_extruders()
-        self._logger.info(f"Number of extruders in database: {num_extruders_in_db}")
-
-        if num_extruders_in_db < num_extruders_in_profile:
-            for i in range(num_extruders_in_db, num_extruders_in_profile):
-                self.add_extruder_to_database(1, i + 1)
-        elif num_extruders_in_db > num_extruders_in_profile:
-            for i in range(num_extruders_in_profile, num_extruders_in_db):
-                self.remove_extruder_from_database(extruder_position=i + 1)
-
-        # check if the nozzles are the same if multi tool head is false
-        if not self.is_multi_tool_head():
-            extruder_list = self.fetch_extruders_from_database()
-            extruder_1_nozzle = self.get_nozzle_id_for_extruder(1)
-            for extruder in extruder_list:
-                if extruder['nozzle_id'] != extruder_1_nozzle:
-                    self.set_nozzle_for_extruder(extruder['extruder_position'], extruder_1_nozzle)
+        is_multi_tool_head = self.is_multi_tool_head()
+        manager = get_manager(self.data_folder)
+        with manager.transaction() as cursor:
+            cursor.execute("SELECT extruder_position FROM extruders")
+            positions = {row[0] for row in cursor.fetchall()}
+            self._logger.info(f"Number of extruders in database: {len(positions)}")
+
+            missing = sorted(set(range(1, num_extruders_in_profile + 1)) - positions)
+            cursor.executemany("INSERT INTO extruders (nozzle_id, extruder_position) VALUES (1, ?)",
+                               [(position,) for position in missing])
+            cursor.execute("DELETE FROM extruders WHERE extruder_position > ?", (num_extruders_in_profile,))
+            changed = bool(missing) or cursor.rowcount > 0
+
+            # all extruders share the nozzle of extruder 1 if multi tool head is false
+            if not is_multi_tool_head:
+                cursor.execute("UPDATE extruders SET nozzle_id = (SELECT nozzle_id FROM extruders "
+                               "WHERE extruder_position = 1) WHERE extruder_position != 1 AND nozzle_id IS NOT "
+                               "(SELECT nozzle_id FROM extruders WHERE extruder_position = 1)")
+                changed = changed or cursor.rowcount > 0
+
+            generation = bump_generation(cursor) if changed else None
+        if generation is not None:
+            manager.notify(generation)
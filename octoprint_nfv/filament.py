@@ -29,14 +29,16 @@ class filament:
         con = db.get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("INSERT OR IGNORE INTO filament_data (id, data) VALUES (?, ?)", (setting_id, value))
-        con.commit()
+        # An existing setting is left alone, so there is no change to announce
+        if cursor.rowcount > 0:
+            db.commit_change(self.data_folder, con)
         con.close()
 
     def _update_setting(self, setting_id: str, value) -> None:
         con = db.get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("UPDATE filament_data SET data = ? WHERE id = ?", (value, setting_id))
-        con.commit()
+        db.commit_change(self.data_folder, con)
         con.close()
 
     def _get_bool_setting(self, setting_id: str, default: bool) -> bool:
@@ -63,7 +65,7 @@ class filament:
             self._logger.error("Timeout already exists in the database")
         else:
             cursor.execute("INSERT INTO filament_data (id, data) VALUES (?, ?)", ("timeout", timeout,))
-        con.commit()
+            db.commit_change(self.data_folder, con)
 
     def add_enable_spool_checking_to_db(self, enable_spool_checking: bool) -> None:
         """
@@ -83,7 +85,7 @@ class filament:
         else:
             cursor.execute("INSERT INTO filament_data (id, data) VALUES (?, ?)", ("enable_spool_checking",
                                                                                   enable_spool_checking,))
-        con.commit()
+            db.commit_change(self.data_folder, con)
 
     def update_enable_spool_checking(self, enable_spool_checking: bool) -> None:
         """
@@ -93,7 +95,7 @@ class filament:
         con = db.get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("UPDATE filament_data SET data = ? WHERE id = 'enable_spool_checking'", (enable_spool_checking,))
-        con.commit()
+        db.commit_change(self.data_folder, con)
 
     def update_enable_filament_type_checking(self, enabled: bool) -> None:
         self._update_setting("enable_filament_type_checking", enabled)
@@ -106,7 +108,7 @@ class filament:
         con = db.get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("UPDATE filament_data SET data = ? WHERE id = 'timeout'", (timeout,))
-        con.commit()
+        db.commit_change(self.data_folder, con)
 
     def get_timeout(self) -> int:
         """
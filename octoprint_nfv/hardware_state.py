@@ -0,0 +1,180 @@
+import logging
+import threading
+from typing import Any, Dict, List, Tuple, Union
+
+from octoprint_nfv.db import get_db, subscribe
+
+
+class hardware_snapshot:
+    """
+    Class to handle one consistent, read-only copy of the configured hardware and filament settings
+    """
+
+    def __init__(self, nozzles: Dict[int, float], extruders: Dict[int, int],
+                 build_plates: Dict[int, Tuple[str, List[str]]], current_build_plate: Union[int, None],
+                 filament_settings: Dict[str, Any], generation: int = 0) -> None:
+        """
+        Constructor
+        :param nozzles: nozzle size by nozzle id
+        :param extruders: nozzle id by extruder position
+        :param build_plates: (name, compatible filaments) by build plate id
+        :param current_build_plate: the id of the selected build plate
+        :param filament_settings: the filament_data rows by id
+        :param generation: the state generation the tables were read at
+        """
+        self.nozzles = nozzles
+        self.extruders = extruders
+        self.build_plates = build_plates
+        self.current_build_plate = current_build_plate
+        self.filament_settings = filament_settings
+        self.generation = generation
+
+    def get_nozzle_size_for_extruder(self, extruder_position: int) -> Union[float, None]:
+        """
+        Get the nozzle size for an extruder
+        :param extruder_position: the position of the extruder
+        :return: the nozzle size or none if no nozzle is selected
+        """
+        nozzle_id = self.extruders.get(extruder_position)
+        return self.nozzles.get(nozzle_id) if nozzle_id is not None else None
+
+    def get_current_build_plate_filaments(self) -> Union[List[str], None]:
+        """
+        Get the current build plate filaments
+        :return: a list of the current build plate filaments or none if not found
+        """
+        build_plate = self.build_plates.get(self.current_build_plate)
+        return build_plate[1] if build_plate else None
+
+    def is_filament_compatible_with_build_plate(self, filament_type: str) -> bool:
+        """
+        Check if the filament type is compatible with the current build plate
+        :param filament_type: the filament type to check
+        :return: true if the filament is compatible, false otherwise
+        """
+        build_plate_filaments = self.get_current_build_plate_filaments()
+        return build_plate_filaments is not None and filament_type in build_plate_filaments
+
+    def get_timeout(self) -> int:
+        return self.filament_settings.get("timeout")
+
+    def get_enable_spool_checking(self) -> bool:
+        return bool(self.filament_settings.get("enable_spool_checking"))
+
+    def get_enable_filament_type_checking(self) -> bool:
+        value = self.filament_settings.get("enable_filament_type_checking")
+        return True if value is None else bool(value)
+
+
+class live_hardware:
+    """
+    Class to handle reading the hardware settings from the database classes when no snapshot is available
+    """
+
+    def __init__(self, extruders: Any, build_plate: Any, filament: Any) -> None:
+        self._extruders = extruders
+        self._build_plate = build_plate
+        self._filament = filament
+
+    def get_nozzle_size_for_extruder(self, extruder_position: int) -> Union[float, None]:
+        try:
+            return self._extruders.get_nozzle_size_for_extruder(extruder_position)
+        except TypeError:
+            # the extruder has no row yet
+            return None
+
+    def get_current_build_plate_filaments(self) -> Union[List[str], None]:
+        return self._build_plate.get_current_build_plate_filaments()
+
+    def is_filament_compatible_with_build_plate(self, filament_type: str) -> bool:
+        return self._build_plate.is_filament_compatible_with_build_plate(filament_type)
+
+    def get_timeout(self) -> int:
+        return self._filament.get_timeout()
+
+    def get_enable_spool_checking(self) -> bool:
+        return self._filament.get_enable_spool_checking()
+
+    def get_enable_filament_type_checking(self) -> bool:
+        return self._filament.get_enable_filament_type_checking()
+
+
+class hardware_state:
+    """
+    Class to handle the in-memory copy of the hardware tables, refreshed after every committed change
+    """
+
+    def __init__(self, data_folder: str, logger: logging.Logger) -> None:
+        """
+        Constructor
+        :param data_folder: the data folder of the plugin
+        :param logger: the logger object
+        """
+        self.data_folder = data_folder
+        self._logger = logger
+        self._refresh_lock = threading.Lock()
+        self._snapshot = hardware_snapshot({}, {}, {}, None, {})
+        self._unsubscribe = subscribe(data_folder, self._on_change)
+
+    def snapshot(self) -> hardware_snapshot:
+        """
+        Get the current snapshot, it is replaced as a whole and never modified
+        :return: the snapshot
+        """
+        return self._snapshot
+
+    def generation(self) -> int:
+        """
+        Get the state generation of the current snapshot
+        :return: the generation
+        """
+        return self._snapshot.generation
+
+    def close(self) -> None:
+        """
+        Stop following the changes to the hardware tables
+        """
+        self._unsubscribe()
+
+    def _on_change(self, generation: int) -> None:
+        """
+        Refresh the snapshot after a change was committed
+        :param generation: the generation of the change
+        """
+        if generation > self._snapshot.generation:
+            self.refresh()
+
+    def refresh(self) -> hardware_snapshot:
+        """
+        Load the hardware tables into a new snapshot
+        :return: the new snapshot
+        """
+        with self._refresh_lock:
+            con = get_db(self.data_folder)
+            try:
+                cursor = con.cursor()
+                # One read transaction, so the tables are read at the same point in time
+                cursor.execute("BEGIN")
+                cursor.execute("SELECT generation FROM state_generation WHERE id = 1")
+                row = cursor.fetchone()
+                generation = row[0] if row else 0
+                cursor.execute("SELECT id, size FROM nozzles")
+                nozzles = {row[0]: row[1] for row in cursor.fetchall()}
+                cursor.execute("SELECT extruder_position, nozzle_id FROM extruders")
+                extruders = {row[0]: row[1] for row in cursor.fetchall()}
+                cursor.execute("SELECT id, name, compatible_filaments FROM build_plates")
+                build_plates = {row[0]: (row[1], str(row[2]).split(",")) for row in cursor.fetchall()}
+                cursor.execute("SELECT selection FROM current_selections WHERE id = 'build_plate'")
+                row = cursor.fetchone()
+                current_build_plate = row[0] if row else None
+                cursor.execute("SELECT id, data FROM filament_data")
+                filament_settings = {row[0]: row[1] for row in cursor.fetchall()}
+                con.commit()
+            finally:
+                con.close()
+
+            # A refresh never goes back to an older generation
+            if generation >= self._snapshot.generation:
+                self._snapshot = hardware_snapshot(nozzles, extruders, build_plates, current_build_plate,
+                                                   filament_settings, generation)
+            return self._snapshot
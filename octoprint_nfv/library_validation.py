@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+from octoprint_nfv.constants import library_validation_state
+
+# Files validated at the same time, their metadata is parsed by the metadata cache's parser
+LIBRARY_VALIDATION_WORKERS = 2
+# Seconds between two progress messages of a library validation
+PROGRESS_INTERVAL = 0.5
+
+
+class library_validation:
+    """
+    Class to handle validating many files in the background against one snapshot of the printer state
+    """
+
+    def __init__(self, job_id: int, files: List[Tuple[str, str]], validator: Any, metadata_cache: Any,
+                 send_message: Callable[[Dict[str, Any]], None], logger: logging.Logger,
+                 workers: int = LIBRARY_VALIDATION_WORKERS) -> None:
+        """
+        Constructor
+        :param job_id: the id of the job
+        :param files: (path in the storage, path on disk) of every file to validate
+        :param validator: the validator, its rules compute the verdicts
+        :param metadata_cache: the metadata cache the files are parsed through
+        :param send_message: sends a progress message to the frontend
+        :param logger: the logger object
+        :param workers: the number of files validated at the same time
+        """
+        self.job_id = job_id
+        self._files = files
+        self._validator = validator
+        self._metadata_cache = metadata_cache
+        self._send_message = send_message
+        self._logger = logger
+        self._workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self.state = library_validation_state.queued
+        self.results = []
+        self._unsent = []
+
+    def start(self) -> None:
+        """
+        Start validating in a background thread
+        """
+        threading.Thread(target=self.run, name="nfv-library-validation", daemon=True).start()
+
+    def cancel(self) -> None:
+        """
+        Stop validating, the files that are already running still finish
+        """
+        self._cancelled.set()
+
+    def run(self) -> None:
+        """
+        Validate every file and stream the verdicts to the frontend
+        """
+        self.state = library_validation_state.running
+        try:
+            # Every file is checked against the same printer state
+            snapshot = self._validator.capture_snapshot()
+            last_message = time.monotonic()
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="nfv-library") as executor:
+                futures = [executor.submit(self._validate, storage_path, disk_path, snapshot)
+                           for storage_path, disk_path in self._files]
+                for future in as_completed(futures):
+                    with self._lock:
+                        self.results.append(future.result())
+                        self._unsent.append(self.results[-1])
+                    if time.monotonic() - last_message >= PROGRESS_INTERVAL:
+                        last_message = time.monotonic()
+                        self._send_progress()
+            self.state = (library_validation_state.cancelled if self._cancelled.is_set()
+                          else library_validation_state.done)
+        except Exception:
+            self._logger.exception(f"Library validation {self.job_id} failed")
+            self.state = library_validation_state.failed
+        self._send_progress()
+
+    def _validate(self, storage_path: str, disk_path: str, snapshot: Any) -> Dict[str, Any]:
+        """
+        Validate one file without prompting, it is parsed on this worker and not on the validator's threads
+        :param storage_path: the path of the file in the storage
+        :param disk_path: the path of the file on disk
+        :param snapshot: the printer state to validate against
+        :return: the verdict of the file
+        """
+        if self._cancelled.is_set():
+            return dict(path=storage_path, printable=None, reasons=["Cancelled"])
+        try:
+            gcode_info = self._metadata_cache.get_or_parse(disk_path)
+        except (OSError, UnicodeError) as e:
+            return dict(path=storage_path, printable=False, reasons=[f"The GCODE could not be parsed: {e}"])
+        except Exception as e:
+            # A parser or cache bug fails this file only, the other files of the job are still validated
+            self._logger.exception(f"Parsing {storage_path} failed")
+            return dict(path=storage_path, printable=False, reasons=[f"The GCODE could not be parsed: {e}"])
+        try:
+            printable, reasons = self._validator.explain_metadata(gcode_info, snapshot)
+        except Exception as e:
+            self._logger.exception(f"Validating {storage_path} failed")
+            printable, reasons = False, [f"Validation failed: {e}"]
+        return dict(path=storage_path, printable=printable, reasons=reasons)
+
+    def _send_progress(self) -> None:
+        with self._lock:
+            results, self._unsent = self._unsent, []
+            done = len(self.results)
+        self._send_message(dict(job=self.job_id, state=self.state, done=done, total=len(self._files),
+                                results=results))
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Get the progress and the verdicts of the job
+        :return: the status
+        """
+        with self._lock:
+            results = list(self.results)
+        return dict(job=self.job_id, state=self.state, done=len(results), total=len(self._files),
+                    printable=sum(1 for result in results if result["printable"]), results=results)
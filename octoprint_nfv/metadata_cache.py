@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple, Union
+
+from octoprint_nfv.db import get_db
+from octoprint_nfv.validate import fingerprint, parse_gcode
+
+METADATA_DATABASE_FILE = "gcode_metadata.db"
+# Cache hits remembered in memory before their last use is written to the database
+LAST_USED_FLUSH_SIZE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gcode_metadata
+(
+    path      TEXT PRIMARY KEY,
+    size      INTEGER,
+    mtime_ns  INTEGER,
+    inode     INTEGER,
+    metadata  TEXT,
+    bytes     INTEGER,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS gcode_metadata_last_used ON gcode_metadata (last_used);
+"""
+
+
+class metadata_cache:
+    """
+    Class to handle the persistent cache of parsed GCODE metadata, keyed by the file fingerprint
+    """
+
+    def __init__(self, data_folder: str, logger: logging.Logger, max_entries: int = 5000,
+                 max_bytes: int = 8 * 1024 * 1024, parser: Callable[[str], Dict[str, Any]] = parse_gcode) -> None:
+        """
+        Constructor
+        :param data_folder: the data folder of the plugin
+        :param logger: the logger object
+        :param max_entries: the maximum number of cached files
+        :param max_bytes: the maximum size of all cached metadata in bytes
+        :param parser: the function used to parse a file on a miss
+        """
+        self.parser = parser
+        self.data_folder = data_folder
+        self._logger = logger
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # the last use of the entries hit since the last flush, a hit doesn't write to the database
+        self._last_used = {}
+        con = self._connect()
+        con.executescript(SCHEMA)
+        con.commit()
+        con.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return get_db(self.data_folder, METADATA_DATABASE_FILE)
+
+    def get(self, file_path: str) -> Union[Dict[str, Any], None]:
+        """
+        Get the cached metadata of a file, entries of changed or deleted files are dropped
+        :param file_path: the path to the GCODE file
+        :return: the metadata as returned by parse_gcode or none if it isn't cached
+        """
+        try:
+            current = fingerprint(file_path)
+        except OSError:
+            self.remove(file_path)
+            return None
+
+        with self._lock:
+            con = self._connect()
+            try:
+                cursor = con.cursor()
+                cursor.execute("SELECT size, mtime_ns, inode, metadata FROM gcode_metadata WHERE path = ?",
+                               (file_path,))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                if tuple(row[:3]) != current:
+                    cursor.execute("DELETE FROM gcode_metadata WHERE path = ?", (file_path,))
+                    con.commit()
+                    return None
+                self._last_used[file_path] = time.time()
+                if len(self._last_used) >= LAST_USED_FLUSH_SIZE:
+                    self._flush(cursor)
+                    con.commit()
+                return json.loads(row[3])
+            finally:
+                con.close()
+
+    def _flush(self, cursor: sqlite3.Cursor) -> None:
+        """
+        Write the last use of the entries hit since the last flush, the lock must be held
+        :param cursor: the cursor of the transaction the writes join
+        """
+        if self._last_used:
+            cursor.executemany("UPDATE gcode_metadata SET last_used = ? WHERE path = ?",
+                               [(last_used, path) for path, last_used in self._last_used.items()])
+            self._last_used.clear()
+
+    def flush(self) -> None:
+        """
+        Write the last use of the entries hit since the last flush
+        """
+        with self._lock:
+            con = self._connect()
+            try:
+                self._flush(con.cursor())
+                con.commit()
+            finally:
+                con.close()
+
+    def put(self, file_path: str, metadata: Dict[str, Any], file_fingerprint: Tuple[int, int, int] = None) -> None:
+        """
+        Store the metadata of a file and evict the least recently used entries above the limits
+        :param file_path: the path to the GCODE file
+        :param metadata: the metadata as returned by parse_gcode
+        :param file_fingerprint: the fingerprint the metadata was read from, defaults to the current one
+        """
+        if file_fingerprint is None:
+            file_fingerprint = fingerprint(file_path)
+        data = json.dumps(metadata)
+        with self._lock:
+            con = self._connect()
+            try:
+                cursor = con.cursor()
+                cursor.execute("INSERT OR REPLACE INTO gcode_metadata (path, size, mtime_ns, inode, metadata, bytes, "
+                               "last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (file_path, *file_fingerprint, data, len(data), time.time()))
+                self._last_used.pop(file_path, None)
+                # Evicting needs the current order of use
+                self._flush(cursor)
+                self._evict(cursor)
+                con.commit()
+            finally:
+                con.close()
+
+    def _evict(self, cursor: sqlite3.Cursor) -> None:
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM gcode_metadata")
+        entries, total_bytes = cursor.fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        evicted = []
+        cursor.execute("SELECT path, bytes FROM gcode_metadata ORDER BY last_used")
+        for path, size in cursor.fetchall():
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append((path,))
+            entries -= 1
+            total_bytes -= size
+        cursor.executemany("DELETE FROM gcode_metadata WHERE path = ?", evicted)
+
+    def get_or_parse(self, file_path: str, parser: Callable[[str], Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Get the metadata of a file from the cache, parsing and storing it on a miss
+        :param file_path: the path to the GCODE file
+        :param parser: the function used to parse the file on a miss, the parser of the cache when not given
+        :return: the metadata as returned by parse_gcode
+        """
+        metadata = self.get(file_path)
+        if metadata is not None:
+            return metadata
+
+        # Take the fingerprint before parsing, a file modified while it is
+        # parsed then no longer matches its entry.
+        file_fingerprint = fingerprint(file_path)
+        metadata = (parser or self.parser)(file_path)
+        try:
+            self.put(file_path, metadata, file_fingerprint)
+        except sqlite3.Error as e:
+            self._logger.warning(f"Could not cache the GCODE metadata of {file_path}: {e}")
+        return metadata
+
+    def remove(self, file_path: str) -> None:
+        """
+        Remove a file from the cache
+        :param file_path: the path to the GCODE file
+        """
+        with self._lock:
+            con = self._connect()
+            con.execute("DELETE FROM gcode_metadata WHERE path = ?", (file_path,))
+            con.commit()
+            con.close()
+
+    def remove_folder(self, folder_path: str) -> None:
+        """
+        Remove all files within a folder from the cache
+        :param folder_path: the path to the folder
+        """
+        prefix = os.path.join(folder_path, "")
+        with self._lock:
+            con = self._connect()
+            con.execute("DELETE FROM gcode_metadata WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            con.commit()
+            con.close()
+
+    def prune(self) -> None:
+        """
+        Drop the entries of files that were changed or deleted while the plugin wasn't running
+        """
+        with self._lock:
+            con = self._connect()
+            try:
+                cursor = con.cursor()
+                cursor.execute("SELECT path, size, mtime_ns, inode FROM gcode_metadata")
+                stale = []
+                for path, size, mtime_ns, inode in cursor.fetchall():
+                    try:
+                        if fingerprint(path) != (size, mtime_ns, inode):
+                            stale.append((path,))
+                    except OSError:
+                        stale.append((path,))
+                cursor.executemany("DELETE FROM gcode_metadata WHERE path = ?", stale)
+                con.commit()
+            finally:
+                con.close()
+        if stale:
+            self._logger.info(f"Removed {len(stale)} stale entries from the GCODE metadata cache")
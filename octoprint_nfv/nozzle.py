@@ -1,7 +1,7 @@
 import logging
 from typing import Any, List, Dict
 
-from octoprint_nfv.db import get_db
+from octoprint_nfv.db import commit_change, get_db
 
 
 class nozzle:
@@ -50,7 +50,7 @@ class nozzle:
             else:
                 # Otherwise, insert the nozzle size into the database
                 cursor.execute("INSERT INTO nozzles (size) VALUES (?)", (float(nozzle_size),))
-                con.commit()
+                commit_change(self.data_folder, con)
         except Exception as e:
             self._logger.error(f"Error adding nozzle to the database: {e}")
 
@@ -62,7 +62,7 @@ class nozzle:
         con = get_db(self.data_folder)
         cursor = con.cursor()
         cursor.execute("DELETE FROM nozzles WHERE id = ?", (nozzle_id,))
-        con.commit()
+        commit_change(self.data_folder, con)
 
     def get_nozzle_size_by_id(self, nozzle_id: int) -> float:
         """
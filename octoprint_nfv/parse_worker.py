@@ -0,0 +1,148 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Union
+
+from octoprint_nfv.validate import parse_gcode
+
+# Seconds a worker may take to parse one file before it is considered hung
+PARSE_WORKER_TIMEOUT = 10.0
+# Number of worker processes, one keeps the parse off the OctoPrint interpreter without competing for the cores
+PARSE_WORKERS = 1
+
+
+class parse_worker_pool:
+    """
+    Class to handle parsing GCODE metadata in long-lived worker processes, so the regex and decode work doesn't hold
+    the GIL of OctoPrint's comm and web server threads
+    """
+
+    def __init__(self, logger: logging.Logger, timeout: float = PARSE_WORKER_TIMEOUT, workers: int = PARSE_WORKERS,
+                 mp_context: Any = None) -> None:
+        """
+        Constructor
+        :param logger: the logger object
+        :param timeout: seconds a worker may take to parse one file
+        :param workers: the number of worker processes
+        :param mp_context: the multiprocessing context of the workers, spawn when not given
+        """
+        self._logger = logger
+        self._timeout = timeout
+        self._workers = max(1, workers)
+        # Spawned workers don't inherit the threads and held locks of OctoPrint
+        self._mp_context = mp_context if mp_context is not None else multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._executor = None
+        # Parses that haven't finished yet, with the pool they were submitted to
+        self._futures: Dict[Future, ProcessPoolExecutor] = {}
+        self._closed = False
+        self.worker_parses = 0
+        self.fallbacks = 0
+        self.restarts = 0
+        self.timeouts = 0
+
+    def _get_executor(self) -> Union[ProcessPoolExecutor, None]:
+        with self._lock:
+            if self._closed:
+                return None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers, mp_context=self._mp_context)
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Throw away a broken or hung pool, the next parse starts a new one
+        :param executor: the pool to throw away
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        # A hung worker never picks up the shutdown, so it is stopped directly
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        self._shutdown(executor)
+
+    def _shutdown(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Cancel the parses still queued on a pool and stop it without waiting, shutdown only takes cancel_futures from
+        Python 3.9 on
+        :param executor: the pool to stop
+        """
+        with self._lock:
+            pending = [future for future, owner in self._futures.items() if owner is executor]
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(future, None)
+
+    def start(self) -> None:
+        """
+        Start the workers ahead of the first parse, so it doesn't wait for a process to start
+        """
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                executor.submit(os.getpid)
+            except RuntimeError as e:
+                self._logger.warning(f"Could not start the GCODE parse worker: {e}")
+
+    def parse(self, file_path: str) -> Dict[str, Any]:
+        """
+        Parse the metadata of a GCODE file in a worker, in this process when no worker is available
+        :param file_path: the path to the GCODE file
+        :return: the metadata as returned by parse_gcode
+        """
+        executor = self._get_executor()
+        if executor is None:
+            return self._parse_in_process(file_path, "the worker pool is closed")
+        try:
+            future = executor.submit(parse_gcode, file_path)
+        except RuntimeError as e:
+            self._discard(executor)
+            return self._parse_in_process(file_path, str(e) or "the worker pool is unavailable")
+        with self._lock:
+            self._futures[future] = executor
+        future.add_done_callback(self._forget)
+
+        try:
+            metadata = future.result(timeout=self._timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            self._discard(executor)
+            raise TimeoutError(f"Parsing {file_path} took longer than {self._timeout} seconds")
+        except BrokenProcessPool as e:
+            # The worker crashed, the file is parsed here and the next parse gets a new worker
+            self._discard(executor)
+            return self._parse_in_process(file_path, str(e) or "the worker crashed")
+        self.worker_parses += 1
+        return metadata
+
+    def _parse_in_process(self, file_path: str, reason: str) -> Dict[str, Any]:
+        self.fallbacks += 1
+        self._logger.warning(f"Parsing {file_path} in the OctoPrint process, {reason}")
+        return parse_gcode(file_path)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the pool
+        :return: the counters
+        """
+        return dict(worker_parses=self.worker_parses, fallbacks=self.fallbacks, restarts=self.restarts,
+                    timeouts=self.timeouts)
+
+    def close(self) -> None:
+        """
+        Stop the workers, later parses run in this process
+        """
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            self._shutdown(executor)
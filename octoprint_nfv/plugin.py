@@ -0,0 +1,1094 @@
+# coding=utf-8
+from __future__ import absolute_import, annotations
+
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import flask
+import octoprint.plugin
+from flask_login import current_user
+from octoprint.events import Events
+from octoprint.filemanager import FileDestinations, valid_file_type
+
+import octoprint_nfv.build_plate as build_plate
+import octoprint_nfv.db as db
+import octoprint_nfv.extruders as extruders
+import octoprint_nfv.hardware_state as hardware_state
+import octoprint_nfv.library_validation as library_validation
+import octoprint_nfv.metadata_cache as metadata_cache
+import octoprint_nfv.nozzle as nozzle
+import octoprint_nfv.parse_worker as parse_worker
+import octoprint_nfv.preprocessor as preprocessor
+import octoprint_nfv.printability_index as printability_index
+import octoprint_nfv.printer_profile as printer_profile
+import octoprint_nfv.state_view as state_view
+import octoprint_nfv.validate as validate
+from octoprint_nfv.constants import alert_types, library_validation_state, validation_gate
+from octoprint_nfv.db import get_db, init_db
+from octoprint_nfv.filament import filament
+from octoprint_nfv.spoolManager import SPOOL_MANAGER_EVENT_PREFIX, SpoolManagerIntegration, circuit_breaker
+
+# Seconds without printer profile events before the extruders are reconciled with the profile
+EXTRUDER_RECONCILE_DELAY = 0.5
+# Seconds without state changes before the printability index is moved to the new state
+PRINTABILITY_REFRESH_DELAY = 0.5
+
+
+class Nozzle_filament_validatorPlugin(octoprint.plugin.StartupPlugin, octoprint.plugin.SettingsPlugin,
+                                      octoprint.plugin.AssetPlugin,
+                                      octoprint.plugin.TemplatePlugin,
+                                      octoprint.plugin.SimpleApiPlugin,
+                                      octoprint.plugin.EventHandlerPlugin,
+                                      octoprint.plugin.ShutdownPlugin
+                                      ):
+    """
+    Class to handle the Nozzle Filament Validator plugin
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        super().__init__()
+        self._spool_manager: spoolManager = None
+        self.nozzle: validate = None
+        self.build_plate: build_plate = None
+        self.extruders: extruders = None
+        self.validator: validate = None
+        self.filament: filament = None
+        self.metadata_cache: metadata_cache = None
+        self.parse_worker: parse_worker = None
+        self.hardware_state: hardware_state = None
+        self.printer_profile: printer_profile = None
+        self.printability_index: printability_index = None
+        self._upload_capture: preprocessor.upload_metadata_capture = None
+        self._validation_lock = threading.RLock()
+        self._validation_result = None
+        self._validation_path = None
+        # (state, job) replaced as a whole so the queuing hook can read it without the lock
+        self._gate = (validation_gate.idle, None)
+        # Speculative validation of the selected file, see _schedule_prevalidation
+        self._prevalidation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nfv-prevalidate")
+        # Maintains the printability index in order, apart from the speculative validations
+        self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nfv-printability")
+        self._prevalidation = None
+        self._validation_token = None
+        self._state_generation = 0
+        # (comm, cmd, cmd_type, tags) of the job commands held while a pending job is on hold, see _hold_job
+        self._held_commands = []
+        self._job_held = False
+        # (key, etag, state, body) of the last state served to the frontend, see _get_state_view
+        self._state_view = None
+        # The state the clients were last sent, see _push_state_delta
+        self._pushed_state = None
+        self._state_push_lock = threading.Lock()
+        # Pending reconciliation of the extruders, see _schedule_extruder_reconciliation
+        self._reconcile_timer = None
+        self._reconcile_lock = threading.Lock()
+        # The last library validation, see _start_library_validation
+        self._library_validation = None
+        self._library_validation_lock = threading.Lock()
+        # Pending refresh of the printability index, see _schedule_printability_refresh
+        self._printability_timer = None
+        self._printability_lock = threading.Lock()
+
+    def get_api_commands(self):
+        """
+        Get the API commands for the plugin
+        :return: the API commands
+        """
+        if current_user.is_anonymous:
+            return flask.abort(403)
+
+        return dict(
+            addNozzle=["size"],
+            removeNozzle=["nozzleId"],
+            add_build_plate=["name", "compatibleFilaments", "id"],
+            select_build_plate=["buildPlateId"],
+            remove_build_plate=["buildPlateId"],
+            get_build_plate=["buildPlateId"],
+            update_extruder=["extruderPosition", "nozzleId"],
+            get_extruder_info=["extruderId"],
+            get_loaded_filaments=[],
+            updateWaitState=["state"],
+            update_filament_timeout=["timeout"],
+            update_check_spool_id_timeout=["timeout"],
+            update_check_spool_id=["checkSpoolId"],
+            update_filament_type_checking=["enabled"],
+            add_extruder=["nozzleId", "extruderPosition"],
+            remove_extruder=["extruderId"],
+            get_diagnostics=[],
+            set_multiple_tool_heads=["value"],
+            validate_library=[],
+            get_library_validation=[],
+            get_printability=[],
+        )
+
+    def on_api_get(self, request: flask.Request) -> flask.Response:
+        """
+        Handle the API get requests
+        :param request: the request to handle
+        """
+        if current_user.is_anonymous:
+            return flask.abort(403)
+
+        etag, state, body = self._get_state_view()
+        active_prompt = self.validator.get_active_prompt()
+        if active_prompt is not None:
+            # The countdown of a prompt changes every second, so the response can't be revalidated
+            return flask.jsonify(**state, active_prompt=active_prompt)
+
+        if request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            response = flask.Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _get_state_view(self) -> Tuple[str, Dict, str]:
+        """
+        Get the state shown by the frontend, built from one hardware snapshot and kept until the state changes
+        :return: the ETag, the state and the serialized state
+        """
+        snapshot = self.hardware_state.snapshot()
+        profile = self.printer_profile.get()
+        key = (snapshot.generation, profile)
+        view = self._state_view
+        if view is not None and view[0] == key:
+            return view[1], view[2], view[3]
+
+        state = state_view.build_state_view(snapshot, profile)
+        body = json.dumps(dict(state, active_prompt=None))
+        etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        self._state_view = (key, etag, state, body)
+        return etag, state, body
+
+    def on_api_command(self, command: str, data: Dict) -> flask.response:
+        """
+        Handle the API commands from the frontend
+        :param command: the command to handle
+        :param data: the data to handle
+        :return:
+        """
+        if current_user.is_anonymous():
+            return flask.abort(403)
+
+        if command == "addNozzle":
+            nozzle_size = data["size"]
+            if nozzle_size is not None:
+                try:
+                    self.nozzle.add_nozzle_to_database(nozzle_size)
+                except Exception as e:
+                    self.send_alert(f"Error adding nozzle to the database: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "removeNozzle":
+            nozzle_size = data.get("nozzleId")
+            if nozzle_size is not None:
+                try:
+                    self.nozzle.remove_nozzle_from_database(nozzle_size)
+                except Exception as e:
+                    self.send_alert(f"Error removing nozzle from the database: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "add_build_plate":
+            name = data["name"]
+            compatible_filaments = data["compatibleFilaments"]
+            db_position = data.get("id") if data.get("id") not in (None, "") else "null"
+            if name is not None and compatible_filaments is not None:
+                try:
+                    self.build_plate.insert_build_plate_to_database(name, compatible_filaments, db_position)
+                except Exception as e:
+                    self.send_alert(f"Error adding build plate: {e}", alert_types.tmp_error)
+                    return flask.abort(409)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "select_build_plate":
+            selected_build_plate_id = data.get("buildPlateId")
+            if selected_build_plate_id is not None:
+                try:
+                    self.build_plate.select_current_build_plate(selected_build_plate_id)
+                except Exception as e:
+                    self.send_alert(f"Error selecting build_plate: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "remove_build_plate":
+            selected_build_plate_id = data.get("buildPlateId")
+            if selected_build_plate_id is not None:
+                try:
+                    self.build_plate.remove_build_plate_from_database(selected_build_plate_id)
+                except Exception as e:
+                    self.send_alert(f"Error removing build_plate from the database: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "get_build_plate":
+            selected_build_plate_id = data.get("buildPlateId")
+            if selected_build_plate_id is not None:
+                try:
+                    current_build_plate = self.build_plate.get_build_plate_name_by_id(selected_build_plate_id)
+                    current_build_plate_filaments = str(self.build_plate.get_build_plate_filaments_by_id(
+                        selected_build_plate_id))
+                    return flask.jsonify(name=current_build_plate, filaments=current_build_plate_filaments)
+                except Exception as e:
+                    self.send_alert(f"Error retrieving build_plate from the database: {e}", alert_types.tmp_error)
+                    return flask.abort(502)
+            else:
+                return flask.abort(400)
+
+        elif command == "add_extruder":
+            nozzle_size = data.get("nozzleId")
+            extruder_position = data.get("extruderPosition")
+            if nozzle_size is not None and extruder_position is not None:
+                try:
+                    self.extruders.add_extruder_to_database(nozzle_size, extruder_position)
+                except Exception as e:
+                    self.send_alert(f"Error adding extruder to the database: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "update_extruder":
+            extruder_position = data.get("extruderPosition")
+            nozzle_id = data.get("nozzleId")
+            # extruder_position = data.get("extruderID")
+            if extruder_position is not None and nozzle_id is not None:
+                try:
+                    self.extruders.update_extruder(extruder_position=extruder_position, nozzle_id=nozzle_id)
+                except Exception as e:
+                    self.send_alert(f"Error updating extruder: {e}", alert_types.error)
+                return flask.jsonify(success=True)
+            else:
+                return flask.abort(400)
+
+        elif command == "remove_extruder":
+            extruder_id = data.get("extruderId")
+            if extruder_id is not None:
+                try:
+                    self.extruders.remove_extruder_from_database(extruder_position=extruder_id)
+                    return flask.jsonify(success=True)
+                except Exception as e:
+                    self.send_alert(f"Error removing extruder from the database: {e}", alert_types.error)
+
+            return flask.abort(400)
+
+        elif command == "get_extruder_info":
+            extruder_id = data.get("extruderId")
+            if extruder_id is not None:
+                try:
+                    nozzle_size = self.extruders.get_nozzle_size_for_extruder(extruder_id)
+                    extruder_position = extruder_id
+                    try:
+                        filaments = self._spool_manager.get_loaded_filaments()[extruder_position - 1]
+                    except Exception as e:
+                        self._logger.error(f"Error retrieving filament info: {e}")
+                        filaments = None
+                    return flask.jsonify(nozzleSize=nozzle_size, extruderPosition=extruder_position,
+                                         filamentType=filaments,
+                                         spoolName=self._spool_manager.get_names()[extruder_position - 1])
+                except Exception as e:
+                    self.send_alert(f"Error retrieving extruder info: {e}", alert_types.tmp_error)
+                    return flask.abort(500)
+
+        elif command == "get_loaded_filaments":
+            try:
+                filaments = str(self._spool_manager.get_loaded_filaments()).replace("[", "").replace("]", "")
+                return flask.jsonify(filaments=filaments)
+            except Exception as e:
+                self.send_alert(f"Error retrieving filament info: {e}", alert_types.tmp_error)
+                return flask.abort(500)
+
+        elif command == "set_multiple_tool_heads":
+            value = data.get("value")
+            if value is not None:
+                try:
+                    self.extruders.set_multiple_tool_heads(value.lower() == "true")
+                    return flask.jsonify()
+                except Exception as e:
+                    self.send_alert(f"Error setting multiple tool heads: {e}", alert_types.error)
+                return flask.abort(500)
+
+        elif command == "updateWaitState":
+            data = data.get("state")
+            if data is not None:
+                self.validator.update_filament_wait_status(data)
+                return flask.jsonify(success=True)
+            flask.abort(400)
+
+        elif command in ("update_filament_timeout", "update_check_spool_id_timeout"):
+            data = data.get("timeout")
+            if data is not None:
+                timeout = int(data)
+                if timeout < 0:
+                    return flask.abort(400)
+                self.filament.update_timeout(timeout)
+                return flask.jsonify(success=True)
+            flask.abort(400)
+
+        elif command == "update_check_spool_id":
+            data = data.get("checkSpoolId")
+            if data is not None:
+                enabled = data if isinstance(data, bool) else str(data).lower() in ("1", "true", "yes", "on")
+                self.filament.update_enable_spool_checking(enabled)
+                return flask.jsonify(success=True)
+            flask.abort(400)
+        elif command == "get_diagnostics":
+            return flask.jsonify(databases=db.get_stats(),
+                                 state_generation=self.hardware_state.generation(),
+                                 spool_manager=self._spool_manager.stats(),
+                                 parse_worker=self.parse_worker.stats() if self.parse_worker is not None else None,
+                                 printability_index=self.printability_index.stats(),
+                                 verdict_cache=dict(hits=self.validator.verdicts.hits,
+                                                    misses=self.validator.verdicts.misses))
+        elif command == "validate_library":
+            try:
+                job = self._start_library_validation(data.get("path"))
+            except Exception as e:
+                self.send_alert(f"Error validating the library: {e}", alert_types.tmp_error)
+                return flask.abort(500)
+            if job is None:
+                return flask.abort(409, description="A library validation is already running")
+            return flask.jsonify(job.status())
+        elif command == "get_library_validation":
+            job = self._library_validation
+            return flask.jsonify(job.status() if job is not None else None)
+        elif command == "get_printability":
+            return flask.jsonify(self.printability_index.query(data.get("path")))
+        elif command == "update_filament_type_checking":
+            value = data.get("enabled")
+            if value is not None:
+                enabled = value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes", "on")
+                self.filament.update_enable_filament_type_checking(enabled)
+                return flask.jsonify(success=True)
+            flask.abort(400)
+        return flask.abort(400)
+
+    def send_alert(self, message: str, alert_type: str = alert_types.popup) -> None:
+        """
+        Send an alert to the frontend
+        :param message: the message to send
+        :param alert_type: what type of alert to send
+        """
+        self._plugin_manager.send_plugin_message(self._identifier, dict(type=alert_type, msg=message))
+
+    def _start_library_validation(self, path: Union[str, None] = None) -> \
+            Union[library_validation.library_validation, None]:
+        """
+        Validate every GCODE file of a folder of the local storage in the background
+        :param path: the folder to validate, the whole local storage when not given
+        :return: the job or none if a library validation is already running
+        """
+        with self._library_validation_lock:
+            job = self._library_validation
+            if job is not None and job.state in (library_validation_state.queued, library_validation_state.running):
+                return None
+            files = [(file_path, self._file_manager.path_on_disk(FileDestinations.LOCAL, file_path))
+                     for file_path in self._list_library_files(path)]
+            job = library_validation.library_validation(
+                job.job_id + 1 if job is not None else 1, files, self.validator, self.metadata_cache,
+                self._send_library_progress, self._logger, workers=self._settings.get_int(["library_validation_workers"]))
+            self._library_validation = job
+        job.start()
+        return job
+
+    def _list_library_files(self, path: Union[str, None] = None) -> List[str]:
+        """
+        Get the paths of the GCODE files of a folder of the local storage, including its sub folders
+        :param path: the folder, the whole local storage when not given
+        :return: the paths in the storage
+        """
+        entries = self._file_manager.list_files(FileDestinations.LOCAL, path=path, recursive=True)
+        pending = list(entries.get(FileDestinations.LOCAL, {}).values())
+        files = []
+        while pending:
+            entry = pending.pop()
+            if entry.get("type") == "folder":
+                pending.extend(entry.get("children", {}).values())
+            elif valid_file_type(entry["path"], type="gcode"):
+                files.append(entry["path"])
+        return sorted(files)
+
+    def _send_library_progress(self, progress: Dict) -> None:
+        """
+        Send the progress and the new verdicts of a library validation to the frontend
+        :param progress: the progress of the job
+        """
+        self._plugin_manager.send_plugin_message(self._identifier,
+                                                 dict(progress, type=alert_types.library_validation))
+
+    def on_settings_save(self, data) -> None:
+        """
+        Save the settings
+        :param data: the data to save
+        """
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+
+    def initialize(self) -> None:
+        """
+        Initialize the plugin
+        """
+
+        init_db(self.get_plugin_data_folder())
+
+        conn = get_db(self.get_plugin_data_folder())
+
+        spool_manager_info = self._plugin_manager.plugins.get("SpoolManager")
+        spool_manager_plugin = spool_manager_info.implementation if spool_manager_info is not None else None
+        breaker = circuit_breaker(failure_threshold=self._settings.get_int(["spool_manager_failure_threshold"]),
+                                  reset_timeout=self._settings.get_float(["spool_manager_reset_timeout"]))
+        self._spool_manager = SpoolManagerIntegration(
+            spool_manager_plugin, self._logger, deadline=self._settings.get_float(["spool_manager_deadline"]),
+            breaker=breaker)
+
+        self.nozzle = nozzle.nozzle(self.get_plugin_data_folder(), self._logger)
+        self.build_plate = build_plate.build_plate(self.get_plugin_data_folder(), self._logger)
+        self.printer_profile = printer_profile.printer_profile_cache(self._printer_profile_manager)
+        self.extruders = extruders.extruders(self.nozzle, self.get_plugin_data_folder(), self._logger,
+                                             self._printer_profile_manager, self.printer_profile)
+        self.filament = filament(self.get_plugin_data_folder(), self._logger)
+        self.hardware_state = hardware_state.hardware_state(self.get_plugin_data_folder(), self._logger)
+        parser = validate.parse_gcode
+        if self._settings.get_boolean(["parse_in_worker_process"]):
+            self.parse_worker = parse_worker.parse_worker_pool(
+                self._logger, timeout=self._settings.get_float(["parse_worker_timeout"]))
+            self.parse_worker.start()
+            parser = self.parse_worker.parse
+        self.metadata_cache = metadata_cache.metadata_cache(
+            self.get_plugin_data_folder(), self._logger,
+            max_entries=self._settings.get_int(["metadata_cache_max_entries"]),
+            max_bytes=self._settings.get_int(["metadata_cache_max_bytes"]), parser=parser)
+        self._upload_capture = preprocessor.upload_metadata_capture(self._logger)
+
+        self.validator = validate.validator(self.nozzle, self.build_plate, self.extruders, self._spool_manager,
+                                            self.filament,
+                                            self._printer, self._logger, self._plugin_manager, self._identifier,
+                                            self._printer_profile_manager, self.metadata_cache, self.hardware_state,
+                                            self.printer_profile)
+        self.printability_index = printability_index.printability_index(self.validator, self.metadata_cache,
+                                                                        self._logger)
+        db.subscribe(self.get_plugin_data_folder(), self._on_hardware_change)
+
+        # Check if the nozzle and build plate columns exist in the current_selections table
+        db.check_and_insert_to_db(self.get_plugin_data_folder(), self._logger, "build_plate")
+
+        # Add default nozzle and build plate to the database
+        db.add_row_to_db(self.get_plugin_data_folder(), self._logger, "nozzles", self.nozzle.add_nozzle_to_database,
+                         (0.4,))
+        db.add_row_to_db(self.get_plugin_data_folder(), self._logger, "build_plates",
+                         self.build_plate.insert_build_plate_to_database, ("Generic", "PLA, PETG, ABS", "1"))
+
+        db.add_row_to_db(self.get_plugin_data_folder(), self._logger, "extruders",
+                         self.extruders.add_extruder_to_database, (1, 1))
+        db.add_row_to_db(self.get_plugin_data_folder(), self._logger, "filament_data",
+                         self.filament.initial_db_add, (False, 300, True), 3)
+
+        self.extruders.update_data()
+        self.hardware_state.refresh()
+        self._pushed_state = self._get_state_view()[1]
+        conn.close()
+
+    def on_event(self, event, payload) -> None:
+        """
+        Handle octoprint events
+        :param event: the event to handle
+        :param payload: the payload of the event
+        """
+        if event == Events.PRINT_CANCELLING:
+            # The cancellation commands are part of the job, a job on hold would never send them
+            self._abandon_pending_job()
+        elif event in (Events.PRINT_CANCELLED, Events.PRINT_DONE, Events.PRINT_FAILED):
+            self._reset_gate()
+            self._prevalidate_selected_file()
+
+        if event == Events.FILE_SELECTED and payload.get("origin") == FileDestinations.LOCAL:
+            self._schedule_prevalidation(self._file_manager.path_on_disk(FileDestinations.LOCAL, payload["path"]))
+        elif event == Events.FILE_DESELECTED:
+            self._invalidate_prevalidation()
+        elif event == Events.FILE_ADDED and payload.get("storage") == FileDestinations.LOCAL:
+            self._store_upload_metadata(payload["path"])
+            if valid_file_type(payload["path"], type="gcode"):
+                # Parse ahead of selection so validating the file later is a cache hit
+                self._index_executor.submit(
+                    self.printability_index.update_file, payload["path"],
+                    self._file_manager.path_on_disk(FileDestinations.LOCAL, payload["path"]))
+        elif event == Events.FILE_REMOVED and payload.get("storage") == FileDestinations.LOCAL:
+            self.metadata_cache.remove(self._file_manager.path_on_disk(FileDestinations.LOCAL, payload["path"]))
+            self._index_executor.submit(self.printability_index.remove_file, payload["path"])
+        elif event == Events.FOLDER_REMOVED and payload.get("storage") == FileDestinations.LOCAL:
+            self.metadata_cache.remove_folder(
+                self._file_manager.path_on_disk(FileDestinations.LOCAL, payload["path"]))
+            self._index_executor.submit(self.printability_index.remove_folder, payload["path"])
+
+        if "PrinterProfile" in event or event == Events.CONNECTED:
+            self.printer_profile.invalidate()
+            self._invalidate_prevalidation()
+            self._schedule_extruder_reconciliation()
+        elif event.startswith(SPOOL_MANAGER_EVENT_PREFIX):
+            self._spool_manager.invalidate()
+            self._invalidate_prevalidation()
+            self._schedule_printability_refresh()
+
+    def capture_upload_metadata(self, path, file_object, links=None, printer_profile=None, allow_overwrite=False,
+                                *args, **kwargs):
+        """
+        File preprocessor hook, taps uploaded GCODE while it is written so its metadata is known before printing
+        :param path: the path of the file in the storage
+        :param file_object: the uploaded file object
+        :return: the file object to store
+        """
+        if self._upload_capture is None or not valid_file_type(path, type="gcode"):
+            return file_object
+        return self._upload_capture.wrap(path, file_object)
+
+    def _store_upload_metadata(self, path: str) -> None:
+        """
+        Move the metadata captured during an upload into the metadata cache, files that don't match the capture
+        are parsed from disk when the printability index reads them
+        :param path: the path of the added file in the local storage
+        """
+        try:
+            file_path = self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+            metadata = self._upload_capture.pop(path, file_path)
+            if metadata is not None:
+                self.metadata_cache.put(file_path, metadata)
+        except Exception as e:
+            self._logger.warning(f"Could not cache the metadata captured from {path}: {e}")
+
+    def _reset_gate(self) -> None:
+        """
+        Forget the verdict of the previous job so the next job is validated again
+        """
+        with self._validation_lock:
+            self._release_pending_prompt()
+            commands, held = self._take_held_job()
+            self._gate = (validation_gate.idle, None)
+            self._validation_result = None
+            self._validation_path = None
+            self._validation_token = None
+        if held:
+            self._release_job(commands, None)
+
+    def _abandon_pending_job(self) -> None:
+        """
+        Release the hold of a job that is cancelled while its validation waits for the operator
+        """
+        with self._validation_lock:
+            state, job = self._gate
+            if state != validation_gate.pending:
+                return
+            self._release_pending_prompt()
+            commands, held = self._take_held_job()
+            self._gate = (validation_gate.blocked, job)
+        if held:
+            self._release_job(commands, None)
+
+    def _schedule_extruder_reconciliation(self) -> None:
+        """
+        Reconcile the extruders once a burst of printer profile events is over
+        """
+        with self._reconcile_lock:
+            if self._reconcile_timer is not None:
+                self._reconcile_timer.cancel()
+            self._reconcile_timer = threading.Timer(EXTRUDER_RECONCILE_DELAY, self._reconcile_extruders)
+            self._reconcile_timer.daemon = True
+            self._reconcile_timer.start()
+
+    def _reconcile_extruders(self) -> None:
+        """
+        Reconcile the extruders with the printer profile and send the clients the changes
+        """
+        with self._reconcile_lock:
+            self._reconcile_timer = None
+        try:
+            # Writes of update_data refresh the hardware state through its subscription
+            self.extruders.update_data()
+        except Exception:
+            self._logger.exception("Reconciling the extruders with the printer profile failed")
+        # The profile is part of the state view even when no extruder changed
+        self._invalidate_prevalidation()
+        self._push_state_delta()
+        self._schedule_printability_refresh()
+
+    def _on_hardware_change(self, generation: int) -> None:
+        """
+        Discard speculative verdicts after a change to the hardware tables
+        :param generation: the state generation of the change
+        """
+        self._invalidate_prevalidation()
+        self._push_state_delta()
+        self._schedule_printability_refresh()
+
+    def _schedule_printability_refresh(self) -> None:
+        """
+        Move the printability index to the new printer state once a burst of changes is over
+        """
+        if self.printability_index is None:
+            return
+        with self._printability_lock:
+            if self._printability_timer is not None:
+                self._printability_timer.cancel()
+            self._printability_timer = threading.Timer(PRINTABILITY_REFRESH_DELAY, self._refresh_printability)
+            self._printability_timer.daemon = True
+            self._printability_timer.start()
+
+    def _refresh_printability(self) -> None:
+        """
+        Recompute the verdicts the state change affects and send the clients the ones that changed
+        """
+        with self._printability_lock:
+            self._printability_timer = None
+        try:
+            changed = self.printability_index.refresh(self.validator.capture_snapshot())
+        except Exception:
+            self._logger.exception("Refreshing the printability index failed")
+            return
+        if changed:
+            self._plugin_manager.send_plugin_message(
+                self._identifier, dict(type=alert_types.printability, version=self.printability_index.version,
+                                       files=changed))
+
+    def _build_printability_index(self) -> None:
+        """
+        Read the requirements of every local GCODE file and compute the verdicts against the current state
+        """
+        try:
+            for path in self._list_library_files():
+                self.printability_index.update_file(
+                    path, self._file_manager.path_on_disk(FileDestinations.LOCAL, path))
+        except Exception:
+            self._logger.exception("Building the printability index failed")
+        self._refresh_printability()
+
+    def _push_state_delta(self) -> None:
+        """
+        Send the clients what changed since the state they were last sent, a client that missed a delta resyncs
+        """
+        with self._state_push_lock:
+            previous = self._pushed_state
+            state = self._get_state_view()[1]
+            self._pushed_state = state
+            if previous is None:
+                self.send_alert("", alert_types.reload)
+                return
+            delta = state_view.diff_state_views(previous, state)
+            if delta is not None:
+                self._plugin_manager.send_plugin_message(
+                    self._identifier,
+                    dict(delta, type=alert_types.state_delta, active_prompt=self.validator.get_active_prompt()))
+
+    def _invalidate_prevalidation(self) -> None:
+        """
+        Discard speculative verdicts, called whenever state a verdict depends on changes
+        """
+        with self._validation_lock:
+            self._state_generation += 1
+            if self._gate[0] == validation_gate.idle:
+                self._validation_result = None
+                self._validation_path = None
+                self._validation_token = None
+
+    def _prevalidate_selected_file(self) -> None:
+        """
+        Speculatively validate the file that is still selected after a job ended
+        """
+        job = self._printer.get_current_job() or {}
+        file_info = job.get("file") or {}
+        if file_info.get("path") and file_info.get("origin") == FileDestinations.LOCAL:
+            self._schedule_prevalidation(self._file_manager.path_on_disk(FileDestinations.LOCAL, file_info["path"]))
+
+    def _schedule_prevalidation(self, path: str) -> None:
+        """
+        Validate a selected file in the background, so a passing verdict is ready when its job starts
+        :param path: the path of the selected file on disk
+        """
+        with self._validation_lock:
+            if self._gate[0] != validation_gate.idle:
+                return
+            self._prevalidation = self._prevalidation_executor.submit(self._prevalidate, path,
+                                                                      self._state_generation)
+
+    def _prevalidate(self, path: str, generation: int) -> bool:
+        """
+        Validate a file without prompting and hand a passing verdict to the queuing hook
+        Failures are not recorded, the job's first command then validates interactively so the user is asked.
+        :param path: the path of the file on disk
+        :param generation: the state generation the validation started at
+        :return: the verdict
+        """
+        try:
+            file_fingerprint = metadata_cache.fingerprint(path)
+            result = bool(self.validator.check_print(path, interactive=False))
+        except Exception:
+            self._logger.exception(f"Speculative validation of {path} failed")
+            return False
+
+        with self._validation_lock:
+            # Verdicts computed while the state changed are discarded
+            if result and self._gate[0] == validation_gate.idle and generation == self._state_generation:
+                self._validation_path = path
+                self._validation_result = True
+                self._validation_token = (file_fingerprint, generation)
+        self._logger.info(f"Speculative validation of {path} {'passed' if result else 'did not pass'}")
+        return result
+
+    def _is_prevalidation_current(self, path: str) -> bool:
+        """
+        Check that a speculative verdict was computed for the current file contents and state
+        :param path: the path of the file on disk
+        :return: true if the verdict can be used
+        """
+        try:
+            return self._validation_token == (metadata_cache.fingerprint(path), self._state_generation)
+        except (OSError, TypeError):
+            return False
+
+    def _get_selected_file_path(self, comm_instance=None):
+        """Return the selected local job's absolute path, when available."""
+        # During a select-and-print request the state monitor can still contain
+        # the previously selected path. The comm layer is authoritative at the
+        # point where it queues this job's first command.
+        current_file = getattr(comm_instance, "_currentFile", None)
+        is_sd_file_selected = getattr(comm_instance, "isSdFileSelected", None)
+        is_sd_file = bool(is_sd_file_selected and is_sd_file_selected())
+        if is_sd_file:
+            return None
+        if current_file is not None:
+            filename = current_file.getFilename()
+            if filename:
+                return filename
+
+        job = self._printer.get_current_job() or {}
+        file_info = job.get("file") or {}
+        path = file_info.get("path")
+        origin = file_info.get("origin")
+        if path and origin == FileDestinations.LOCAL:
+            return self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+        return None
+
+    def validate_before_queuing(self, comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
+        """Block the first job command until the selected GCODE has passed validation."""
+        # Fast path for the millions of lines of a running job: once this job
+        # has passed, every later command is allowed without tag parsing,
+        # locking or path resolution. The job is identified by the comm
+        # layer's file object, which OctoPrint replaces on every selection.
+        state, job = self._gate
+        if state == validation_gate.passed and getattr(comm_instance, "_currentFile", None) is job:
+            return None
+
+        tags = kwargs.get("tags") or set()
+        is_print_command = "source:job" in tags or "source:file" in tags
+        is_cancellation_command = bool(
+            {"trigger:cancel", "trigger:comm.cancel"} & tags
+            or "script:afterPrintCancelled" in tags
+        )
+        if not is_print_command or is_cancellation_command:
+            return None
+
+        with self._validation_lock:
+            current_job = getattr(comm_instance, "_currentFile", None)
+            state, job = self._gate
+            stale_hold = False
+            if state == validation_gate.idle or job is not current_job:
+                stale_hold = self._start_validation(comm_instance, current_job, state)
+            state = self._gate[0]
+            hold = False
+            if state == validation_gate.pending:
+                # A hold left by the previous job holds this one
+                self._job_held, stale_hold = self._job_held or stale_hold, False
+                hold = not self._job_held and not self._held_commands
+                self._held_commands.append((comm_instance, cmd, cmd_type, tags))
+
+        if stale_hold:
+            self._printer.set_job_on_hold(False)
+
+        if state == validation_gate.passed:
+            return None
+        if state == validation_gate.pending:
+            # Only the first job command gets here, the job is put on hold so the rest of it waits in
+            # OctoPrint's queues while the operator decides and other comm traffic keeps flowing.
+            if hold:
+                self._hold_job(current_job)
+            # A None command suppresses it in OctoPrint's GCODE phase hook.
+            return (None,)
+        # OctoPrint ignores cancellation while still in STARTING. The
+        # hook therefore tries again when the first source:file command
+        # arrives, after the state marker has changed it to PRINTING.
+        self._cancel_blocked_job()
+        return (None,)
+
+    def _start_validation(self, comm_instance, current_job, state: str) -> bool:
+        """
+        Decide the gate of a new job, from a usable speculative verdict, a check without prompts or by starting a
+        validation worker for the prompts. Must be called with the validation lock held.
+        :param comm_instance: the comm instance of the hook call
+        :param current_job: the comm layer's file object of the job
+        :param state: the gate state before the job
+        :return: true if the previous job is still on hold, the caller releases or keeps the hold
+        """
+        stale_hold = False
+        if state != validation_gate.idle:
+            # A new job started before the previous one's end event
+            # was handled, e.g. a queue plugin reacting to PrintDone.
+            self._validation_result = None
+            self._release_pending_prompt()
+            stale_hold = self._take_held_job()[1]
+        try:
+            path = self._get_selected_file_path(comm_instance)
+        except Exception:
+            self._logger.exception("Could not resolve the selected GCODE path")
+            path = None
+
+        if path != self._validation_path:
+            self._validation_path = path
+            self._validation_result = None
+        elif self._validation_result is not None and not self._is_prevalidation_current(path):
+            self._validation_result = None
+        self._validation_token = None
+
+        if self._validation_result is None:
+            self._logger.info("Validating selected GCODE before its first command is queued")
+            # Checks that need no operator are decided right away, the job only waits for a prompt
+            try:
+                if self.validator.check_print(path, interactive=False):
+                    self._validation_result = True
+            except Exception:
+                self._logger.exception("Unexpected error during pre-print validation")
+
+        if self._validation_result is not None:
+            self._gate = (validation_gate.passed if self._validation_result else validation_gate.blocked, current_job)
+            return stale_hold
+
+        self._gate = (validation_gate.pending, current_job)
+        self._held_commands = []
+        self._job_held = False
+        threading.Thread(target=self._run_validation, args=(path, current_job), name="nfv-validation",
+                         daemon=True).start()
+        return stale_hold
+
+    def _run_validation(self, path: str, job) -> None:
+        """
+        Validate a job's file off the comm thread, prompts block this worker instead of command queuing
+        :param path: the path of the file on disk
+        :param job: the comm layer's file object of the job
+        """
+        try:
+            result = bool(self.validator.check_print(path))
+        except Exception:
+            self._logger.exception("Unexpected error during pre-print validation")
+            self.send_alert("Print blocked: an unexpected validation error occurred.", alert_types.error)
+            result = False
+        self._finish_validation(path, job, result)
+
+    def _finish_validation(self, path: str, job, result: bool) -> None:
+        """
+        Resolve a pending gate, the job on hold is released on a pass and cancelled otherwise
+        :param path: the path of the file on disk
+        :param job: the comm layer's file object of the job
+        :param result: the verdict
+        """
+        with self._validation_lock:
+            if self._gate != (validation_gate.pending, job):
+                # The job ended while it was validated
+                return
+            self._validation_result = result
+            if result:
+                # The operator's decision covers the state it was made on
+                try:
+                    self._validation_token = (metadata_cache.fingerprint(path), self._state_generation)
+                except (OSError, TypeError):
+                    self._validation_token = None
+            self._gate = (validation_gate.passed if result else validation_gate.blocked, job)
+            # Until the hook has put the job on hold it releases the job itself, see _hold_job
+            commands, held = self._take_held_job()
+        if held:
+            self._release_job(commands, result)
+
+    def _hold_job(self, job) -> None:
+        """
+        Put a job on hold while its validation waits for the operator
+        :param job: the comm layer's file object of the job
+        """
+        on_hold = self._printer.set_job_on_hold(True, blocking=False) is not False
+        with self._validation_lock:
+            state = self._gate[0] if self._gate[1] is job else None
+            if on_hold and state == validation_gate.pending:
+                self._job_held = True
+                return
+            if state == validation_gate.pending:
+                self._logger.warning("Could not put the job on hold while it is validated, cancelling it")
+                self.send_alert("Print blocked: the job could not be held while it is validated.",
+                                alert_types.error)
+                self._release_pending_prompt()
+                self._gate = (validation_gate.blocked, job)
+                state = validation_gate.blocked
+            commands, self._held_commands = self._held_commands, []
+        if state == validation_gate.passed:
+            self._send_held_commands(commands)
+        elif state == validation_gate.blocked:
+            self._cancel_blocked_job()
+        if on_hold:
+            self._printer.set_job_on_hold(False)
+
+    def _take_held_job(self) -> Tuple[List[Tuple], bool]:
+        """
+        Take the held commands of the job on hold, the lock must be held
+        :return: (the held commands, true if the job is on hold and must be released by the caller)
+        """
+        if not self._job_held:
+            return [], False
+        commands, self._held_commands = self._held_commands, []
+        self._job_held = False
+        return commands, True
+
+    def _release_job(self, commands: List[Tuple], result: Union[bool, None]) -> None:
+        """
+        Take a job off hold
+        :param commands: the job commands the hook held
+        :param result: true to send the held commands, false to cancel the job, none if the job is gone
+        """
+        if result:
+            self._send_held_commands(commands)
+        elif result is not None:
+            self._cancel_blocked_job()
+        self._printer.set_job_on_hold(False)
+
+    @staticmethod
+    def _send_held_commands(commands: List[Tuple]) -> None:
+        # Queued ahead of the file, the passed gate lets them through the hook
+        for comm_instance, cmd, cmd_type, tags in commands:
+            comm_instance.sendCommand(cmd, cmd_type=cmd_type, part_of_job=True, tags=tags)
+
+    def _cancel_blocked_job(self) -> None:
+        is_cancelling = getattr(self._printer, "is_cancelling", lambda: False)
+        if not is_cancelling():
+            self._printer.cancel_print()
+
+    def _release_pending_prompt(self) -> None:
+        """
+        Cancel the prompt of a validation whose job is gone
+        """
+        if self._gate[0] == validation_gate.pending and self.validator is not None:
+            self.validator.update_filament_wait_status(validate.filament_timeout.cancel)
+
+    # ~~ TemplatePlugin mixin
+
+    def get_template_configs(self) -> List[Dict[str, str | bool]]:
+        """
+        get the html templete for the plugin
+        :return: the html template
+        """
+        return [
+            dict(type="settings", template="nozzle_filament_validator_page.jinja2", custom_bindings=False)  # Custom
+            # page
+        ]
+
+    # ~~ AssetPlugin mixin
+
+    def get_assets(self) -> Dict[str, List[str]]:
+        """
+        returns the web assets for the plugin
+        :return: the web assets
+        """
+        return {
+            "js": ["js/Nozzle_Filament_Validator.js", "js/nozzles.js", "js/build_plate.js", "js/filament.js",
+                   "js/extruders.js"],
+            "css": ["css/Nozzle_Filament_Validator.css"],
+        }
+
+    def on_after_startup(self):
+        self._logger.info("NozzleFilamentValidatorPlugin initialized")
+        # Drop metadata of files changed or deleted while OctoPrint was down
+        threading.Thread(target=self.metadata_cache.prune, name="nfv-metadata-prune", daemon=True).start()
+        self._index_executor.submit(self._build_printability_index)
+
+    def on_shutdown(self):
+        self._prevalidation_executor.shutdown(wait=False)
+        self._index_executor.shutdown(wait=False)
+        if self._library_validation is not None:
+            self._library_validation.cancel()
+        with self._reconcile_lock:
+            if self._reconcile_timer is not None:
+                self._reconcile_timer.cancel()
+        with self._printability_lock:
+            if self._printability_timer is not None:
+                self._printability_timer.cancel()
+        if self.hardware_state is not None:
+            self.hardware_state.close()
+        if self._spool_manager is not None:
+            self._spool_manager.close()
+        if self.validator is not None:
+            self.validator.close()
+        if self.parse_worker is not None:
+            self.parse_worker.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.flush()
+        db.close_all()
+
+    # ~~ SettingsPlugin mixin
+
+    def get_settings_defaults(self):
+        return {
+            "metadata_cache_max_entries": 5000,
+            "metadata_cache_max_bytes": 8 * 1024 * 1024,
+            "spool_manager_deadline": 2.0,
+            "spool_manager_failure_threshold": 3,
+            "spool_manager_reset_timeout": 30.0,
+            "parse_in_worker_process": False,
+            "parse_worker_timeout": 10.0,
+            "library_validation_workers": library_validation.LIBRARY_VALIDATION_WORKERS,
+        }
+
+    # ~~ Software update hook
+
+    def get_update_information(self):
+        """
+        Get the update information for the plugin so it can be auto updated by the software update plugin
+        :return: the update information
+        """
+
+        return dict(
+            Nozzle_Filament_Validator=dict(
+                displayName="Nozzle Filament Validator",
+                displayVersion=self._plugin_version,
+
+                # version check: GitHub repository
+                type="github_release",
+                user="Rylan-Meilutis",
+                repo="OctoPrint-Nozzle-Filament-Validator",
+                current=self._plugin_version,
+                stable_branch=dict(
+                    name="Stable",
+                    branch="main",
+                    commitish=["main"]
+                ),
+                prerelease_branches=[
+                    dict(
+                        name="Release Candidate",
+                        branch="rc",
+                        commitish=["rc", "main"]
+                    ),
+                    dict(
+                        name="Development",
+                        branch="dev",
+                        commitish=["dev", "rc", "main"]
+                    )
+                ],
+
+                # update method: pip
+                pip="https://github.com/Rylan-Meilutis/OctoPrint-Nozzle-Filament-Validator/archive/{"
+                    "target_version}.zip"
+            )
+        )
@@ -0,0 +1,112 @@
+import collections
+import logging
+import os
+import threading
+from typing import Any, Dict, Union
+
+from octoprint.filemanager.util import LineProcessorStream, StreamWrapper
+
+from octoprint_nfv.validate import TAIL_LINES, extract_metadata
+
+
+class metadata_capture_stream(LineProcessorStream):
+    """
+    Stream that passes an upload through unchanged while remembering its last lines
+    """
+
+    def __init__(self, input_stream: Any, num_lines: int = TAIL_LINES) -> None:
+        """
+        Constructor
+        :param input_stream: the stream of the uploaded file
+        :param num_lines: the number of lines to keep, the same window parse_gcode reads
+        """
+        super().__init__(input_stream)
+        self._num_lines = num_lines
+        self._tail = collections.deque(maxlen=num_lines)
+        # the number of bytes that passed through the stream
+        self.size = 0
+
+    def process_line(self, line: bytes) -> bytes:
+        self._tail.append(line)
+        self.size += len(line)
+        return line
+
+    def matches(self, disk_path: str) -> bool:
+        """
+        Check if a file on disk is what passed through the stream, a later preprocessor may have rewritten it
+        :param disk_path: the path of the stored file
+        :return: true if the file has the same size and ends with the lines the metadata is extracted from
+        """
+        tail = b"".join(self._tail)
+        with open(disk_path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() != self.size:
+                return False
+            file.seek(self.size - len(tail))
+            return file.read() == tail
+
+    def metadata(self) -> Dict[str, Any]:
+        """
+        Extract the validation metadata from the lines seen so far
+        :return: the metadata in the format returned by parse_gcode
+        """
+        lines = list(self._tail)
+        # parse_gcode reads the text after the num_lines-th newline from the
+        # end, which leaves out the oldest line if the file ends with one.
+        if len(lines) == self._num_lines and lines[-1].endswith(b"\n"):
+            lines = lines[1:]
+        text = b"".join(lines).decode("utf-8", errors="replace").replace("\r\n", "\n")
+        return extract_metadata(text.split("\n"))
+
+
+class upload_metadata_capture:
+    """
+    Class to handle the metadata captured from uploads until the files are added to the storage
+    """
+
+    def __init__(self, logger: logging.Logger, max_pending: int = 32) -> None:
+        """
+        Constructor
+        :param logger: the logger object
+        :param max_pending: the maximum number of uploads remembered before their FileAdded event
+        """
+        self._logger = logger
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+
+    def wrap(self, path: str, file_object: Any) -> Any:
+        """
+        Wrap an uploaded file so its metadata is captured while it is written
+        :param path: the path of the file in the storage
+        :param file_object: the file object passed to the preprocessor hook
+        :return: the wrapped file object
+        """
+        stream = metadata_capture_stream(file_object.stream())
+        with self._lock:
+            self._pending.pop(path, None)
+            self._pending[path] = stream
+            # Uploads that failed never get a FileAdded event
+            while len(self._pending) > self._max_pending:
+                self._pending.popitem(last=False)
+        return StreamWrapper(file_object.filename, stream)
+
+    def pop(self, path: str, disk_path: str) -> Union[Dict[str, Any], None]:
+        """
+        Get the metadata captured for an added file
+        :param path: the path of the file in the storage
+        :param disk_path: the path of the stored file
+        :return: the metadata or none if the file wasn't captured or the stored file differs from the captured one
+        """
+        with self._lock:
+            stream = self._pending.pop(path, None)
+        if stream is None:
+            return None
+        try:
+            if not stream.matches(disk_path):
+                self._logger.debug(f"{path} was changed after its metadata was captured, it is parsed from disk")
+                return None
+            return stream.metadata()
+        except Exception as e:
+            self._logger.warning(f"Could not extract the metadata captured from {path}: {e}")
+            return None
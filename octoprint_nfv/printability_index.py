@@ -0,0 +1,228 @@
+import logging
+import threading
+from typing import Any, Dict, FrozenSet, Hashable, NamedTuple, Set, Union
+
+from octoprint_nfv.rules import validation_snapshot
+
+# Metadata the rules read, everything else parse_gcode returns is left out of the requirement records
+REQUIREMENT_KEYS = ("printer_model", "skip_validation", "single_extruder_multi_material", "nozzle_size",
+                    "filament_type", "filament_used", "filament_notes")
+
+
+class file_requirements(NamedTuple):
+    """
+    Class to handle what a GCODE file needs from the printer, kept so its verdict can be recomputed without the file
+    """
+    # the path of the file on disk
+    disk_path: str
+    # the metadata the rules read, see REQUIREMENT_KEYS
+    metadata: Dict[str, Any]
+    # the facets of the printer state the verdict depends on, see snapshot_facets
+    facets: FrozenSet[Hashable]
+
+
+def requirement_facets(metadata: Dict[str, Any]) -> FrozenSet[Hashable]:
+    """
+    Get the facets of the printer state the verdict of a file depends on
+    :param metadata: the metadata of the file
+    :return: the facets, empty when the verdict doesn't depend on the printer state
+    """
+    nozzles = metadata.get("nozzle_size")
+    filament_types = metadata.get("filament_type")
+    filament_used = metadata.get("filament_used")
+    # Skipped files always pass and incomplete metadata always fails
+    if metadata.get("skip_validation") or not (nozzles and filament_types and filament_used
+                                               and metadata.get("printer_model")):
+        return frozenset()
+    if not len(nozzles) == len(filament_types) == len(filament_used):
+        return frozenset()
+    try:
+        [float(value) for value in nozzles]
+        tools = [index for index, used in enumerate(filament_used) if used is not None and float(used) != 0]
+    except (TypeError, ValueError):
+        return frozenset()
+
+    facets = {"model", "build_plate", "spools"}
+    for index in tools:
+        facets.update((("nozzle", index), ("filament", index), ("spool", index)))
+    return frozenset(facets)
+
+
+def snapshot_facets(snapshot: validation_snapshot) -> Dict[Hashable, Any]:
+    """
+    Split a snapshot into the facets verdicts depend on, a tool missing from a facet reads as none like in the rules
+    :param snapshot: the snapshot
+    :return: the value of every facet
+    """
+    loaded_filaments = snapshot.loaded_filaments
+    per_tool = isinstance(loaded_filaments, tuple)
+    facets = {
+        "model": (snapshot.printer_model, snapshot.extruder_count),
+        "build_plate": snapshot.build_plate_filaments,
+        "spools": (snapshot.check_filament_types, snapshot.check_spool_ids, snapshot.loaded_filaments_error,
+                   len(loaded_filaments) if per_tool else loaded_filaments),
+    }
+    for index, size in enumerate(snapshot.nozzle_sizes):
+        facets[("nozzle", index)] = size
+    if per_tool:
+        for index, filament_type in enumerate(loaded_filaments):
+            facets[("filament", index)] = filament_type
+    for index, name in enumerate(snapshot.spool_names):
+        facets[("spool", index)] = name
+    return facets
+
+
+def changed_facets(previous: Dict[Hashable, Any], current: Dict[Hashable, Any]) -> Set[Hashable]:
+    """
+    Find the facets that differ between two snapshots
+    :param previous: the facets of the previous snapshot
+    :param current: the facets of the new snapshot
+    :return: the changed facets
+    """
+    return {facet for facet in previous.keys() | current.keys() if previous.get(facet) != current.get(facet)}
+
+
+class printability_index:
+    """
+    Class to handle the printable verdict of every local file against the current printer state, only the verdicts
+    that depend on a changed part of the state are recomputed
+    """
+
+    def __init__(self, validator: Any, metadata_cache: Any, logger: logging.Logger) -> None:
+        """
+        Constructor
+        :param validator: the validator, its rules compute the verdicts
+        :param metadata_cache: the metadata cache the requirement records are read from
+        :param logger: the logger object
+        """
+        self._validator = validator
+        self._metadata_cache = metadata_cache
+        self._logger = logger
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._facets = {}
+        self._records = {}
+        self._verdicts = {}
+        # the files that depend on a facet
+        self._dependents = {}
+        # increases whenever a verdict changes, so clients can tell whether their copy is current
+        self.version = 0
+        self.evaluations = 0
+
+    def _evaluate(self, path: str) -> bool:
+        """
+        Compute the verdict of a file against the current snapshot, the lock must be held
+        :param path: the path of the file in the storage
+        :return: true if the verdict changed
+        """
+        record = self._records[path]
+        try:
+            printable, reasons = self._validator.explain_metadata(record.metadata, self._snapshot)
+        except Exception as e:
+            self._logger.exception(f"Evaluating the printability of {path} failed")
+            printable, reasons = False, [f"Validation failed: {e}"]
+        self.evaluations += 1
+        verdict = (printable, tuple(reasons))
+        if self._verdicts.get(path) == verdict:
+            return False
+        self._verdicts[path] = verdict
+        self.version += 1
+        return True
+
+    def _unlink(self, path: str) -> None:
+        record = self._records.pop(path, None)
+        self._verdicts.pop(path, None)
+        if record is None:
+            return
+        for facet in record.facets:
+            dependents = self._dependents.get(facet)
+            if dependents is not None:
+                dependents.discard(path)
+                if not dependents:
+                    del self._dependents[facet]
+
+    def update_file(self, path: str, disk_path: str) -> None:
+        """
+        Read the requirements of an added or changed file and compute its verdict
+        :param path: the path of the file in the storage
+        :param disk_path: the path of the file on disk
+        """
+        try:
+            metadata = self._metadata_cache.get_or_parse(disk_path)
+        except Exception as e:
+            self._logger.warning(f"Could not read the metadata of {path} for the printability index: {e}")
+            self.remove_file(path)
+            return
+        metadata = {key: metadata.get(key) for key in REQUIREMENT_KEYS}
+        record = file_requirements(disk_path, metadata, requirement_facets(metadata))
+        with self._lock:
+            self._unlink(path)
+            self._records[path] = record
+            for facet in record.facets:
+                self._dependents.setdefault(facet, set()).add(path)
+            if self._snapshot is not None:
+                self._evaluate(path)
+
+    def remove_file(self, path: str) -> None:
+        """
+        Remove a file from the index
+        :param path: the path of the file in the storage
+        """
+        with self._lock:
+            if path in self._records:
+                self._unlink(path)
+                self.version += 1
+
+    def remove_folder(self, folder_path: str) -> None:
+        """
+        Remove every file of a folder from the index
+        :param folder_path: the path of the folder in the storage
+        """
+        prefix = folder_path.rstrip("/") + "/"
+        with self._lock:
+            for path in [path for path in self._records if path.startswith(prefix)]:
+                self._unlink(path)
+                self.version += 1
+
+    def refresh(self, snapshot: validation_snapshot) -> Dict[str, Dict[str, Any]]:
+        """
+        Move the index to a new snapshot, only the files that depend on a changed facet are evaluated again
+        :param snapshot: the new snapshot
+        :return: the verdicts that changed, by path
+        """
+        facets = snapshot_facets(snapshot)
+        with self._lock:
+            if self._snapshot is None:
+                affected = set(self._records)
+            else:
+                affected = set()
+                for facet in changed_facets(self._facets, facets):
+                    affected |= self._dependents.get(facet, set())
+            self._snapshot = snapshot
+            self._facets = facets
+            changed = [path for path in affected if self._evaluate(path)]
+            return {path: self._verdict(path) for path in changed}
+
+    def _verdict(self, path: str) -> Dict[str, Any]:
+        printable, reasons = self._verdicts[path]
+        return dict(printable=printable, reasons=list(reasons))
+
+    def query(self, folder_path: Union[str, None] = None) -> Dict[str, Any]:
+        """
+        Get the verdicts of the files of a folder
+        :param folder_path: the path of the folder in the storage, every file when not given
+        :return: the version of the index and the verdicts by path
+        """
+        prefix = folder_path.rstrip("/") + "/" if folder_path else ""
+        with self._lock:
+            return dict(version=self.version,
+                        files={path: self._verdict(path) for path in self._verdicts if path.startswith(prefix)})
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the index
+        :return: the counters
+        """
+        with self._lock:
+            return dict(files=len(self._records), verdicts=len(self._verdicts), facets=len(self._dependents),
+                        evaluations=self.evaluations, version=self.version)
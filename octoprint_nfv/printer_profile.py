@@ -0,0 +1,80 @@
+import threading
+from typing import Any, Dict, NamedTuple, Union
+
+from octoprint_nfv.rules import normalize_printer_model
+
+
+class printer_profile_view(NamedTuple):
+    """
+    Class to handle the parts of the printer profile the plugin reads, parsed once per profile change
+    """
+    model: Union[str, None]
+    # the lowercase model, none if the profile has no model
+    model_key: Union[str, None]
+    # the lowercase model without the input shaping suffix, none if the profile has no model
+    base_model_key: Union[str, None]
+    input_shaping: bool
+    tool_count: int
+    shared_nozzle: bool
+
+    @property
+    def is_multi_tool_head(self) -> bool:
+        """
+        Check if the printer has multiple tool heads that use different nozzles
+        :return: true if the printer has multiple tool heads
+        """
+        return self.tool_count > 1 and not self.shared_nozzle
+
+
+def build_profile_view(profile: Dict[str, Any]) -> printer_profile_view:
+    """
+    Parse a printer profile
+    :param profile: the printer profile as returned by the printer profile manager
+    :return: the parsed profile
+    """
+    model = profile.get("model")
+    model_key, base_model_key, input_shaping = normalize_printer_model(model) if model else (None, None, False)
+    return printer_profile_view(model=model, model_key=model_key, base_model_key=base_model_key,
+                                input_shaping=input_shaping, tool_count=profile["extruder"]["count"],
+                                shared_nozzle=bool(profile["extruder"]["sharedNozzle"]))
+
+
+class printer_profile_cache:
+    """
+    Class to handle the parsed current printer profile, kept until a printer profile event invalidates it
+    """
+
+    def __init__(self, printer_profile_manager: Any) -> None:
+        """
+        Constructor
+        :param printer_profile_manager: the printer profile manager of OctoPrint
+        """
+        self._printer_profile_manager = printer_profile_manager
+        self._lock = threading.Lock()
+        self._view = None
+        self._version = 0
+
+    def get(self) -> printer_profile_view:
+        """
+        Get the parsed current printer profile
+        :return: the parsed profile
+        """
+        view = self._view
+        if view is not None:
+            return view
+        with self._lock:
+            version = self._version
+        view = build_profile_view(self._printer_profile_manager.get_current_or_default())
+        with self._lock:
+            # A profile read while the cache was invalidated may be outdated and is not kept
+            if version == self._version:
+                self._view = view
+        return view
+
+    def invalidate(self) -> None:
+        """
+        Forget the parsed profile, called when the printer profile changes
+        """
+        with self._lock:
+            self._version += 1
+            self._view = None
@@ -0,0 +1,330 @@
+import functools
+import re
+from typing import Any, List, NamedTuple, Sequence, Tuple, Union
+
+from octoprint_nfv.constants import alert_types
+
+# (message, alert type) of an alert a rule wants shown, the validator decides whether to send it
+Finding = Tuple[str, str]
+
+
+class validation_snapshot(NamedTuple):
+    """
+    Class to handle the frozen state one validation checks against, captured once before any rule runs
+    """
+    # the printer model of the OctoPrint printer profile
+    printer_model: Union[str, None]
+    # the number of extruders of the printer profile
+    extruder_count: int
+    # the installed nozzle size of every extruder, indexed by tool index
+    nozzle_sizes: Tuple[Union[float, None], ...]
+    # the filaments the selected build plate supports, none if no build plate is selected
+    build_plate_filaments: Union[Tuple[str, ...], None]
+    check_filament_types: bool
+    # the loaded filament types as returned by SpoolManager, a sentinel int or none when unavailable
+    loaded_filaments: Any
+    # the error raised while the loaded filaments were read
+    loaded_filaments_error: Union[str, None]
+    check_spool_ids: bool
+    # the selected spool name of every tool
+    spool_names: Tuple[Union[str, None], ...]
+    timeout: int
+
+
+class tool_evaluation(NamedTuple):
+    """
+    Class to handle the result of the per-tool rules
+    """
+    # the override prompt message of the first failing tool, none if no tool failed
+    failure: Union[str, None]
+    nozzle_passed: bool
+    filament_passed: bool
+    findings: List[Finding]
+
+
+def ends_with_mmu(string: str) -> bool:
+    """
+    Check if the string ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
+    :param string: the string to check
+    :return: if the string ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
+    """
+    match_1 = re.match(r".*mmu[23](s)?$", string)
+    match_2 = re.match(r".*mmu[23](s)?is$", string)
+    match_3 = re.match(r".*ismmu[23](s)?$", string)
+    return bool(match_1 or match_2 or match_3)
+
+
+def match_ends_with_mmu(string: str) -> Union[str, None]:
+    """
+    Match the string that ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
+    :param string: the string to match
+    :return: the matched string
+    """
+    match = re.match(r"^(.*?)(is)?(mmu[23](s)?)(is)?$", string)
+    if match:
+        return match.group(1)
+    else:
+        return None
+
+
+def remove_mmu_from_end(text: str) -> str:
+    """
+    Remove mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis from the end of the string
+    :param text: the string to remove mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis from
+    :return: the string with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis removed
+    """
+    if bool(re.match(r".*mmu[23](s)?$|^mmu[23](s)?$", text)):
+        return re.sub(r'mmu[23](s)?$', '', text)
+    elif bool(re.match(r".*mmu[23](s)?is$|^mmu[23](s)?is$", text)):
+        return re.sub(r'mmu[23](s)?is$', 'is', text)
+    elif bool(re.match(r".*ismmu[23](s)?$|^ismmu[23](s)?$", text)):
+        return re.sub(r'ismmu[23](s)?$', 'is', text)
+    else:
+        return text
+
+
+def remove_is_from_end(text: str) -> str:
+    """
+    Remove 'is' from the end of the string unless it is followed by 'mmu', a number, and optionally 's'
+    :param text: the text to remove 'is' from
+    :return: the text with 'is' removed
+    """
+    if bool(re.search(r"ismmu[23](s)?", text)):
+        return re.sub(r'is(?=mmu[23](s)?)', '', text)
+    elif bool(re.search(r"is$", text)):
+        return re.sub(r'is$', '', text)
+    else:
+        return text
+
+
+def normalize_loaded_filaments(loaded_filaments: Any, tool_count: int) -> List[Any]:
+    """
+    Normalize the SpoolManager sentinel values to one entry per tool, so filament comparison can be skipped
+    while nozzle and build plate are still checked
+    :param loaded_filaments: the loaded filaments as returned by SpoolManager
+    :param tool_count: the number of tools in the GCODE
+    :return: the loaded filament of every tool
+    """
+    if isinstance(loaded_filaments, int):
+        return [loaded_filaments] * tool_count
+    elif loaded_filaments is None:
+        return [None] * tool_count
+    return list(loaded_filaments)
+
+
+@functools.lru_cache(maxsize=64)
+def normalize_printer_model(model: str) -> Tuple[str, str, bool]:
+    """
+    Normalize a printer model for comparison, the result is cached per model
+    :param model: the printer model
+    :return: (the lowercase model, the lowercase model without the input shaping suffix, true if the model supports
+    input shaping)
+    """
+    model = model.lower()
+    return model, remove_is_from_end(model), remove_mmu_from_end(model).endswith("is")
+
+
+def check_printer_model(gcode_model: Union[str, None], profile_model: Union[str, None]) -> Tuple[bool, List[Finding]]:
+    """
+    Check if the printer model in the GCODE matches the printer model set in OctoPrint
+    :param gcode_model: the printer model in the GCODE
+    :param profile_model: the printer model of the printer profile
+    :return: (true if the printer model passes the check, findings)
+    """
+    if gcode_model is None or gcode_model == "":
+        return True, [("No printer model found in GCODE, printer model checking won't be performed",
+                       alert_types.info)]
+
+    elif profile_model is None or profile_model == "":
+        return True, [("No printer model set in OctoPrint, printer model checking won't be performed",
+                       alert_types.info)]
+
+    findings = []
+    profile_key, profile_base_key, profile_input_shaping = normalize_printer_model(profile_model)
+    if gcode_model.lower() != profile_key:
+        if profile_input_shaping:
+            if not remove_mmu_from_end(gcode_model.lower()).endswith("is"):
+                findings.append(("Printing with non InputShaping profile on a printer that supports input shaping",
+                                 alert_types.info))
+
+        if profile_base_key != gcode_model.lower():
+            findings.append((f"Validation warning: Incorrect printer model, {gcode_model} found in gcode but "
+                             f"{profile_model} is set.", alert_types.error))
+            return False, findings
+    return True, findings
+
+
+def check_mmu(printer_model: str, nozzles: Sequence[str], filament_types: Sequence[str],
+              filament_used: Sequence[str], extruder_count: int) -> Tuple[bool, bool, List[Finding]]:
+    """
+    Check if using an mmu and handle it accordingly
+    :param printer_model: the printer model from the GCODE
+    :param nozzles: the nozzles from the GCODE
+    :param filament_types: the filament types from the GCODE
+    :param filament_used: the filament used from the GCODE
+    :param extruder_count: the number of extruders of the printer
+    :return: (true if the check passed, true in mmu single mode, findings)
+    """
+    findings = []
+    mmu_single_mode = False
+    if (printer_model and ends_with_mmu(printer_model.lower()) and len(nozzles) == 1
+            and len(filament_types) == 1 and len(filament_used) == 1):
+        mmu_single_mode = True
+        findings.append(("MMU single mode detected, skipping filament checks, please make sure you pick a tool with "
+                         f"{filament_types[0]} filament", alert_types.info))
+    # Check if the number of nozzles in the GCODE is longer than the number of extruders on the printer
+    if len(nozzles) > extruder_count:
+        findings.append((f"Number of nozzles ({len(nozzles)}) in the gcode is longer than the number of extruders "
+                         f"on your machine ({extruder_count})", alert_types.error))
+        return False, mmu_single_mode, findings
+
+    return True, mmu_single_mode, findings
+
+
+def check_num_filaments(loaded_filaments: Sequence[Any], filament_types: Sequence[str],
+                        filament_used: Sequence[str]) -> Tuple[bool, List[Finding]]:
+    """
+    Check the number of filaments in the GCODE
+    :param loaded_filaments: the normalized loaded filaments
+    :param filament_types: the filament types from the GCODE
+    :param filament_used: the filament used from the GCODE
+    :return: (true if the check passed, findings)
+    """
+    # tools that use no filament don't need a loaded filament
+    needed_fil_length = sum(1 for used in filament_used if used is None or float(used) != 0)
+    if needed_fil_length > len(loaded_filaments):
+        return False, [(f"Loaded filaments ({len(loaded_filaments)}) is shorter than the number specified in the "
+                        f"gcode ({len(filament_types)})", alert_types.error)]
+    return True, []
+
+
+def check_num_extruders(nozzles: Sequence[str], semm: bool, extruder_count: int) -> Tuple[bool, List[Finding]]:
+    """
+    Check the number of extruders in the GCODE
+    :param nozzles: the nozzles from the GCODE
+    :param semm: Single Extruder Multi Material
+    :param extruder_count: the number of extruders of the printer
+    :return: (true if the check passed, findings)
+    """
+    if len(nozzles) > extruder_count:
+        return False, [(f"Number of extruders in gcode ({len(nozzles)}) is Larger than the number specified in the "
+                        f"config ({extruder_count})", alert_types.error)]
+    elif len(nozzles) < extruder_count and not semm:
+        return False, [(f"Number of extruders in gcode ({len(nozzles)}) is shorter than the number specified in the "
+                        f"config ({extruder_count}). Print blocked.", alert_types.error)]
+    return True, []
+
+
+def check_filament_type(index: int, loaded_filament: Any, filament_type: Union[str, None],
+                        filament_passed: bool, mmu_single_mode: bool) -> Tuple[bool, bool, List[Finding]]:
+    """
+    Check the filament type of one tool
+    :param index: the index of the extruder
+    :param loaded_filament: the filament loaded in the extruder
+    :param filament_type: the filament type from the GCODE
+    :param filament_passed: the state of filament_passed
+    :param mmu_single_mode: whether the printer is in mmu single mode
+    :return: (filament_passed, check_passed, findings)
+    """
+    if mmu_single_mode or not filament_passed:
+        return filament_passed, True, []
+
+    if filament_type is None:
+        return False, True, [("No filament alert_type found in GCODE, error checking won't be performed",
+                              alert_types.info)]
+    elif loaded_filament is None:
+        return filament_passed, True, [("No filament loaded, error checking won't be performed", alert_types.info)]
+    elif loaded_filament == -1:
+        return filament_passed, True, [("Spool Manager plugin is not installed. Filament alert_type will not be "
+                                        "checked.", alert_types.info)]
+    elif loaded_filament == -2:
+        return filament_passed, True, [("Error retrieving loaded filament, filament error checking won't be "
+                                        "performed", alert_types.info)]
+
+    if filament_type.lower() != str(loaded_filament).lower():
+        return filament_passed, False, [(f"Validation warning: Incorrect filament type on extruder {index + 1}. "
+                                         f"expected {filament_type}, but {loaded_filament} is currently loaded",
+                                         alert_types.error)]
+    return filament_passed, True, []
+
+
+def check_nozzle(index: int, gcode_size: Union[str, None], installed_size: Union[float, None],
+                 nozzle_passed: bool) -> Tuple[bool, bool, List[Finding]]:
+    """
+    Check the nozzle size of one tool
+    :param index: index of the extruder
+    :param gcode_size: the nozzle size from the GCODE
+    :param installed_size: the nozzle size installed in the extruder
+    :param nozzle_passed: current state of nozzle_passed
+    :return: (nozzle_passed, check_passed, findings)
+    """
+    if not nozzle_passed:
+        return nozzle_passed, True, []
+
+    if gcode_size is None:
+        return False, True, [("No nozzle size found in GCODE, error checking won't be performed", alert_types.info)]
+    elif installed_size is None:
+        return False, True, [(f"No nozzle selected for extruder {index + 1}, error checking won't be performed",
+                              alert_types.info)]
+
+    if float(gcode_size) != float(installed_size):
+        return nozzle_passed, False, [(f"Validation warning: Incorrect nozzle size on extruder {index + 1}. expected "
+                                       f"{gcode_size}mm nozzle, but {installed_size}mm nozzle is currently installed",
+                                       alert_types.error)]
+    return nozzle_passed, True, []
+
+
+def check_build_plate(filament_type: Union[str, None],
+                      build_plate_filaments: Union[Sequence[str], None]) -> Tuple[bool, List[Finding]]:
+    """
+    Check if the build plate is compatible with the filament of one tool
+    :param filament_type: the filament type from the GCODE
+    :param build_plate_filaments: the filaments the selected build plate supports
+    :return: (true if the check passed, findings)
+    """
+    if filament_type is not None and (build_plate_filaments is None or filament_type not in build_plate_filaments):
+        return False, [(f"Validation warning: Incompatible build plate, current plate doesn't support "
+                        f"{filament_type}", alert_types.error)]
+    return True, []
+
+
+def evaluate_tools(snapshot: validation_snapshot, tools: Sequence[int], nozzles: Sequence[str],
+                   filament_types: Sequence[str], loaded_filaments: Sequence[Any],
+                   mmu_single_mode: bool) -> tool_evaluation:
+    """
+    Run the filament type, nozzle and build plate rules over all used tools in one pass
+    :param snapshot: the state to check against
+    :param tools: the indexes of the tools the GCODE uses
+    :param nozzles: the nozzles from the GCODE
+    :param filament_types: the filament types from the GCODE
+    :param loaded_filaments: the normalized loaded filaments
+    :param mmu_single_mode: whether the printer is in mmu single mode
+    :return: the evaluation, stopped at the first failing tool
+    """
+    nozzle_passed = True
+    filament_passed = True
+    findings = []
+    for index in tools:
+        if snapshot.check_filament_types:
+            loaded_filament = loaded_filaments[index] if index < len(loaded_filaments) else None
+            filament_passed, passed, tool_findings = check_filament_type(
+                index, loaded_filament, filament_types[index], filament_passed, mmu_single_mode)
+            findings += tool_findings
+            if not passed:
+                return tool_evaluation(f"The loaded filament type does not match the GCODE on extruder {index + 1}.",
+                                       nozzle_passed, filament_passed, findings)
+
+        installed_size = snapshot.nozzle_sizes[index] if index < len(snapshot.nozzle_sizes) else None
+        nozzle_passed, passed, tool_findings = check_nozzle(index, nozzles[index], installed_size, nozzle_passed)
+        findings += tool_findings
+        if not passed:
+            return tool_evaluation(f"The installed nozzle does not match the GCODE on extruder {index + 1}.",
+                                   nozzle_passed, filament_passed, findings)
+
+        passed, tool_findings = check_build_plate(filament_types[index], snapshot.build_plate_filaments)
+        findings += tool_findings
+        if not passed:
+            return tool_evaluation(f"The selected build plate is incompatible with extruder {index + 1}'s filament.",
+                                   nozzle_passed, filament_passed, findings)
+
+    return tool_evaluation(None, nozzle_passed, filament_passed, findings)
@@ -24,4 +24,10 @@ CREATE TABLE IF NOT EXISTS filament_data
 (
     id   REAL PRIMARY KEY,
     data INTEGER
-);
\ No newline at end of file
+);
+CREATE TABLE IF NOT EXISTS state_generation
+(
+    id         INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO state_generation (id, generation) VALUES (1, 0);
@@ -1,23 +1,201 @@
 import json
 import logging
-from typing import Any, List, Dict, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, List, Dict, NamedTuple, Union
 
 from octoprint.server import app
 
+from octoprint_nfv.constants import circuit_state
+
+# Prefix of the events fired by the SpoolManager plugin, e.g. plugin_spoolmanager_spool_selected
+SPOOL_MANAGER_EVENT_PREFIX = "plugin_spoolmanager_"
+# Seconds a fetched spool selection is reused, SpoolManager events discard it earlier
+SPOOL_SELECTION_TTL = 2.0
+# Seconds a call into the SpoolManager may take before it counts as failed
+SPOOL_MANAGER_DEADLINE = 2.0
+# Failed or slow calls in a row that open the circuit breaker
+BREAKER_FAILURE_THRESHOLD = 3
+# Seconds the circuit breaker stays open before one trial call is let through
+BREAKER_RESET_TIMEOUT = 30.0
+
 
 class SpoolManagerException(Exception):
     pass
 
 
+class circuit_breaker:
+    """
+    Class to handle suspending calls to a dependency after repeated failures
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT) -> None:
+        """
+        Constructor
+        :param failure_threshold: failed calls in a row that open the breaker
+        :param reset_timeout: seconds the breaker stays open before a trial call
+        """
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = circuit_state.closed
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def allow(self) -> bool:
+        """
+        Check if a call may be made, an open breaker lets one trial call through after the reset timeout
+        :return: true if the call may be made
+        """
+        with self._lock:
+            if self.state == circuit_state.open and time.monotonic() - self._opened_at >= self._reset_timeout:
+                self.state = circuit_state.half_open
+                return True
+            if self.state != circuit_state.closed:
+                self.rejected += 1
+                return False
+            return True
+
+    def record(self, latency: float, failed: bool, timed_out: bool = False) -> None:
+        """
+        Record the outcome of a call
+        :param latency: seconds the call took, up to the deadline
+        :param failed: true if the call failed or timed out
+        :param timed_out: true if the call did not finish within the deadline
+        """
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if not failed:
+                self._consecutive_failures = 0
+                self.state = circuit_state.closed
+                return
+            self.failures += 1
+            self.timeouts += 1 if timed_out else 0
+            self._consecutive_failures += 1
+            if self.state == circuit_state.half_open or self._consecutive_failures >= self._failure_threshold:
+                self.state = circuit_state.open
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the counters of the breaker
+        :return: the counters
+        """
+        with self._lock:
+            return dict(state=self.state, calls=self.calls, failures=self.failures, timeouts=self.timeouts,
+                        rejected=self.rejected, max_latency_ms=round(self.max_latency * 1000, 3),
+                        mean_latency_ms=round(self.total_latency * 1000 / self.calls, 3) if self.calls else 0.0)
+
+
+class spool_selection(NamedTuple):
+    """
+    Class to handle one fetched selection of spools, normalized to one entry per tool
+    """
+    # material_colorName_color of every tool
+    materials: List[Union[str, None]]
+    names: List[Union[str, None]]
+    db_ids: List[Union[str, None]]
+
+
 class SpoolManagerIntegration:
-    def __init__(self, impl: Any, logger: logging.Logger) -> None:
+    def __init__(self, impl: Any, logger: logging.Logger, ttl: float = SPOOL_SELECTION_TTL,
+                 deadline: float = SPOOL_MANAGER_DEADLINE, breaker: circuit_breaker = None) -> None:
         """
         Constructor
         :param impl: implementation of the Spool Manager
         :param logger: logger object
+        :param ttl: seconds a fetched spool selection is reused
+        :param deadline: seconds a call into the Spool Manager may take
+        :param breaker: the circuit breaker of the calls into the Spool Manager
         """
         self._logger = logger
         self._impl = impl
+        self._ttl = ttl
+        self._deadline = deadline
+        self.breaker = breaker if breaker is not None else circuit_breaker()
+        # Calls run here so the caller can stop waiting at the deadline
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="nfv-spoolmanager")
+        self._lock = threading.Lock()
+        # (fetch time, selection) of the last fetched spool selection
+        self._selection = None
+        self._version = 0
+
+    def _call(self, function: Callable[[], Any]) -> Any:
+        """
+        Call into the Spool Manager within the deadline and record the outcome in the circuit breaker
+        :param function: the call to make
+        :return: the result of the call
+        """
+        if self._impl is None:
+            raise SpoolManagerException("SpoolManager is not installed")
+        if not self.breaker.allow():
+            raise SpoolManagerException("SpoolManager calls are suspended after repeated failures")
+        started = time.monotonic()
+        future = self._executor.submit(function)
+        try:
+            result = future.result(timeout=self._deadline)
+        except FutureTimeoutError:
+            self.breaker.record(time.monotonic() - started, failed=True, timed_out=True)
+            raise SpoolManagerException(f"SpoolManager did not answer within {self._deadline} seconds")
+        except Exception:
+            self.breaker.record(time.monotonic() - started, failed=True)
+            raise
+        self.breaker.record(time.monotonic() - started, failed=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the latency and failure counters of the calls into the Spool Manager
+        :return: the counters
+        """
+        return self.breaker.stats()
+
+    def close(self) -> None:
+        """
+        Stop the worker threads, calls that are still running are abandoned
+        """
+        self._executor.shutdown(wait=False)
+
+    def get_selection(self) -> spool_selection:
+        """
+        Get the selected spools, fetched from the Spool Manager at most once per ttl
+        :return: the selection
+        """
+        cached = self._selection
+        if cached is not None and time.monotonic() - cached[0] < self._ttl:
+            return cached[1]
+        with self._lock:
+            version = self._version
+        fetched_at = time.monotonic()
+        spools = self._call(self._impl.api_getSelectedSpoolInformations)
+        selection = spool_selection(
+            materials=[f"{m['material']}_{m['colorName']}_{m['color']}" if m is not None else None for m in spools],
+            names=[f"{m['spoolName']}" if m is not None else None for m in spools],
+            db_ids=[f"{m['databaseId']}" if m is not None else None for m in spools],
+        )
+        with self._lock:
+            # A selection fetched while the cache was invalidated may be outdated and is not kept
+            if version == self._version:
+                self._selection = (fetched_at, selection)
+        return selection
+
+    def invalidate(self) -> None:
+        """
+        Forget the fetched spool selection, called when the Spool Manager reports a change
+        """
+        with self._lock:
+            self._version += 1
+            self._selection = None
 
     def get_materials(self) -> List[str]:
         """
@@ -27,27 +205,29 @@ class SpoolManagerIntegration:
         try:
             if self._impl is None:
                 return []
-            materials = self._impl.api_getSelectedSpoolInformations()
-            materials = [
-                f"{m['material']}_{m['colorName']}_{m['color']}"
-                if m is not None
-                else None
-                for m in materials
-            ]
-            return materials
+            return list(self.get_selection().materials)
         except Exception as e:
             self._logger.warning(
                 f"Skipping material assignment due to SpoolManager error: {e}"
             )
             return []
 
+    @staticmethod
+    def _in_app_context(function: Callable[[], Any]) -> Any:
+        """
+        Call a Spool Manager API function inside the Flask app context it needs
+        :param function: the function to call
+        :return: the result of the function
+        """
+        with app.app_context():
+            return function()
+
     def allowed_to_print(self) -> Dict[str, Any]:
         """
         Check if the printer is allowed to print
         :return: the response from the Spool Manager
         """
-        with app.app_context():
-            r = self._impl.allowed_to_print()
+        r = self._call(lambda: self._in_app_context(self._impl.allowed_to_print))
         if r.status_code != 200:
             raise SpoolManagerException(
                 f"SpoolManager allowed_to_print() error: {r.data}"
@@ -59,8 +239,7 @@ class SpoolManagerIntegration:
         Start of a print job confirmed
         :return: information about the print job
         """
-        with app.app_context():
-            r = self._impl.start_print_confirmed()
+        r = self._call(lambda: self._in_app_context(self._impl.start_print_confirmed))
         if r.status_code != 200:
             raise SpoolManagerException(
                 f"SpoolManager error {r.status_code} on print start: {r.data}"
@@ -94,7 +273,11 @@ class SpoolManagerIntegration:
                 self._logger.warning("Spool Manager plugin is not installed. Filament alert_type will not be checked.")
                 return -1
 
-            materials = self.get_materials()
+            try:
+                materials = self.get_selection().materials
+            except SpoolManagerException as e:
+                self._logger.warning(f"{e}. Filament alert_type will not be checked.")
+                return -2
 
             if not materials:
                 self._logger.warning("No filament selected in Spool Manager. Filament alert_type will not be checked.")
@@ -125,14 +308,7 @@ class SpoolManagerIntegration:
         try:
             if self._impl is None:
                 return []
-            spool_names = self._impl.api_getSelectedSpoolInformations()
-            spool_names = [
-                f"{m['spoolName']}"
-                if m is not None
-                else None
-                for m in spool_names
-            ]
-            return spool_names
+            return list(self.get_selection().names)
         except Exception as e:
             self._logger.warning(
                 f"Skipping material assignment due to SpoolManager error: {e}"
@@ -149,14 +325,7 @@ class SpoolManagerIntegration:
         :return:
         """
         try:
-            db_ids = self._impl.api_getSelectedSpoolInformations()
-            db_ids = [
-                f"{m['databaseId']}"
-                if m is not None
-                else None
-                for m in db_ids
-            ]
-            return db_ids
+            return list(self.get_selection().db_ids)
         except Exception as e:
             self._logger.warning(
                 f"Skipping material assignment due to SpoolManager error: {e}"
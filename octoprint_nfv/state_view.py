@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Union
+
+from octoprint_nfv.build_plate import get_filament_types
+from octoprint_nfv.hardware_state import hardware_snapshot
+from octoprint_nfv.printer_profile import printer_profile_view
+
+# Lists of the state view that are sent as changed and removed items, by the key that identifies an item
+ITEM_KEYS = {"nozzles": "id", "build_plates": "id", "extruders": "extruderPosition"}
+
+
+def build_state_view(snapshot: hardware_snapshot, profile: printer_profile_view) -> Dict[str, Any]:
+    """
+    Build the state shown by the frontend
+    :param snapshot: the hardware snapshot
+    :param profile: the parsed printer profile
+    :return: the state
+    """
+    current_build_plate = snapshot.build_plates.get(snapshot.current_build_plate)
+    return dict(
+        nozzles=[{"id": nozzle_id, "size": size} for nozzle_id, size in sorted(snapshot.nozzles.items())],
+        number_of_extruders=profile.tool_count,
+        build_plates=[{"id": build_plate_id, "name": name,
+                       "compatible_filaments": [filament_type.replace(" ", "") for filament_type in filaments]}
+                      for build_plate_id, (name, filaments) in sorted(snapshot.build_plates.items())],
+        extruders=[{"extruderPosition": position, "nozzleId": nozzle_id}
+                   for position, nozzle_id in sorted(snapshot.extruders.items())],
+        currentBuildPlate=current_build_plate[0] if current_build_plate else None,
+        currentBuildPlateFilaments=snapshot.get_current_build_plate_filaments(),
+        filaments=get_filament_types(),
+        isMultiExtruder=str(profile.is_multi_tool_head),
+        check_spool_id=str(snapshot.get_enable_spool_checking()),
+        check_spool_id_timeout=snapshot.get_timeout(),
+        check_filament_type=str(snapshot.get_enable_filament_type_checking()),
+        state_generation=snapshot.generation,
+    )
+
+
+def diff_items(previous: List[Dict[str, Any]], current: List[Dict[str, Any]], key: str) -> \
+        Union[Dict[str, List], None]:
+    """
+    Find the items of a list that changed
+    :param previous: the items before the change
+    :param current: the items after the change
+    :param key: the key that identifies an item
+    :return: the changed items and the keys of the removed items, or none if nothing changed
+    """
+    previous_items = {item[key]: item for item in previous}
+    current_keys = {item[key] for item in current}
+    changed = [item for item in current if previous_items.get(item[key]) != item]
+    removed = [item_key for item_key in previous_items if item_key not in current_keys]
+    return dict(changed=changed, removed=removed) if changed or removed else None
+
+
+def diff_state_views(previous: Dict[str, Any], current: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+    """
+    Build the delta that turns one state view into another
+    :param previous: the state the clients have
+    :param current: the new state
+    :return: the delta or none if nothing changed
+    """
+    items = {}
+    for name, key in ITEM_KEYS.items():
+        change = diff_items(previous.get(name, []), current[name], key)
+        if change is not None:
+            items[name] = change
+    values = {name: value for name, value in current.items()
+              if name not in ITEM_KEYS and name != "state_generation" and previous.get(name) != value}
+    if not items and not values:
+        return None
+    return dict(base=previous.get("state_generation"), generation=current["state_generation"], items=items,
+                values=values)
@@ -2,6 +2,11 @@ const PLUGIN_ID = "Nozzle_Filament_Validator";
 let activeTabId = "";
 let validatorMessageHandler = null;
 let activePromptKey = null;
+// The last state received from the server and the extruder information rendered with it
+let currentState = null;
+let currentExtruders = null;
+// Lists of the state that deltas patch, by the key that identifies an item
+const STATE_ITEM_KEYS = {nozzles: "id", build_plates: "id", extruders: "extruderPosition"};
 
 /**
  * Function to sleep for a given time in ms
@@ -39,6 +44,26 @@ function updateWaitState(state) {
     });
 }
 
+/**
+ * Replace the buttons of an answered spool prompt with the outcome
+ * @param notice The notice of the prompt
+ * @param title The title of the outcome
+ * @param text The text of the outcome
+ */
+function resolveSpoolNotice(notice, title, text) {
+    notice.update({
+        title: title,
+        text: text,
+        icon: true,
+        closer: true,
+        sticker: false,
+        type: 'info',
+        buttons: {closer: true, sticker: false},
+        hide: true,
+    });
+    notice.get().find(".button").remove();
+}
+
 // Function to create extruder tabs
 /**
  * Function to create extruder tabs
@@ -228,32 +253,79 @@ function fetchExtruderInfo(numberOfExtruders) {
     return Promise.all(promises);
 }
 
+/**
+ * Function to render a state received from the server
+ * @param state The state to render
+ * @param extruderArray The extruder information to reuse, it is fetched again when not given
+ */
+function renderState(state, extruderArray) {
+    if (state.active_prompt && validatorMessageHandler) {
+        validatorMessageHandler(PLUGIN_ID, state.active_prompt);
+    }
+    let extruders = extruderArray ? Promise.resolve(extruderArray) : fetchExtruderInfo(state.number_of_extruders);
+    extruders
+        .then((responses) => {
+            currentExtruders = responses;
+            currentExtruders.sort((a, b) => (a.extruderPosition > b.extruderPosition) ? 1 : -1);
+            createExtruderTabs(currentExtruders, state);
+            displayGeneralInfo(state);
+            activate_nozzle_buttons(state);
+            activate_build_plate_buttons(state);
+            activate_extruder_buttons(state);
+            setRefreshButtons();
+
+        }).catch((error) => {
+        console.error("Error fetching extruder info:", error);
+    });
+}
+
 // Main function to display data
 /**
  * Function to update the display window with the latest data
  */
 function displayData() {
     OctoPrint.simpleApiGet(PLUGIN_ID).done(function (response) {
-        if (response.active_prompt && validatorMessageHandler) {
-            validatorMessageHandler(PLUGIN_ID, response.active_prompt);
-        }
-        fetchExtruderInfo(response.number_of_extruders)
-            .then((responses) => {
-                let extruderArray = responses;
-                extruderArray.sort((a, b) => (a.extruderPosition > b.extruderPosition) ? 1 : -1);
-                createExtruderTabs(extruderArray, response);
-                displayGeneralInfo(response);
-                activate_nozzle_buttons(response);
-                activate_build_plate_buttons(response);
-                activate_extruder_buttons(response);
-                setRefreshButtons();
-
-            }).catch((error) => {
-            console.error("Error fetching extruder info:", error);
-        });
+        currentState = response;
+        renderState(response);
     });
 }
 
+/**
+ * Replace the changed items of a list and drop the removed ones
+ * @param items The items of the list
+ * @param change The changed items and the keys of the removed items
+ * @param key The key that identifies an item
+ * @returns {Array} The patched list
+ */
+function patchItems(items, change, key) {
+    let replaced = new Set(change.removed.concat(change.changed.map(item => item[key])));
+    let patched = (items || []).filter(item => !replaced.has(item[key])).concat(change.changed);
+    patched.sort((a, b) => (a[key] > b[key]) ? 1 : -1);
+    return patched;
+}
+
+/**
+ * Apply a state delta from the server, the whole state is fetched again when a delta was missed
+ * @param delta The delta to apply
+ */
+function applyStateDelta(delta) {
+    if (currentState === null || delta.base !== currentState.state_generation) {
+        displayData();
+        return;
+    }
+    for (let [name, change] of Object.entries(delta.items)) {
+        currentState[name] = patchItems(currentState[name], change, STATE_ITEM_KEYS[name]);
+    }
+    Object.assign(currentState, delta.values);
+    currentState.state_generation = delta.generation;
+    currentState.active_prompt = delta.active_prompt;
+
+    // The extruder information depends on the nozzles and extruders only
+    let extrudersChanged = "nozzles" in delta.items || "extruders" in delta.items ||
+        "number_of_extruders" in delta.values;
+    renderState(currentState, extrudersChanged ? null : currentExtruders);
+}
+
 $(function () {
 // Bind the plugin message handler to the global scope
     /**
@@ -273,6 +345,27 @@ $(function () {
                 displayData();
                 return;
             }
+            if (data.type === "state_delta") {
+                applyStateDelta(data);
+                return;
+            }
+            if (data.type === "printability") {
+                // Changed verdicts for file list badges, the full index is read with get_printability
+                return;
+            }
+            if (data.type === "library_validation") {
+                if (data.state === "done" || data.state === "failed") {
+                    new PNotify({
+                        title: 'Nozzle Filament Validator',
+                        text: data.state === "done" ? "Library validation finished: " + data.done + " of " +
+                            data.total + " files checked." : "Library validation failed.",
+                        type: data.state === "done" ? "info" : "error",
+                        hide: true,
+                        buttons: {closer: true, sticker: false}
+                    });
+                }
+                return;
+            }
 
             if (data.type === "validation_prompt" || data.type === "switch_spools") {
                 let promptKey = data.type + ":" + data.msg;
@@ -327,22 +420,8 @@ $(function () {
 
             if (data.type === "switch_spools") {
                 get_spools().then((raw_spool_data) => {
-                    let raw_data = data.msg.split(",");
-                    let desiredName = raw_data[0];
-
-                    // remove leading and trailing whitespace
-                    while (desiredName[0] === " ") {
-                        desiredName = desiredName.substring(1);
-                    }
-                    while (desiredName[desiredName.length - 1] === " ") {
-                        desiredName = desiredName.substring(0, desiredName.length - 1);
-                    }
-
-                    let extruderPos = raw_data[1].replace(" ", "");
-                    let currentName = raw_data[2].replace(" ", "");
-                    let timeout = data.timeout !== undefined
-                        ? Math.max(0, Number(data.timeout) || 0)
-                        : raw_data[3].replace(" ", "");
+                    let mismatches = data.mismatches || [];
+                    let timeout = Math.max(0, Number(data.timeout) || 0);
 
                     if (raw_spool_data === undefined || raw_spool_data.length === 0) {
                         alert("No spools found in Spool Manager. Please add a spool to Spool Manager before continuing.");
@@ -350,142 +429,66 @@ $(function () {
                         return;
                     }
 
-                    let spool = raw_spool_data.find(sp => sp.displayName === desiredName);
-                    let desiredDbId = undefined;
-
-                    if (spool) {
-                        desiredDbId = spool.databaseId;
-                    }
-
-                    if (desiredDbId === undefined) {
-                        new PNotify({
-                            title: 'Spool Mismatch Detected',
-                            text: 'The spool specified in the gcode (name: ' + desiredName + ') does not match the spool ' +
-                                'loaded in Spool Manager (name: ' + currentName + '). The desired spool was not found. Which of the following is true?',
-                            icon: 'fas fa-question-circle',
-                            hide: true,
-                            delay: Number(timeout) * 1000,
-                            closer: false,
-                            sticker: false,
-                            destroy: true,
-                            buttons: {closer: false, sticker: false},
-                            confirm: {
-                                confirm: true,
-                                buttons: [{
-                                    text: 'The incorrect spool is loaded',
-                                    addClass: "button",
-                                    click: notice => {
-                                        updateWaitState("cancel");
-                                        notice.update({
-                                            title: 'Incorrect spool loaded',
-                                            text: 'leaving the spool and canceling the print',
-                                            icon: true,
-                                            closer: true,
-                                            sticker: false,
-                                            type: 'info',
-                                            buttons: {closer: true, sticker: false},
-                                            hide: true,
-                                        });
-                                        notice.get().find(".button").remove();
-                                    },
-                                },
-                                    {
-                                        text: 'The incorrect spool is loaded but I want to continue anyway.',
-                                        addClass: "button",
-                                        click: notice => {
-                                            updateWaitState("ok");
-                                            notice.update({
-                                                title: 'Ignoring spool',
-                                                text: 'Ignoring the spool and continuing the print',
-                                                icon: true,
-                                                closer: true,
-                                                sticker: false,
-                                                type: 'info',
-                                                buttons: {closer: true, sticker: false},
-                                                hide: true,
-                                            });
-                                            notice.get().find(".button").remove();
-
-                                        }
-                                    }
-                                ]
-                            }, before_close: function (notice) {
-                                updateWaitState("cancel")
-                            },
+                    // One prompt covers every mismatched tool, it is answered once for all of them
+                    mismatches.forEach(mismatch => {
+                        let spool = raw_spool_data.find(sp => sp.displayName === mismatch.spool_id);
+                        mismatch.databaseId = spool ? spool.databaseId : undefined;
+                    });
+                    let allFound = mismatches.every(mismatch => mismatch.databaseId !== undefined);
+                    let plural = mismatches.length > 1;
+                    let details = mismatches.map(mismatch =>
+                        'Extruder ' + (Number(mismatch.index) + 1) + ': the gcode specifies ' +
+                        $('<div>').text(mismatch.spool_id).html() + ', Spool Manager has ' +
+                        $('<div>').text(mismatch.current || 'None Selected').html() +
+                        (mismatch.databaseId === undefined ? ' (the desired spool was not found)' : '')
+                    ).join('<br>');
+
+                    let buttons = [];
+                    if (allFound) {
+                        buttons.push({
+                            text: plural ? 'The correct spools are loaded' : 'The correct spool is loaded',
+                            primary: true,
+                            addClass: "button",
+                            click: notice => {
+                                mismatches.forEach(mismatch => updateSpool(mismatch.databaseId, mismatch.index));
+                                updateWaitState("ok");
+                                resolveSpoolNotice(notice, plural ? 'Correct spools loaded' : 'Correct spool loaded',
+                                    'Changing the spool and continuing');
+                            }
                         });
-                        return;
                     }
+                    buttons.push({
+                        text: plural ? 'The incorrect spools are loaded' : 'The incorrect spool is loaded',
+                        addClass: "button",
+                        click: notice => {
+                            updateWaitState("cancel");
+                            resolveSpoolNotice(notice, plural ? 'Incorrect spools loaded' : 'Incorrect spool loaded',
+                                'leaving the spool and canceling the print');
+                        },
+                    }, {
+                        text: (plural ? 'The incorrect spools are loaded' : 'The incorrect spool is loaded') +
+                            ' but I want to continue anyway.',
+                        addClass: "button",
+                        click: notice => {
+                            updateWaitState("ok");
+                            resolveSpoolNotice(notice, 'Ignoring spool', 'Ignoring the spool and continuing the print');
+                        }
+                    });
 
                     new PNotify({
                         title: 'Spool Mismatch Detected',
-                        text: 'The spool specified in the gcode (name: ' + desiredName + ') does not match the spool ' +
-                            'loaded in Spool Manager (name: ' + currentName + '). Which of the following is true?',
+                        text: 'The spools specified in the gcode do not match the spools loaded in Spool Manager.<br>' +
+                            details + '<br>Which of the following is true?',
                         icon: 'fas fa-question-circle',
                         hide: true,
-                        delay: Number(timeout) * 1000,
+                        delay: timeout * 1000,
                         closer: false,
                         sticker: false,
                         destroy: true,
                         buttons: {closer: false, sticker: false},
                         confirm: {
                             confirm: true,
-                            buttons: [{
-                                text: 'The correct spool is loaded',
-                                primary: true,
-                                addClass: "button",
-                                click: notice => {
-                                    updateSpool(desiredDbId, extruderPos);
-                                    updateWaitState("ok");
-                                    notice.update({
-                                        title: 'Correct spool loaded',
-                                        text: 'Changing the spool and continuing',
-                                        icon: true,
-                                        closer: true,
-                                        sticker: false,
-                                        type: 'info',
-                                        buttons: {closer: true, sticker: false},
-                                        hide: true,
-                                    });
-                                    notice.get().find(".button").remove();
-                                }
-                            },
-                                {
-                                    text: 'The incorrect spool is loaded',
-                                    addClass: "button",
-                                    click: notice => {
-                                        updateWaitState("cancel");
-                                        notice.update({
-                                            title: 'Incorrect spool loaded',
-                                            text: 'leaving the spool and canceling the print',
-                                            icon: true,
-                                            closer: true,
-                                            sticker: false,
-                                            type: 'info',
-                                            buttons: {closer: true, sticker: false},
-                                            hide: true,
-                                        });
-                                        notice.get().find(".button").remove();
-                                    },
-                                },
-                                {
-                                    text: 'The incorrect spool is loaded but I want to continue anyway.',
-                                    addClass: "button",
-                                    click: notice => {
-                                        updateWaitState("ok");
-                                        notice.update({
-                                            title: 'Ignoring spool',
-                                            text: 'Ignoring the spool and continuing the print',
-                                            icon: true,
-                                            closer: true,
-                                            sticker: false,
-                                            type: 'info',
-                                            buttons: {closer: true, sticker: false},
-                                            hide: true,
-                                        });
-                                        notice.get().find(".button").remove();
-                                    }
-                                }
-                            ]
+                            buttons: buttons
                         }, before_close: function (notice) {
                             updateWaitState("cancel")
                         },
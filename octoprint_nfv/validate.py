@@ -1,12 +1,18 @@
+import collections
 import logging
 import math
 import os
 import re
 import threading
 import time
-from typing import Any, Union, Dict, List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Union, Dict, Iterable, List, Tuple
 
 from octoprint_nfv.constants import alert_types
+from octoprint_nfv.hardware_state import live_hardware
+from octoprint_nfv.rules import (Finding, check_mmu, check_num_extruders, check_num_filaments, check_printer_model,
+                                 ends_with_mmu, evaluate_tools, match_ends_with_mmu, normalize_loaded_filaments,
+                                 remove_is_from_end, remove_mmu_from_end, validation_snapshot)
 
 
 class filament_timeout:
@@ -18,141 +24,196 @@ class filament_timeout:
     cancel = "cancel"
 
 
-def parse_gcode(file_path: str) -> Dict[str, Any]:
+# Number of lines to read from the end of the file
+TAIL_LINES = 1000
+# Size of the chunks read backwards from the end of the file
+TAIL_BLOCK_SIZE = 64 * 1024
+# Number of passing verdicts remembered
+VERDICT_CACHE_MAX_ENTRIES = 256
+# Threads that fetch the inputs of a validation concurrently
+GATHER_WORKERS = 2
+# Seconds a validation waits for all of its inputs together
+GATHER_DEADLINE = 10.0
+
+
+def read_tail(file_path: str, num_lines: int = TAIL_LINES, block_size: int = TAIL_BLOCK_SIZE) -> str:
     """
-    Parse the GCODE file to extract the nozzle diameter and filament type
-    :param file_path: the path to the GCODE file
-    :return: a dictionary containing the nozzle diameter and filament type
+    Read the last lines of a file by reading fixed size binary blocks backwards from its end
+    :param file_path: the path to the file
+    :param num_lines: the number of newlines to collect from the end of the file
+    :param block_size: the number of bytes read per block
+    :return: the decoded text following the num_lines-th newline from the end, or the whole file if it is shorter
     """
-    # Regular expression patterns to extract nozzle diameter and filament alert_type
-    nozzle_pattern = re.compile(r'^;\s*nozzle_diameter\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-    filament_pattern = re.compile(r'^;\s*filament_type\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-    used_filament_pattern = re.compile(r'^;\s*filament used \[mm]\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-    printer_model_pattern = re.compile(r'^;\s*printer_model\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-    skip_validation_pattern = re.compile(r'^;\s*skip_validation\s*$', re.MULTILINE | re.IGNORECASE)
-    filament_notes_pattern = re.compile(r'^;\s*filament_notes\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-    single_extruder_multi_material_pattern = re.compile(
-        r'^;\s*single_extruder_multi_material\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
-
-    # Number of lines to read from the end of the file
-    num_lines = 1000
-
-    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
-        # Move the file pointer to the end
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        # Track the position in the file
-        pos = file_size - 1
+    with open(file_path, 'rb') as file:
+        pos = file.seek(0, os.SEEK_END)
+        blocks = []
         newline_count = 0
-        # Read the file backwards until we find the last 100 lines or reach the beginning of the file
         while pos > 0 and newline_count < num_lines:
+            read_size = min(block_size, pos)
+            pos -= read_size
             file.seek(pos)
-            char = file.read(1)
-            if char == '\n':
-                newline_count += 1
-                if newline_count == num_lines:
+            block = file.read(read_size)
+            blocks.append(block)
+            newline_count += block.count(b'\n')
+
+    if newline_count >= num_lines:
+        # Only the oldest block can hold the num_lines-th newline from the end,
+        # drop it and everything before it.
+        excess = newline_count - num_lines
+        blocks[-1] = blocks[-1].split(b'\n', excess + 1)[-1]
+    blocks.reverse()
+    # Only the final window is decoded, never the rest of the file
+    return b''.join(blocks).decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+
+# Slicer comment keys (lower case, as in "; key = value") mapped to the parse_gcode fields they fill
+METADATA_KEYS = {
+    "nozzle_diameter": "nozzle_size",
+    "filament_type": "filament_type",
+    "filament used [mm]": "filament_used",
+    "printer_model": "printer_model",
+    "filament_notes": "filament_notes",
+    "single_extruder_multi_material": "single_extruder_multi_material",
+}
+# Bare directive ("; skip_validation") that disables validation for a file
+SKIP_VALIDATION_DIRECTIVE = "skip_validation"
+
+
+def extract_metadata(lines: Iterable[str]) -> Dict[str, Any]:
+    """
+    Extract the validation metadata from GCODE lines in a single pass
+    Only comment lines are inspected, the first value of every key wins and the scan stops once every key was found.
+    :param lines: the GCODE lines to scan
+    :return: a dictionary in the format returned by parse_gcode
+    """
+    values = {}
+    skip_validation = False
+    for line in lines:
+        if not line.startswith(';'):
+            continue
+        key, separator, value = line[1:].partition('=')
+        if not separator:
+            if key.strip().lower() == SKIP_VALIDATION_DIRECTIVE:
+                skip_validation = True
+                if len(values) == len(METADATA_KEYS):
                     break
-            pos -= 1
-        # Ensure short files are read from byte zero. Without this seek, the
-        # first character of a file with fewer than ``num_lines`` lines was
-        # omitted.
-        file.seek(max(pos, 0))
-        lines = file.readlines()
-
-        # Extract nozzle diameter and filament alert_type from the collected lines
-        gcode_content = ''.join(lines)
-        nozzle_match = nozzle_pattern.search(gcode_content)
-        filament_match = filament_pattern.search(gcode_content)
-        filament_used_match = used_filament_pattern.search(gcode_content)
-        printer_model_match = printer_model_pattern.search(gcode_content)
-        skip_validation_match = skip_validation_pattern.search(gcode_content)
-        filament_notes_match = filament_notes_pattern.search(gcode_content)
-        single_extruder_multi_material_match = single_extruder_multi_material_pattern.search(gcode_content)
-        nozzle_size = None
-        filament_type = None
-        filament_used = None
-        printer_model = None
-        filament_notes = None
-        single_extruder_multi_material = None
-        skip_validation = False
-        if nozzle_match:
-            nozzle_size = nozzle_match.group(1).replace(" ", "").strip().split(',')
-        if filament_match:
-            filament_type = filament_match.group(1).strip().split(';')
-        if filament_used_match:
-            filament_used = filament_used_match.group(1).replace(" ", "").strip().split(',')
-        if printer_model_match:
-            printer_model = printer_model_match.group(1).strip()
-        if skip_validation_match:
-            skip_validation = True
-        if filament_notes_match:
-            filament_notes = filament_notes_match.group(1).strip().split(';')
-        if single_extruder_multi_material_match:
-            data = single_extruder_multi_material_match.group(1).replace(" ", "").strip()
-            if data == "1":
-                single_extruder_multi_material = True
-            else:
-                single_extruder_multi_material = False
+            continue
+        field = METADATA_KEYS.get(key.strip().lower())
+        if field is None or field in values:
+            continue
+        value = value.strip()
+        if value:
+            values[field] = value
+            if skip_validation and len(values) == len(METADATA_KEYS):
+                break
+
+    nozzle_size = values.get("nozzle_size")
+    filament_type = values.get("filament_type")
+    filament_used = values.get("filament_used")
+    filament_notes = values.get("filament_notes")
+    single_extruder_multi_material = values.get("single_extruder_multi_material")
+    if nozzle_size is not None:
+        nozzle_size = nozzle_size.replace(" ", "").split(',')
+    if filament_type is not None:
+        filament_type = filament_type.split(';')
+    if filament_used is not None:
+        filament_used = filament_used.replace(" ", "").split(',')
+    if filament_notes is not None:
+        filament_notes = filament_notes.split(';')
+    if single_extruder_multi_material is not None:
+        single_extruder_multi_material = single_extruder_multi_material.replace(" ", "") == "1"
 
     return {
         "nozzle_size": nozzle_size, "filament_type": filament_type, "filament_used": filament_used,
-        "printer_model": printer_model, "skip_validation": skip_validation, "filament_notes": filament_notes,
-        "single_extruder_multi_material": single_extruder_multi_material}
+        "printer_model": values.get("printer_model"), "skip_validation": skip_validation,
+        "filament_notes": filament_notes, "single_extruder_multi_material": single_extruder_multi_material}
 
 
-def ends_with_mmu(string: str) -> bool:
+def parse_gcode(file_path: str) -> Dict[str, Any]:
     """
-    Check if the string ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
-    :param string: the string to check
-    :return: if the string ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
+    Parse the GCODE file to extract the nozzle diameter and filament type
+    :param file_path: the path to the GCODE file
+    :return: a dictionary containing the nozzle diameter and filament type
     """
-    match_1 = re.match(r".*mmu[23](s)?$", string)
-    match_2 = re.match(r".*mmu[23](s)?is$", string)
-    match_3 = re.match(r".*ismmu[23](s)?$", string)
-    return bool(match_1 or match_2 or match_3)
+    return extract_metadata(read_tail(file_path, TAIL_LINES).split('\n'))
 
 
-def match_ends_with_mmu(string: str) -> Union[str, None]:
+def fingerprint(file_path: str) -> Tuple[int, int, int]:
     """
-    Match the string that ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
-    :param string: the string to match
-    :return: the matched string
+    Get the fingerprint of a file, it changes whenever the file is rewritten or replaced
+    :param file_path: the path to the file
+    :return: (size, mtime in ns, inode) of the file
     """
-    match = re.match(r"^(.*?)(is)?(mmu[23](s)?)(is)?$", string)
-    if match:
-        return match.group(1)
-    else:
-        return None
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
 
 
-def remove_mmu_from_end(text: str) -> str:
-    """
-    Remove mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis from the end of the string
-    :param text: the string to remove mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis from
-    :return: the string with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis removed
-    """
-    if bool(re.match(r".*mmu[23](s)?$|^mmu[23](s)?$", text)):
-        return re.sub(r'mmu[23](s)?$', '', text)
-    elif bool(re.match(r".*mmu[23](s)?is$|^mmu[23](s)?is$", text)):
-        return re.sub(r'mmu[23](s)?is$', 'is', text)
-    elif bool(re.match(r".*ismmu[23](s)?$|^ismmu[23](s)?$", text)):
-        return re.sub(r'ismmu[23](s)?$', 'is', text)
-    else:
-        return text
+def _freeze(value: Any) -> Any:
+    return tuple(value) if isinstance(value, list) else value
 
 
-def remove_is_from_end(text: str) -> str:
+class verdict_cache:
     """
-    Remove 'is' from the end of the string unless it is followed by 'mmu', a number, and optionally 's'
-    :param text: the text to remove 'is' from
-    :return: the text with 'is' removed
+    Class to handle the passing verdicts of validations, keyed by everything the verdict depends on
     """
-    if bool(re.search(r"ismmu[23](s)?", text)):
-        return re.sub(r'is(?=mmu[23](s)?)', '', text)
-    elif bool(re.search(r"is$", text)):
-        return re.sub(r'is$', '', text)
-    else:
-        return text
+
+    def __init__(self, max_entries: int = VERDICT_CACHE_MAX_ENTRIES) -> None:
+        """
+        Constructor
+        :param max_entries: the maximum number of verdicts kept, the least recently used are evicted
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        # the number of cached verdicts of every (path, fingerprint), the state is not needed to rule out a hit
+        self._files = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+
+    def contains(self, key: Tuple) -> bool:
+        """
+        Check if a validation with the same inputs passed before
+        :param key: the key of the validation
+        :return: true if the verdict is cached
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def may_contain(self, file_path: str, file_fingerprint: Tuple[int, int, int]) -> bool:
+        """
+        Check if any verdict of a file is cached, whatever the state it was validated against
+        :param file_path: the path to the GCODE file
+        :param file_fingerprint: the fingerprint of the file
+        :return: false if no validation of the file can hit
+        """
+        with self._lock:
+            return self._files[(file_path, file_fingerprint)] > 0
+
+    def add(self, key: Tuple) -> None:
+        """
+        Remember a passing validation
+        :param key: the key of the validation
+        """
+        with self._lock:
+            if key not in self._entries:
+                self._files[key[:2]] += 1
+            self._entries[key] = True
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._files[evicted[:2]] -= 1
+                if not self._files[evicted[:2]]:
+                    del self._files[evicted[:2]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._files.clear()
 
 
 class validator:
@@ -162,7 +223,8 @@ class validator:
 
     def __init__(self, nozzle: Any, build_plate: Any,
                  extruders: Any, spool_manager: Any, filament: Any, printer: Any,
-                 logger: logging.Logger, plugin_manager: Any, identifier: str, printer_profile_manager: Any) -> None:
+                 logger: logging.Logger, plugin_manager: Any, identifier: str, printer_profile_manager: Any,
+                 metadata_cache: Any = None, hardware_state: Any = None, printer_profile: Any = None) -> None:
         self.nozzle = nozzle
         self.build_plate = build_plate
         self._spool_manager = spool_manager
@@ -173,11 +235,21 @@ class validator:
         self._identifier = identifier
         self._printer_profile_manager = printer_profile_manager
         self._filament = filament
+        self._metadata_cache = metadata_cache
+        self._hardware_state = hardware_state
+        self._printer_profile = printer_profile
+        self.verdicts = verdict_cache()
+        # Fetches the GCODE metadata and the SpoolManager state of a validation side by side
+        self._gather_executor = ThreadPoolExecutor(max_workers=GATHER_WORKERS, thread_name_prefix="nfv-gather")
         self.filament_wait_status = "ok"
+        # Notified whenever filament_wait_status changes, prompts block on it instead of polling
+        self._wait_condition = threading.Condition()
         self.paused = False
         self._prompt_lock = threading.RLock()
         self._active_prompt = None
         self._prompt_deadline = None
+        # Per-thread validation mode, speculative validations run next to an interactive one
+        self._context = threading.local()
 
     def pause_print(self) -> None:
         """
@@ -193,16 +265,37 @@ class validator:
         :param state:
         :return:
         """
-        self.filament_wait_status = state
+        with self._wait_condition:
+            self.filament_wait_status = state
+            self._wait_condition.notify_all()
         if state != filament_timeout.waiting:
             self.clear_active_prompt()
 
-    def set_active_prompt(self, prompt_type: str, message: str, timeout: int) -> Dict[str, Any]:
+    def wait_for_filament_decision(self, timeout: float) -> Union[str, None]:
+        """
+        Block until the frontend answers the open prompt, an expired wait is cancelled
+        :param timeout: the number of seconds to wait
+        :return: the filament wait status or none if the timeout was reached
+        """
+        with self._wait_condition:
+            decided = self._wait_condition.wait_for(
+                lambda: self.filament_wait_status != filament_timeout.waiting, max(0, timeout))
+            if decided:
+                return self.filament_wait_status
+            # Still under the lock, so an answer arriving right now isn't overwritten
+            self.filament_wait_status = filament_timeout.cancel
+        self.clear_active_prompt()
+        return None
+
+    def set_active_prompt(self, prompt_type: str, message: str, timeout: int, **details: Any) -> Dict[str, Any]:
         timeout = max(0, int(timeout))
         with self._prompt_lock:
-            self._active_prompt = {"type": prompt_type, "msg": message}
+            self._active_prompt = dict(details, type=prompt_type, msg=message)
             self._prompt_deadline = time.monotonic() + timeout
-            return dict(self._active_prompt, timeout=timeout)
+            prompt = dict(self._active_prompt, timeout=timeout)
+        # A verdict the operator decided isn't reused for later validations
+        self._context.prompted = True
+        return prompt
 
     def clear_active_prompt(self) -> None:
         with self._prompt_lock:
@@ -223,6 +316,8 @@ class validator:
         Get the current printer model
         :return: the current printer model
         """
+        if self._printer_profile is not None:
+            return self._printer_profile.get().model
         return self._printer_profile_manager.get_current_or_default()['model']
 
     def send_alert(self, message: str, alert_type: str = alert_types.popup) -> None:
@@ -231,45 +326,276 @@ class validator:
         :param message: the message to send
         :param alert_type: what type of alert to send
         """
+        if not self.is_interactive():
+            self._logger.debug(f"Non-interactive validation: {message}")
+            self._record_reason(message, alert_type)
+            return
         self._plugin_manager.send_plugin_message(self._identifier, dict(type=alert_type, msg=message))
 
+    def _record_reason(self, message: str, alert_type: str) -> None:
+        """
+        Remember why a validation run by explain_print did not pass
+        :param message: the message of the alert
+        :param alert_type: the type of the alert, only errors are reasons
+        """
+        reasons = getattr(self._context, "reasons", None)
+        if reasons is not None and alert_type in (alert_types.error, alert_types.danger, alert_types.tmp_error,
+                                                  alert_types.tmp_danger):
+            reasons.append(message)
+
+    def is_interactive(self) -> bool:
+        """
+        Check if the validation running on this thread may alert and prompt the user
+        :return: true for interactive validations
+        """
+        return getattr(self._context, "interactive", True)
+
     def prompt_validation_override(self, message: str) -> bool:
         """Wait for an explicit continue/cancel decision, defaulting to cancel on timeout."""
-        timeout = max(0, int(self._filament.get_timeout()))
+        if not self.is_interactive():
+            self._logger.info(f"Non-interactive validation did not pass: {message}")
+            self._record_reason(message, alert_types.error)
+            return False
+
+        timeout = max(0, int(self.get_snapshot().timeout))
         self.update_filament_wait_status(filament_timeout.waiting)
         prompt = self.set_active_prompt(alert_types.validation_prompt, message, timeout)
         self._plugin_manager.send_plugin_message(self._identifier, prompt)
 
-        deadline = time.monotonic() + timeout
-        while self.filament_wait_status == filament_timeout.waiting and time.monotonic() < deadline:
-            time.sleep(0.1)
-
-        if self.filament_wait_status == filament_timeout.ok:
+        decision = self.wait_for_filament_decision(timeout)
+        if decision == filament_timeout.ok:
             self.send_alert("Validation warning acknowledged; continuing at the user's request.", alert_types.info)
             return True
 
-        if self.filament_wait_status == filament_timeout.waiting:
-            self.update_filament_wait_status(filament_timeout.cancel)
+        if decision is None:
             self.send_alert("Validation prompt timed out; the print was blocked.", alert_types.error)
         return False
 
-    def check_print(self, file_path: str) -> bool:
+    def get_gcode_info(self, file_path: str) -> Dict[str, Any]:
+        """
+        Get the metadata of a GCODE file, from the metadata cache when the file is unchanged
+        :param file_path: the path to the GCODE file
+        :return: the metadata as returned by parse_gcode
+        """
+        if self._metadata_cache is None:
+            return parse_gcode(file_path)
+        return self._metadata_cache.get_or_parse(file_path)
+
+    def check_print(self, file_path: str, interactive: bool = True, snapshot: validation_snapshot = None) -> bool:
         """
         Validate a GCODE file and return whether it is safe to start.
         :param file_path: The path to the GCODE file
+        :param interactive: false to validate without alerts or prompts, anything that would prompt fails instead
+        :param snapshot: the state to validate against, captured when not given
+        """
+        previous = self.is_interactive()
+        previous_snapshot = getattr(self._context, "snapshot", None)
+        self._context.interactive = interactive
+        try:
+            # The GCODE is only parsed when the verdict can't be reused, a file that never passed can't hit so its
+            # parse starts right away and runs while SpoolManager is read
+            deadline = time.monotonic() + GATHER_DEADLINE
+            gcode_info = None
+            if not self._may_reuse_verdict(file_path):
+                gcode_info = self._gather_executor.submit(self.get_gcode_info, file_path)
+            if snapshot is None:
+                hardware = self.get_hardware()
+                check_filament_types = hardware.get_enable_filament_type_checking()
+                spool_state = self._gather_executor.submit(self._read_spool_state, check_filament_types,
+                                                           hardware.get_enable_spool_checking())
+                try:
+                    spool_state = spool_state.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    # Only a missing answer about the filament types is an error, unchecked types read as not loaded
+                    if check_filament_types:
+                        spool_state = (None, "SpoolManager did not answer in time", ())
+                    else:
+                        spool_state = (-1, None, ())
+                snapshot = self.capture_snapshot(hardware, spool_state)
+
+            # Every rule of this validation runs against the same state, captured once
+            self._context.snapshot = snapshot
+            key = self._verdict_key(file_path, snapshot)
+            if key is not None and self.verdicts.contains(key):
+                self._logger.info("The GCODE passed with the same file and printer state before, reusing the verdict")
+                self.send_alert("Print passed nozzle and filament check", alert_types.success)
+                return True
+            if gcode_info is None:
+                gcode_info = self._gather_executor.submit(self.get_gcode_info, file_path)
+
+            self._context.prompted = False
+            result = self._check_print(file_path, gcode_info, deadline)
+            if result and key is not None and not self._context.prompted:
+                self.verdicts.add(key)
+            return result
+        finally:
+            self._context.interactive = previous
+            self._context.snapshot = previous_snapshot
+
+    def explain_print(self, file_path: str, snapshot: validation_snapshot = None) -> Tuple[bool, List[str]]:
+        """
+        Validate a GCODE file without alerts or prompts and collect why it did not pass
+        :param file_path: the path to the GCODE file
+        :param snapshot: the state to validate against, captured when not given
+        :return: (true if the file passed, the messages of the failed checks)
+        """
+        previous_reasons = getattr(self._context, "reasons", None)
+        self._context.reasons = reasons = []
+        try:
+            return self.check_print(file_path, interactive=False, snapshot=snapshot), reasons
+        finally:
+            self._context.reasons = previous_reasons
+
+    def explain_metadata(self, gcode_info: Dict[str, Any], snapshot: validation_snapshot) -> Tuple[bool, List[str]]:
+        """
+        Validate already parsed GCODE metadata without alerts or prompts, the file itself is not read
+        :param gcode_info: the metadata as returned by parse_gcode
+        :param snapshot: the state to validate against
+        :return: (true if the metadata passed, the messages of the failed checks)
+        """
+        previous = (self.is_interactive(), getattr(self._context, "snapshot", None),
+                    getattr(self._context, "reasons", None))
+        self._context.interactive = False
+        self._context.snapshot = snapshot
+        self._context.reasons = reasons = []
+        try:
+            return self._check_metadata(gcode_info), reasons
+        finally:
+            self._context.interactive, self._context.snapshot, self._context.reasons = previous
+
+    def _may_reuse_verdict(self, file_path: str) -> bool:
+        """
+        Check if a validation of a file could reuse a cached verdict, without knowing the state yet
+        :param file_path: the path to the GCODE file
+        :return: false if the file never passed in its current form
+        """
+        try:
+            return self.verdicts.may_contain(file_path, fingerprint(file_path))
+        except (OSError, TypeError):
+            return False
+
+    def _verdict_key(self, file_path: str, snapshot: validation_snapshot) -> Union[Tuple, None]:
+        """
+        Get the key of a validation, it covers the file contents and the whole snapshot so any change misses
+        :param file_path: the path to the GCODE file
+        :param snapshot: the snapshot the validation checks against
+        :return: the key or none if the validation can't be cached
+        """
+        try:
+            key = (file_path, fingerprint(file_path), snapshot)
+            hash(key)
+        except (OSError, TypeError):
+            return None
+        return key
+
+    def get_hardware(self) -> Any:
+        """
+        Get the hardware settings
+        :return: the in-memory snapshot or the database classes when there is no hardware state
+        """
+        if self._hardware_state is not None:
+            return self._hardware_state.snapshot()
+        return live_hardware(self.extruders, self.build_plate, self._filament)
+
+    def close(self) -> None:
+        """
+        Stop the threads that fetch the inputs of validations
+        """
+        self._gather_executor.shutdown(wait=False)
+
+    def _read_spool_state(self, check_filament_types: bool,
+                          check_spool_ids: bool) -> Tuple[Any, Union[str, None], Tuple[Union[str, None], ...]]:
+        """
+        Read the SpoolManager state a validation checks against
+        :param check_filament_types: true if the loaded filament types are checked
+        :param check_spool_ids: true if the spool names are checked
+        :return: (the loaded filaments, the error raised while reading them, the spool names)
+        """
+        loaded_filaments, loaded_filaments_error = self._read_loaded_filaments(check_filament_types)
+        spool_names = tuple(self._spool_manager.get_names() or []) if check_spool_ids else ()
+        return loaded_filaments, loaded_filaments_error, spool_names
+
+    def _read_loaded_filaments(self, check_filament_types: bool) -> Tuple[Any, Union[str, None]]:
+        if not check_filament_types:
+            return -1, None
+        try:
+            return self._spool_manager.get_loaded_filaments(), None
+        except Exception as e:
+            return None, str(e)
+
+    def capture_snapshot(self, hardware: Any = None, spool_state: Tuple = None) -> validation_snapshot:
+        """
+        Capture the hardware, printer profile and spool state a validation checks against
+        :param hardware: the hardware settings, read when not given
+        :param spool_state: the SpoolManager state as returned by _read_spool_state, read when not given
+        :return: the frozen snapshot
+        """
+        hardware = hardware if hardware is not None else self.get_hardware()
+        extruder_count = self.extruders.get_number_of_extruders()
+        check_filament_types = hardware.get_enable_filament_type_checking()
+        check_spool_ids = hardware.get_enable_spool_checking()
+        if spool_state is None:
+            spool_state = self._read_spool_state(check_filament_types, check_spool_ids)
+        loaded_filaments, loaded_filaments_error, spool_names = spool_state
+        build_plate_filaments = hardware.get_current_build_plate_filaments()
+        return validation_snapshot(
+            printer_model=self.get_printer_model(),
+            extruder_count=extruder_count,
+            nozzle_sizes=tuple(hardware.get_nozzle_size_for_extruder(position)
+                               for position in range(1, extruder_count + 1)),
+            build_plate_filaments=tuple(build_plate_filaments) if build_plate_filaments is not None else None,
+            check_filament_types=check_filament_types,
+            loaded_filaments=_freeze(loaded_filaments),
+            loaded_filaments_error=loaded_filaments_error,
+            check_spool_ids=check_spool_ids,
+            spool_names=spool_names,
+            timeout=hardware.get_timeout(),
+        )
+
+    def get_snapshot(self) -> validation_snapshot:
+        """
+        Get the snapshot of the running validation, a new one outside a validation
+        :return: the snapshot
+        """
+        snapshot = getattr(self._context, "snapshot", None)
+        return snapshot if snapshot is not None else self.capture_snapshot()
+
+    def send_findings(self, findings: List[Finding]) -> None:
+        """
+        Send the alerts the rules produced
+        :param findings: the findings of the rules
+        """
+        for message, alert_type in findings:
+            self.send_alert(message, alert_type)
+
+    def _check_print(self, file_path: str, gcode_info: Future, deadline: float) -> bool:
+        """
+        Run the rules of a validation
+        :param file_path: the path to the GCODE file
+        :param gcode_info: the running parse of the GCODE metadata
+        :param deadline: the time.monotonic() value by which the inputs must be available
+        :return: true if the print may start
         """
         self.paused = False
         if not file_path or not os.path.isfile(file_path):
             return self.prompt_validation_override(
                 f"The GCODE file {file_path!r} could not be read, so it could not be validated.")
 
-        nozzle_passed = True
-        filament_passed = True
-        spool_passed = True
         try:
-            gcode_info = parse_gcode(file_path)
+            gcode_info = gcode_info.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Caught first, since Python 3.11 it is the builtin TimeoutError which is an OSError
+            return self.prompt_validation_override("The GCODE could not be parsed in time.")
         except (OSError, UnicodeError) as error:
             return self.prompt_validation_override(f"The GCODE could not be parsed: {error}")
+        return self._check_metadata(gcode_info)
+
+    def _check_metadata(self, gcode_info: Dict[str, Any]) -> bool:
+        """
+        Run the rules of a validation against the metadata of a GCODE file
+        :param gcode_info: the metadata as returned by parse_gcode
+        :return: true if the print may start
+        """
         printer_model = gcode_info["printer_model"]
         skip_validation = gcode_info["skip_validation"]
         semm = gcode_info["single_extruder_multi_material"]
@@ -306,357 +632,131 @@ class validator:
             return self.prompt_validation_override(
                 "Nozzle diameter or filament usage metadata contains a malformed numeric value.")
 
-        if not self.check_printer_model(printer_model):
+        snapshot = self.get_snapshot()
+        passed, findings = check_printer_model(printer_model, snapshot.printer_model)
+        self.send_findings(findings)
+        if not passed:
             return self.prompt_validation_override("The printer model in the GCODE does not match this printer.")
 
-        mmu_pass, mmu_single_mode = self.check_mmu(printer_model, nozzles, filament_types, filament_used)
-
+        mmu_pass, mmu_single_mode, findings = check_mmu(printer_model, nozzles, filament_types, filament_used,
+                                                        snapshot.extruder_count)
+        self.send_findings(findings)
         if not mmu_pass:
             return self.prompt_validation_override("The GCODE tool count is incompatible with this printer.")
 
-        for i in range(len(nozzles)):
-            if filament_used[i] is not None:
-                # if no filament was used, assume the tool isn't used and skip the check
-                if float(filament_used[i]) == 0:
-                    continue
-            else:  # if the filament used is None, assume the tool isn't used and skip the check for that tool
-                continue
+        # if no filament was used, assume the tool isn't used and skip the check for that tool
+        used_tools = [i for i in range(len(nozzles)) if filament_used[i] is not None and float(filament_used[i]) != 0]
+        spool_pass, spool_passed = self.check_spool_ids(used_tools, gcode_info)
+        if not spool_pass:
+            return False
+        # The operator may have selected other spools while answering the spool prompt
+        snapshot = self.get_snapshot()
 
-            spool_pass, spool_passed = self.check_spool_id(i, gcode_info, spool_passed)
-            if not spool_pass:
-                return False
-
-        check_filament_types = self._filament.get_enable_filament_type_checking()
-        if check_filament_types:
-            try:
-                loaded_filaments = self._spool_manager.get_loaded_filaments()
-            except Exception as e:
-                return self.prompt_validation_override(f"Loaded filament information could not be retrieved: {e}")
-        else:
-            loaded_filaments = [-1] * len(filament_types)
-
-        # SpoolManager uses sentinel values when it is unavailable. Normalize
-        # those values to one entry per tool so the validator can safely skip
-        # filament comparison while still checking nozzle and build plate.
-        if isinstance(loaded_filaments, int):
-            loaded_filaments = [loaded_filaments] * len(filament_types)
-        elif loaded_filaments is None:
-            loaded_filaments = [None] * len(filament_types)
-
-        if check_filament_types and not self.check_num_filaments(loaded_filaments, filament_types, filament_used):
-            return self.prompt_validation_override("There are fewer loaded filaments than the GCODE requires.")
-
-        if not self.check_num_extruders(nozzles, semm):
+        if snapshot.loaded_filaments_error is not None:
+            return self.prompt_validation_override(
+                f"Loaded filament information could not be retrieved: {snapshot.loaded_filaments_error}")
+        loaded_filaments = normalize_loaded_filaments(snapshot.loaded_filaments, len(filament_types))
+
+        if snapshot.check_filament_types:
+            passed, findings = check_num_filaments(loaded_filaments, filament_types, filament_used)
+            self.send_findings(findings)
+            if not passed:
+                return self.prompt_validation_override("There are fewer loaded filaments than the GCODE requires.")
+
+        passed, findings = check_num_extruders(nozzles, semm, snapshot.extruder_count)
+        self.send_findings(findings)
+        if not passed:
             return self.prompt_validation_override("The configured extruder count does not match the GCODE.")
 
         try:
-            # Check if the loaded filament matches the filament alert_type in the GCODE
-            for i in range(len(nozzles)):
-                if filament_used[i] is not None:
-                    # if no filament was used, assume the tool isn't used and skip the check
-                    if float(filament_used[i]) == 0:
-                        continue
-
-                if check_filament_types:
-                    filament_passed, filament_pass = self.check_filament_type(
-                        i, loaded_filaments, filament_types, gcode_info, filament_passed, mmu_single_mode)
-                    if not filament_pass:
-                        return self.prompt_validation_override(
-                            f"The loaded filament type does not match the GCODE on extruder {i + 1}.")
-
-                nozzle_passed, nozzle_pass = self.check_nozzle(i, nozzles, nozzle_passed)
-                if not nozzle_pass:
-                    return self.prompt_validation_override(
-                        f"The installed nozzle does not match the GCODE on extruder {i + 1}.")
-
-                if not self.check_build_plate(i, filament_types, gcode_info):
-                    return self.prompt_validation_override(
-                        f"The selected build plate is incompatible with extruder {i + 1}'s filament.")
-
-            # Check if the print passed all checks
-            if nozzle_passed and filament_passed and spool_passed:
-                self.send_alert("Print passed nozzle and filament check", alert_types.success)
-                self._logger.info("Print passed nozzle and filament check...")
-                return True
-
-            # If the print didn't pass all checks, pause the print
-            else:
-                out_str = ""
-                data = {
-                    "nozzle_passed": nozzle_passed, "filament_passed": filament_passed
-                }
-                for key, value in data.items():
-                    if not value:
-                        out_str += f"{key}, "
-                out_str = out_str[:-2]
-                self.send_alert(f"Not all checks passed, the following checks failed: {out_str}.\nPlease check your "
-                                f"config and press resume to continue.", alert_types.info)
-                return self.prompt_validation_override("One or more validation checks did not pass.")
-
+            evaluation = evaluate_tools(snapshot, used_tools, nozzles, filament_types, loaded_filaments,
+                                        mmu_single_mode)
         # If an error occurred while running checks, pause the print
         except Exception as e:
             return self.prompt_validation_override(f"An unexpected validation error occurred: {e}")
-
-    def check_printer_model(self, printer_model: str = None) -> bool:
-        """
-        Check if the printer model in the GCODE matches the printer model set in OctoPrint if it isn't the same,
-        cancel the print
-        :param printer_model: the printer model in the GCODE
-        :return: true if the printer model passes the check
-        """
-        if printer_model is None or printer_model == "":
-            self.send_alert("No printer model found in GCODE, printer model checking won't be performed",
-                            alert_types.info)
+        self.send_findings(evaluation.findings)
+        if evaluation.failure is not None:
+            self._logger.warning(f"Validation warning: {evaluation.failure}")
+            return self.prompt_validation_override(evaluation.failure)
+
+        # Check if the print passed all checks
+        if evaluation.nozzle_passed and evaluation.filament_passed and spool_passed:
+            self.send_alert("Print passed nozzle and filament check", alert_types.success)
+            self._logger.info("Print passed nozzle and filament check...")
             return True
 
-        elif self.get_printer_model() is None or self.get_printer_model() == "":
-            self.send_alert("No printer model set in OctoPrint, printer model checking won't be performed",
-                            alert_types.info)
-            return True
-
-        elif (printer_model is not None and printer_model.lower() != self.get_printer_model().lower() and printer_model
-              != ""):
-            if remove_mmu_from_end(self.get_printer_model().lower()).endswith("is"):
-                if not remove_mmu_from_end(printer_model.lower()).endswith("is"):
-                    self.send_alert(
-                        f"Printing with non InputShaping profile on a printer that supports input shaping",
-                        alert_types.info)
-
-            if remove_is_from_end(self.get_printer_model().lower()) != printer_model.lower():
-                self.send_alert(f"Validation warning: Incorrect printer model, {printer_model} found in gcode but "
-                                f"{self.get_printer_model()} is set.", alert_types.error)
-                return False
-        return True
-
-    def check_mmu(self, printer_model: str = None, nozzles: List[str] = None, filament_types: List[str] = None,
-                  filament_used: List[str] = None) -> Tuple[bool, bool]:
-        """
-        Check if using an mmu and handle it accordingly
-        :param printer_model: the printer model from the GCODE
-        :param nozzles: the nozzles from the GCODE
-        :param filament_types: the filament types from the GCODE
-        :param filament_used: the filament used from the GCODE
-        :return: True if the check passed, False if it didn't
-        """
-        mmu_single_mode = False
-        # Check if the printer model ends with mmu3 or mmu3s or mmu2 or mmu2s or mmu3is or mmu3sis or mmu2is or mmu2sis
-        if (printer_model and ends_with_mmu(printer_model.lower()) and len(nozzles) == 1
-                and len(filament_types) == 1 and len(
-                filament_used) == 1):
-            mmu_single_mode = True
-            self.send_alert(
-                "MMU single mode detected, skipping filament checks, please make sure you pick a tool with "
-                f"{filament_types[0]} filament", alert_types.info)
-        # Check if the number of nozzles in the GCODE is longer than the number of extruders on the printer
-        if len(nozzles) > self.extruders.get_number_of_extruders():
-            self.send_alert(f"Number of nozzles ({len(nozzles)}) in the gcode is longer than the number of extruders "
-                            f"on your machine ({self.extruders.get_number_of_extruders()})", alert_types.error)
-            return False, mmu_single_mode
-
-        return True, mmu_single_mode
-
-    def check_num_filaments(self, loaded_filaments: List[str], filament_types: List[str],
-                            filament_used: List[str], ) -> bool:
-        """
-        Check the number of filaments in the GCODE
-
-        :param loaded_filaments: The loaded filaments from the spool manager
-        :param filament_types: the filament types from the GCODE
-        :param filament_used: the filament used from the GCODE
-        :return: true if the check passed
-        """
-        # Check if the number of filament types in the GCODE is longer than the number of extruders on the printer
-        loaded_fil_length = len(loaded_filaments)
-        needed_fil_length = len(filament_types)
-
-        for i in range(len(filament_types)):
-            if filament_used[i] is not None:
-                # if no filament was used, assume the tool isn't used and skip the check
-                if float(filament_used[i]) == 0:
-                    needed_fil_length -= 1
-
-        if needed_fil_length > loaded_fil_length:
-            self.send_alert(
-                f"Loaded filaments ({loaded_fil_length}) is shorter than the number specified in the gcode "
-                f"({len(filament_types)})", alert_types.error)
-            return False
-
-        return True
-
-    def check_num_extruders(self, nozzles: List[str], semm) -> bool:
-        """
-        Check the number of extruders in the GCODE
-        :param semm: Single Extruder Multi Material
-        :param nozzles: the nozzles from the GCODE
-        :return: true if the check passed
-        """
-        if len(nozzles) > self.extruders.get_number_of_extruders():
-            self.send_alert(
-                f"Number of extruders in gcode ({len(nozzles)}) is Larger than the number specified in the "
-                f"config ({self.extruders.get_number_of_extruders()})", alert_types.error)
-            return False
-        elif len(nozzles) < self.extruders.get_number_of_extruders():
-            if not semm:
-                self.send_alert(
-                    f"Number of extruders in gcode ({len(nozzles)}) is shorter than the number specified in the "
-                    f"config ({self.extruders.get_number_of_extruders()}). Print blocked.", alert_types.error)
-                return False
-
-        return True
-
-    def check_filament_type(self, index: int, loaded_filaments: List[str], filament_types: List[str],
-                            gcode_info: Dict[str, Any], filament_passed: bool, mmu_single_mode: bool) -> Tuple[bool, bool]:
-        """
-        Check the filament type
-        :param index: the index of the extruder
-        :param loaded_filaments: the loaded filaments from the spool manager
-        :param filament_types: the filament types from the GCODE
-        :param gcode_info: the GCODE info
-        :param filament_passed: the state of filament_passed
-        :param mmu_single_mode: whether the printer is in mmu single mode
-        :return: (filament_passed, check_passed) the value filament passed and true if the check passed
-        """
-        loaded_filament = loaded_filaments[index] if loaded_filaments is not None else None
-
-        # Check if the loaded filament matches the filament alert_type in the GCODE
-        if filament_types[index] is None and filament_passed and not mmu_single_mode:
-            self.send_alert("No filament alert_type found in GCODE, error checking won't be performed",
-                            alert_types.info)
-            filament_passed = False
-
-        # Check if the loaded filament is None and filament_passed is True and mmu_single_mode is False
-        elif loaded_filament is None and filament_passed and not mmu_single_mode:
-            self.send_alert("No filament loaded, error checking won't be performed", alert_types.info)
-            return filament_passed, True
-
-        # Check if the loaded filament is -1 and filament_passed is True and mmu_single_mode is False
-        elif loaded_filament == -1 and filament_passed and not mmu_single_mode:
-            self.send_alert("Spool Manager plugin is not installed. Filament alert_type will not be checked.",
-                            alert_types.info)
-            return filament_passed, True
-
-        # Check if the loaded filament is -2 and filament_passed is True and mmu_single_mode is False
-        elif loaded_filament == -2 and filament_passed and not mmu_single_mode:
-            self.send_alert("Error retrieving loaded filament, filament error checking won't be performed",
-                            alert_types.info)
-            return filament_passed, True
-
-        # Check if the loaded filament is -3 and filament_passed is True and mmu_single_mode is False
-        if filament_passed and not mmu_single_mode:
-            if (filament_types[index].lower() != str(loaded_filament).lower() and gcode_info[
-                "filament_type"][index] is not
-                    None):
-                self.send_alert(f"Validation warning: Incorrect filament type on extruder {index + 1}. expected "
-                                f"{filament_types[index]}, but {loaded_filament} is currently loaded",
-                                alert_types.error)
-                return filament_passed, False
-
-        return filament_passed, True
-
-    def check_nozzle(self, index: int, nozzles: List[str], nozzle_passed: bool) -> Tuple[bool, bool]:
-        """
-        Check the nozzle size
-        :param index: index of the extruder
-        :param nozzles: list of nozzles from the GCODE
-        :param nozzle_passed: current state of nozzle_passed
-        :return: (nozzle_passed, check_passed) the value of nozzle_passed and true if the check passed
-        """
-
-        # Check if the loaded nozzle size matches the nozzle size in the GCODE
-        if nozzles[index] is None and nozzle_passed:
-            self.send_alert("No nozzle size found in GCODE, error checking won't be performed",
-                            alert_types.info)
-            nozzle_passed = False
-
-        # Check if the nozzle size is None and nozzle_passed is True
-        elif self.extruders.get_nozzle_size_for_extruder(index + 1) is None and nozzle_passed:
-            self.send_alert(f"No nozzle selected for extruder {index + 1}, error checking won't be performed",
-                            alert_types.info)
-            nozzle_passed = False
-
-        # Check if the nozzle size is not None and nozzle_passed is True
-        if nozzle_passed:
-            if (float(nozzles[index]) != float(self.extruders.get_nozzle_size_for_extruder(index + 1)) and
-                    nozzles[index] is
-                    not None):
-                self.send_alert(f"Validation warning: Incorrect nozzle size on extruder {index + 1}. expected "
-                                f"{nozzles[index]}mm nozzle, but"
-                                f" {self.extruders.get_nozzle_size_for_extruder(index + 1)}mm nozzle is currently "
-                                f"installed", alert_types.error)
-                return nozzle_passed, False
-        return nozzle_passed, True
-
-    def check_build_plate(self, index: int, filament_types: List[str], gcode_info: Dict[str, Any]) -> bool:
-        """
-        Check if the build plate is compatible with the loaded filament
-        :param index: index of the extruder
-        :param filament_types: filament types from the GCODE
-        :param gcode_info: gcodes info
-        :return: true if the check passed
-        """
-        # Check if the build plate is compatible with the loaded filament
-        if filament_types[index] is not None:
-            if not self.build_plate.is_filament_compatible_with_build_plate(filament_types[index]):
-                self._logger.warning("Validation warning: Incompatible build plate")
-                self.send_alert(f"Validation warning: Incompatible build plate, current plate doesn't support "
-                                f"{gcode_info['filament_type'][index]}",
-                                alert_types.error)
-                return False
-        return True
+        # If the print didn't pass all checks, pause the print
+        failed = [key for key, value in (("nozzle_passed", evaluation.nozzle_passed),
+                                         ("filament_passed", evaluation.filament_passed)) if not value]
+        self.send_alert(f"Not all checks passed, the following checks failed: {', '.join(failed)}.\nPlease check "
+                        f"your config and press resume to continue.", alert_types.info)
+        return self.prompt_validation_override("One or more validation checks did not pass.")
 
-    def check_spool_id(self, index: int, gcode_info: Dict[str, Any], passed: bool) -> Tuple[bool, bool]:
+    def check_spool_ids(self, tools: List[int], gcode_info: Dict[str, Any]) -> Tuple[bool, bool]:
         """
-        Check the spool id, if it is invalid, wait for input from the frontend
-        :param index: index of the extruder
+        Check the spool names of all used tools, every mismatch is listed in one prompt answered once
+        :param tools: the indexes of the extruders used by the GCODE
         :param gcode_info: info from the GCODE
-        :passed: the current state of passed
-        :return: true if the check passed
+        :return: (true if the print may continue, true if every spool name was found in the GCODE)
         """
-
-        if not self._filament.get_enable_spool_checking():
+        snapshot = self.get_snapshot()
+        if not snapshot.check_spool_ids or not tools:
             return True, True
 
-        timeout = self._filament.get_timeout()
-        self.update_filament_wait_status(filament_timeout.ok)
-        # parse the existing spool id from the gcode
-        filament_notes = gcode_info.get("filament_notes")
-        if not filament_notes or index >= len(filament_notes):
-            override = self.prompt_validation_override(
-                f"Filament/spool name metadata is missing for extruder {index + 1}.")
-            return override, override
-
-        raw_data = filament_notes[index]
-
-        match = re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)]", raw_data)
+        interactive = self.is_interactive()
+        timeout = snapshot.timeout
+        # parse the expected spool names from the gcode
+        filament_notes = gcode_info.get("filament_notes") or []
+        missing = [index for index in tools if index >= len(filament_notes)]
+        if missing:
+            extruder_list = ", ".join(str(index + 1) for index in missing)
+            if not self.prompt_validation_override(
+                    f"Filament/spool name metadata is missing for extruder {extruder_list}."):
+                return False, False
+
+        current_names = snapshot.spool_names
+        passed = True
+        mismatches = []
+        for index in tools:
+            if index in missing:
+                continue
+            match = re.search(r"\[\s*sm_name\s*=\s*([^]]*\S)]", filament_notes[index])
+            if not match:
+                self.send_alert(f"Spool name not found in GCODE for extruder {index + 1}. Print blocked.",
+                                alert_types.error)
+                passed = False
+                continue
+            spool_id = str(match.group(1))
+            current_name = current_names[index] if index < len(current_names) else None
+            if current_name is None or str(current_name) != spool_id:
+                mismatches.append({"spool_id": spool_id, "index": index,
+                                   "current": None if current_name is None else str(current_name)})
+
+        if not mismatches:
+            return True, passed
+        message = "; ".join(f"extruder {mismatch['index'] + 1}: {mismatch['spool_id']} "
+                            f"(loaded: {mismatch['current'] or 'None Selected'})" for mismatch in mismatches)
+        if not interactive:
+            self._record_reason(f"Selected spools do not match the GCODE, {message}", alert_types.error)
+            return False, False
 
-        current_fil_id = self._spool_manager.get_names()[index]
+        self.update_filament_wait_status(filament_timeout.waiting)
+        prompt = self.set_active_prompt(alert_types.switch_spools, message, timeout, mismatches=mismatches)
+        self._plugin_manager.send_plugin_message(self._identifier, prompt)
 
-        if match:
-            spool_id = str(match.group(1))
-            if current_fil_id is None:
-                self.update_filament_wait_status(filament_timeout.waiting)
-                message = f"{spool_id}, {index}, None Selected, {self._filament.get_timeout()}"
-                prompt = self.set_active_prompt(alert_types.switch_spools, message, timeout)
-                self._plugin_manager.send_plugin_message(self._identifier, prompt)
-
-            elif str(current_fil_id) != spool_id:
-                self.update_filament_wait_status(filament_timeout.waiting)
-                message = f"{spool_id}, {index}, {current_fil_id}, {self._filament.get_timeout()}"
-                prompt = self.set_active_prompt(alert_types.switch_spools, message, timeout)
-                self._plugin_manager.send_plugin_message(self._identifier, prompt)
-
-            while self.filament_wait_status == filament_timeout.waiting:
-                if timeout == 0:
-                    self.send_alert("Timeout reached, print cancelling", alert_types.error)
-                    return False, False
-                timeout -= 1
-                time.sleep(1)
-        else:
-            self.send_alert(f"Spool name not found in GCODE for extruder {index + 1}. Print blocked.",
-                            alert_types.error)
-            passed = False
-        if self.filament_wait_status == filament_timeout.cancel:
+        decision = self.wait_for_filament_decision(timeout)
+        if decision is None:
+            self.send_alert("Timeout reached, print cancelling", alert_types.error)
+            return False, False
+        if decision == filament_timeout.cancel:
             self.send_alert("Cancelling print", alert_types.error)
             return False, False
 
+        # The later rules see the spools the operator confirmed
+        if getattr(self._context, "snapshot", None) is snapshot:
+            self._spool_manager.invalidate()
+            loaded_filaments, loaded_filaments_error = self._read_loaded_filaments(snapshot.check_filament_types)
+            self._context.snapshot = snapshot._replace(
+                loaded_filaments=_freeze(loaded_filaments), loaded_filaments_error=loaded_filaments_error,
+                spool_names=tuple(self._spool_manager.get_names() or []))
         return True, passed
@@ -0,0 +1,146 @@
+"""
+Benchmark of the single-pass GCODE metadata extractor against the previous regex scans.
+
+The fixtures reproduce the tail layout written by PrusaSlicer, OrcaSlicer and
+SuperSlicer: the print body, the "filament used" statistics block and the
+embedded configuration block with a few hundred keys. Pass real slicer
+output with ``--file`` to benchmark it as well. Both implementations must
+return identical results for every input.
+
+Only the standard library is used. Run it from the repository root with::
+
+    python tests/bench_parse_gcode.py [--file print.gcode ...]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.validate import TAIL_LINES, extract_metadata, read_tail
+
+
+def legacy_extract(gcode_content: str) -> Dict[str, Any]:
+    """The seven regex scans parse_gcode used before the single-pass extractor."""
+    nozzle_pattern = re.compile(r'^;\s*nozzle_diameter\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+    filament_pattern = re.compile(r'^;\s*filament_type\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+    used_filament_pattern = re.compile(r'^;\s*filament used \[mm]\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+    printer_model_pattern = re.compile(r'^;\s*printer_model\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+    skip_validation_pattern = re.compile(r'^;\s*skip_validation\s*$', re.MULTILINE | re.IGNORECASE)
+    filament_notes_pattern = re.compile(r'^;\s*filament_notes\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+    single_extruder_multi_material_pattern = re.compile(
+        r'^;\s*single_extruder_multi_material\s*=\s*(.+)$', re.MULTILINE | re.IGNORECASE)
+
+    nozzle_match = nozzle_pattern.search(gcode_content)
+    filament_match = filament_pattern.search(gcode_content)
+    filament_used_match = used_filament_pattern.search(gcode_content)
+    printer_model_match = printer_model_pattern.search(gcode_content)
+    filament_notes_match = filament_notes_pattern.search(gcode_content)
+    semm_match = single_extruder_multi_material_pattern.search(gcode_content)
+    semm = None
+    if semm_match:
+        semm = semm_match.group(1).replace(" ", "").strip() == "1"
+    return {
+        "nozzle_size": nozzle_match.group(1).replace(" ", "").strip().split(',') if nozzle_match else None,
+        "filament_type": filament_match.group(1).strip().split(';') if filament_match else None,
+        "filament_used": (filament_used_match.group(1).replace(" ", "").strip().split(',')
+                          if filament_used_match else None),
+        "printer_model": printer_model_match.group(1).strip() if printer_model_match else None,
+        "skip_validation": bool(skip_validation_pattern.search(gcode_content)),
+        "filament_notes": filament_notes_match.group(1).strip().split(';') if filament_notes_match else None,
+        "single_extruder_multi_material": semm,
+    }
+
+
+def _body(lines: int) -> List[str]:
+    return [f"G1 X{i % 250}.{i % 1000:03d} Y{i % 210}.{i % 997:03d} E0.{i % 9973:04d}" for i in range(lines)]
+
+
+def _config(settings: Dict[str, str], filler: int) -> List[str]:
+    config = [f"; {key} = {value}" for key, value in settings.items()]
+    config += [f"; setting_{i} = {i * 0.25}" for i in range(filler)]
+    return sorted(config)
+
+
+def prusaslicer() -> str:
+    settings = {
+        "filament_notes": '"[sm_name = Galaxy Black]"', "filament_type": "PETG", "nozzle_diameter": "0.4",
+        "printer_model": "MK4IS", "single_extruder_multi_material": "0",
+        "start_gcode": "M17\\nG90\\nM83", "thumbnails": "16x16/QOI, 313x173/QOI, 440x240/QOI",
+    }
+    return "\n".join(_body(20000) + [
+        "; filament used [mm] = 5320.77", "; filament used [cm3] = 12.80", "; filament used [g] = 16.26",
+        "; total filament cost = 0.40", "; estimated printing time (normal mode) = 1h 2m 3s",
+        "", "; prusaslicer_config = begin"] + _config(settings, 320) + ["; prusaslicer_config = end", ""])
+
+
+def orcaslicer() -> str:
+    settings = {
+        "filament_notes": '"[sm_name = PLA Basic Red];[sm_name = PLA Basic White]"', "filament_type": "PLA;PLA",
+        "nozzle_diameter": "0.4,0.4", "printer_model": "Bambu Lab X1 Carbon",
+        "single_extruder_multi_material": "1", "filament_colour": "#FF0000;#FFFFFF",
+    }
+    return "\n".join(_body(20000) + [
+        "; filament used [mm] = 2110.41, 310.02", "; filament used [g] = 6.29, 0.92",
+        "; total filament used [g] = 7.21", "; total layers count = 120", "",
+        "; CONFIG_BLOCK_START"] + _config(settings, 450) + ["; CONFIG_BLOCK_END", ""])
+
+
+def superslicer() -> str:
+    settings = {
+        "filament_notes": '""', "filament_type": "ABS", "nozzle_diameter": "0.6",
+        "printer_model": "Voron_v2_350", "single_extruder_multi_material": "0",
+    }
+    return "\n".join(_body(20000) + [
+        "; filament used [mm] = 10234.11", "; filament used [cm3] = 24.62", "; filament used [g] = 25.36",
+        "; total filament used [g] = 25.36", "", "; SuperSlicer_config = begin"]
+        + _config(settings, 380) + ["; SuperSlicer_config = end", ""])
+
+
+def time_call(function: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    result = None
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", action="append", default=[], help="additional GCODE files to benchmark")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per implementation, the best is reported")
+    args = parser.parse_args(argv)
+
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = []
+        for name, generator in (("PrusaSlicer", prusaslicer), ("OrcaSlicer", orcaslicer),
+                                ("SuperSlicer", superslicer)):
+            path = os.path.join(directory, f"{name}.gcode")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(generator())
+            inputs.append((name, path))
+        inputs += [(os.path.basename(path), path) for path in args.file]
+
+        print(f"{'input':<24}{'regex scans':>14}{'single pass':>14}{'speedup':>10}")
+        for name, path in inputs:
+            tail = read_tail(path, TAIL_LINES)
+            legacy_time, legacy_result = time_call(lambda: legacy_extract(tail), args.repeat)
+            single_time, single_result = time_call(lambda: extract_metadata(tail.split("\n")), args.repeat)
+            print(f"{name:<24}{legacy_time * 1e6:>11.1f} us{single_time * 1e6:>11.1f} us"
+                  f"{legacy_time / single_time:>9.1f}x")
+            if legacy_result != single_result:
+                mismatches += 1
+                print(f"  MISMATCH\n  regex:       {legacy_result}\n  single pass: {single_result}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
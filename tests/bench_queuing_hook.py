@@ -0,0 +1,199 @@
+"""
+Microbenchmark for the per-command cost of the GCODE queuing hook.
+
+``validate_before_queuing`` runs on OctoPrint's comm thread for every line of
+every job, so it must stay cheap once a job has been validated. This script
+drives the hook with the same stubs as ``test_preflight.py`` and a synthetic
+job made of realistic command/tag mixes, then reports the cost per command.
+
+Only the standard library is used. Run it from the repository root with::
+
+    python tests/bench_queuing_hook.py --commands 1000000
+
+The exit status is non-zero when any of the configured budgets is exceeded.
+"""
+import argparse
+import array
+import gc
+import itertools
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TESTS_DIR, os.path.dirname(TESTS_DIR)]
+
+from test_preflight import Nozzle_filament_validatorPlugin, _Comm, _Printer, _Validator  # noqa: E402
+
+# (command, gcode, tags) of one synthetic job: a short job start, a long body of
+# file lines with interleaved temperature polling and a cancellation at the end.
+JOB_START = [
+    ("M110 N0", "M110", {"source:job", "trigger:comm.reset_line_numbers"}),
+    ("M117 Printing", "M117", {"source:job", "script:beforePrintStarted"}),
+]
+JOB_BODY = [
+    ("G1 X10.123 Y20.456 E0.0321", "G1", {"source:file", "filepos:1024", "fileline:42"}),
+    ("G1 X11.000 Y21.000 E0.0312", "G1", {"source:file", "filepos:1056", "fileline:43"}),
+    ("G0 F9000 X15 Y25", "G0", {"source:file", "filepos:1088", "fileline:44"}),
+    ("M105", "M105", {"trigger:comm.poll_temperature"}),
+    ("G1 Z0.4 F720", "G1", {"source:file", "filepos:1120", "fileline:45"}),
+    ("M73 P12 R34", "M73", {"source:file", "filepos:1152", "fileline:46"}),
+]
+JOB_END = [
+    ("M400", "M400", {"source:job", "trigger:cancel"}),
+    ("M104 S0", "M104", {"source:job", "script:afterPrintCancelled"}),
+]
+
+
+def make_plugin(path: str) -> Tuple[Nozzle_filament_validatorPlugin, _Comm]:
+    """
+    Create a plugin with a passing validator and a comm stub for one job
+    :param path: the path of the simulated job
+    :return: the plugin and the comm stub
+    """
+    plugin = Nozzle_filament_validatorPlugin()
+    plugin.validator = _Validator(True)
+    plugin._printer = _Printer()
+    plugin._logger = logging.getLogger("nfv-benchmark")
+    return plugin, _Comm(path)
+
+
+def make_commands(count: int) -> List[Tuple[str, str, set]]:
+    """
+    Build the command stream of a job with ``count`` commands
+    :param count: the total number of commands
+    :return: a list of (command, gcode, tags) tuples
+    """
+    body_count = max(0, count - len(JOB_START) - len(JOB_END))
+    body = list(itertools.islice(itertools.cycle(JOB_BODY), body_count))
+    return JOB_START + body + JOB_END
+
+
+def _noop(comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs) -> None:
+    return None
+
+
+def run_loop(hook: Any, comm: Any, commands: List[Tuple[str, str, set]]) -> int:
+    """
+    Call the hook once per command
+    :return: the elapsed time in ns
+    """
+    start = time.perf_counter_ns()
+    for cmd, gcode, tags in commands:
+        hook(comm, "queuing", cmd, None, gcode, tags=tags)
+    return time.perf_counter_ns() - start
+
+
+def measure_latencies(hook: Any, comm: Any, commands: List[Tuple[str, str, set]]) -> array.array:
+    """
+    Time every call individually
+    :return: the per-call latencies in ns
+    """
+    clock = time.perf_counter_ns
+    latencies = array.array("q", bytes(8 * len(commands)))
+    for index, (cmd, gcode, tags) in enumerate(commands):
+        start = clock()
+        hook(comm, "queuing", cmd, None, gcode, tags=tags)
+        latencies[index] = clock() - start
+    return latencies
+
+
+def measure_allocations(hook: Any, comm: Any, commands: List[Tuple[str, str, set]]) -> Tuple[float, float]:
+    """
+    Measure the memory allocated while the hook runs
+    :return: (peak bytes allocated per call, blocks retained per call)
+    """
+    tracemalloc.start()
+    try:
+        peak_total = 0
+        before_blocks = sys.getallocatedblocks()
+        for cmd, gcode, tags in commands:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            hook(comm, "queuing", cmd, None, gcode, tags=tags)
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        retained = sys.getallocatedblocks() - before_blocks
+    finally:
+        tracemalloc.stop()
+    return peak_total / len(commands), retained / len(commands)
+
+
+def percentile(sorted_values: array.array, fraction: float) -> int:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(commands_count: int, allocation_sample: int) -> Dict[str, float]:
+    """
+    Run the benchmark
+    :param commands_count: the number of commands to send through the hook
+    :param allocation_sample: the number of commands traced for allocations
+    :return: the measured results
+    """
+    commands = make_commands(commands_count)
+    gc.disable()
+    try:
+        plugin, comm = make_plugin("print.gcode")
+        baseline_ns = run_loop(_noop, comm, commands)
+        hook_ns = run_loop(plugin.validate_before_queuing, comm, commands)
+
+        plugin, comm = make_plugin("print.gcode")
+        latencies = sorted(measure_latencies(plugin.validate_before_queuing, comm, commands))
+
+        plugin, comm = make_plugin("print.gcode")
+        alloc_bytes, retained_blocks = measure_allocations(
+            plugin.validate_before_queuing, comm, commands[:allocation_sample])
+    finally:
+        gc.enable()
+
+    return {
+        "commands": len(commands),
+        "ns_per_command": hook_ns / len(commands),
+        "overhead_ns_per_command": (hook_ns - baseline_ns) / len(commands),
+        "p50_ns": percentile(latencies, 0.50),
+        "p99_ns": percentile(latencies, 0.99),
+        "alloc_bytes_per_call": alloc_bytes,
+        "retained_blocks_per_call": retained_blocks,
+        "validations": plugin.validator.calls,
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commands", type=int, default=1_000_000, help="number of commands per run")
+    parser.add_argument("--allocation-sample", type=int, default=20_000,
+                        help="number of commands traced with tracemalloc")
+    parser.add_argument("--max-ns", type=float, default=1000.0, help="budget for the mean ns per command")
+    parser.add_argument("--max-p99-ns", type=float, default=2000.0, help="budget for the p99 latency in ns")
+    parser.add_argument("--max-alloc-bytes", type=float, default=512.0,
+                        help="budget for the bytes allocated per call")
+    parser.add_argument("--max-retained-blocks", type=float, default=0.01,
+                        help="budget for the memory blocks retained per call")
+    args = parser.parse_args(argv)
+
+    results = run(args.commands, args.allocation_sample)
+    print(f"commands:              {results['commands']}")
+    print(f"ns/command:            {results['ns_per_command']:.1f} "
+          f"(hook overhead {results['overhead_ns_per_command']:.1f})")
+    print(f"p50 latency:           {results['p50_ns']} ns")
+    print(f"p99 latency:           {results['p99_ns']} ns")
+    print(f"allocated bytes/call:  {results['alloc_bytes_per_call']:.1f}")
+    print(f"retained blocks/call:  {results['retained_blocks_per_call']:.4f}")
+
+    failures = [f"{name} {value:.1f} > {budget:.1f}" for name, value, budget in (
+        ("ns/command", results["ns_per_command"], args.max_ns),
+        ("p99", results["p99_ns"], args.max_p99_ns),
+        ("allocated bytes/call", results["alloc_bytes_per_call"], args.max_alloc_bytes),
+        ("retained blocks/call", results["retained_blocks_per_call"], args.max_retained_blocks),
+    ) if value > budget]
+    if results["validations"] != 1:
+        failures.append(f"the job was validated {results['validations']} times instead of once")
+    for failure in failures:
+        print(f"BUDGET EXCEEDED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
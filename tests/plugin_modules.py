@@ -0,0 +1,46 @@
+"""
+Import the plugin modules in tests without executing the package initializer.
+
+OctoPrint itself is intentionally not a test dependency. The initializer only
+imports the OctoPrint-dependent plugin implementation in ``__plugin_load__``,
+the placeholder keeps the module tests independent of it entirely. Import the
+modules under test inside ``plugin_modules()``::
+
+    with plugin_modules():
+        from octoprint_nfv.validate import validator
+
+The placeholder package is removed again afterwards so test modules collected
+later, like ``test_preflight.py``, can still import the real plugin package.
+"""
+import contextlib
+import sys
+import types
+from pathlib import Path
+from typing import Iterator
+
+PACKAGE_ROOT = Path(__file__).resolve().parents[1] / "octoprint_nfv"
+
+
+def placeholder_package() -> types.ModuleType:
+    """
+    Create a package that finds the plugin modules but doesn't run octoprint_nfv/__init__.py
+    :return: the package module
+    """
+    package = types.ModuleType("octoprint_nfv")
+    package.__path__ = [str(PACKAGE_ROOT)]
+    return package
+
+
+@contextlib.contextmanager
+def plugin_modules() -> Iterator[None]:
+    """
+    Install the placeholder package while the plugin modules are imported, unless a package is already loaded
+    """
+    installed = "octoprint_nfv" not in sys.modules
+    if installed:
+        sys.modules["octoprint_nfv"] = placeholder_package()
+    try:
+        yield
+    finally:
+        if installed:
+            del sys.modules["octoprint_nfv"]
@@ -0,0 +1,143 @@
+import sqlite3
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.db import (commit_change, connection_manager, get_db, get_generation, get_manager, init_db,
+                                  subscribe)
+
+
+class ConnectionManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.manager = connection_manager(str(Path(self.temp_dir.name) / "test.db"))
+        self.addCleanup(self.manager.close_all)
+        with self.manager.transaction() as cursor:
+            cursor.execute("CREATE TABLE items (name TEXT)")
+
+    def test_thread_reuses_its_released_connection_in_wal_mode(self):
+        con = self.manager.acquire()
+        self.manager.release(con)
+        self.assertIs(con, self.manager.acquire())
+        self.assertEqual("wal", con.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual(1, self.manager.stats()["opened_connections"])
+
+    def test_threads_get_their_own_connection(self):
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(self.manager.acquire()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.manager.acquire())
+        self.assertEqual(1, self.manager.stats()["open_connections"])
+
+    def test_failed_transaction_is_rolled_back(self):
+        with self.assertRaises(ValueError):
+            with self.manager.transaction() as cursor:
+                cursor.execute("INSERT INTO items (name) VALUES ('lost')")
+                raise ValueError()
+        with self.manager.transaction() as cursor:
+            cursor.execute("INSERT INTO items (name) VALUES ('kept')")
+        rows = self.manager.acquire().execute("SELECT name FROM items").fetchall()
+        self.assertEqual([("kept",)], rows)
+        self.assertEqual(3, self.manager.stats()["transactions"])
+
+    def test_close_all_closes_every_connection(self):
+        connection = self.manager.acquire()
+        self.manager.release(connection)
+        self.manager.close_all()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+        self.manager.release(connection)
+        self.assertIsNot(connection, self.manager.acquire())
+
+
+class GetDbTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = self.temp_dir.name
+        self.addCleanup(lambda: get_manager(self.path).close_all())
+        con = get_db(self.path)
+        con.execute("CREATE TABLE items (name TEXT)")
+        con.commit()
+        con.close()
+
+    def test_closing_a_borrowed_connection_discards_its_changes(self):
+        first = get_db(self.path)
+        first.execute("INSERT INTO items (name) VALUES ('uncommitted')")
+        first.close()
+        second = get_db(self.path)
+        self.assertEqual([], second.execute("SELECT name FROM items").fetchall())
+        second.close()
+
+    def test_borrowers_on_one_thread_are_isolated(self):
+        outer = get_db(self.path)
+        outer.execute("INSERT INTO items (name) VALUES ('outer')")
+        inner = get_db(self.path)
+        self.assertIsNot(outer._connection, inner._connection)
+        self.assertEqual([], inner.execute("SELECT name FROM items").fetchall())
+        inner.close()
+        outer.commit()
+        outer.close()
+        con = get_db(self.path)
+        self.assertEqual([("outer",)], con.execute("SELECT name FROM items").fetchall())
+        con.close()
+
+    def test_dropped_borrower_gives_the_connection_back(self):
+        con = get_db(self.path)
+        connection = con._connection
+        con.execute("INSERT INTO items (name) VALUES ('dropped')")
+        del con
+        self.assertIs(connection, get_manager(self.path).acquire())
+        self.assertFalse(connection.in_transaction)
+
+    def test_borrowed_connection_is_a_context_manager(self):
+        con = get_db(self.path)
+        with con:
+            con.execute("INSERT INTO items (name) VALUES ('committed')")
+        self.assertFalse(con.in_transaction)
+        con.close()
+        con = get_db(self.path)
+        with self.assertRaises(ValueError):
+            with con:
+                con.execute("INSERT INTO items (name) VALUES ('rolled back')")
+                raise ValueError()
+        self.assertEqual([("committed",)], con.execute("SELECT name FROM items").fetchall())
+        con.close()
+
+
+class GenerationTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = self.temp_dir.name
+        self.addCleanup(lambda: get_manager(self.path).close_all())
+        init_db(self.path)
+
+    def test_change_is_committed_with_a_new_generation(self):
+        con = get_db(self.path)
+        con.execute("INSERT INTO nozzles (size) VALUES (0.4)")
+        self.assertEqual(1, commit_change(self.path, con))
+        self.assertEqual(1, get_generation(self.path))
+        self.assertEqual([(0.4,)], con.execute("SELECT size FROM nozzles").fetchall())
+
+    def test_subscribers_are_notified_until_they_unsubscribe(self):
+        generations = []
+        unsubscribe = subscribe(self.path, generations.append)
+        con = get_db(self.path)
+        con.execute("INSERT INTO nozzles (size) VALUES (0.4)")
+        commit_change(self.path, con)
+        unsubscribe()
+        con.execute("INSERT INTO nozzles (size) VALUES (0.6)")
+        commit_change(self.path, con)
+        self.assertEqual([1], generations)
+        self.assertEqual(2, get_generation(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
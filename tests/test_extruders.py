@@ -0,0 +1,61 @@
+import logging
+import tempfile
+import unittest
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.db import get_generation, get_manager, init_db
+    from octoprint_nfv.extruders import extruders
+    from octoprint_nfv.nozzle import nozzle
+
+
+class _Profiles:
+    def __init__(self, count, shared_nozzle):
+        self.profile = {"extruder": {"count": count, "sharedNozzle": shared_nozzle}}
+
+    def get_current_or_default(self):
+        return self.profile
+
+
+class ReconciliationTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.data_folder = self.temp_dir.name
+        self.addCleanup(lambda: get_manager(self.data_folder).close_all())
+        init_db(self.data_folder)
+        logger = logging.getLogger("nfv-tests")
+        self.nozzle = nozzle(self.data_folder, logger)
+        self.nozzle.add_nozzle_to_database(0.4)
+        self.nozzle.add_nozzle_to_database(0.6)
+        self.profiles = _Profiles(3, False)
+        self.extruders = extruders(self.nozzle, self.data_folder, logger, self.profiles)
+
+    def positions(self):
+        return sorted((row["extruder_position"], row["nozzle_id"])
+                      for row in self.extruders.fetch_extruders_from_database())
+
+    def test_missing_and_extra_extruders_are_reconciled(self):
+        self.extruders.update_data()
+        self.assertEqual([(1, 1), (2, 1), (3, 1)], self.positions())
+        self.profiles.profile["extruder"]["count"] = 2
+        self.extruders.update_data()
+        self.assertEqual([(1, 1), (2, 1)], self.positions())
+
+    def test_single_tool_head_shares_the_first_nozzle(self):
+        self.extruders.update_data()
+        self.extruders.set_nozzle_for_extruder(1, 2)
+        self.profiles.profile["extruder"]["sharedNozzle"] = True
+        self.extruders.update_data()
+        self.assertEqual([(1, 2), (2, 2), (3, 2)], self.positions())
+
+    def test_unchanged_extruders_keep_the_generation(self):
+        self.extruders.update_data()
+        generation = get_generation(self.data_folder)
+        self.extruders.update_data()
+        self.assertEqual(generation, get_generation(self.data_folder))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.build_plate import build_plate
+    from octoprint_nfv.db import get_manager, init_db
+    from octoprint_nfv.filament import filament
+    from octoprint_nfv.hardware_state import hardware_state
+    from octoprint_nfv.nozzle import nozzle
+    from octoprint_nfv.validate import validator
+
+VALID_GCODE = """; nozzle_diameter = 0.4
+; filament_type = PLA
+; filament used [mm] = 100.0
+; printer_model = Test Printer
+G28
+"""
+
+
+class _Profiles:
+    def get_current_or_default(self):
+        return {"model": "Test Printer", "extruder": {"count": 1, "sharedNozzle": False}}
+
+
+class _Extruders:
+    def get_number_of_extruders(self):
+        return 1
+
+
+class _SpoolManager:
+    def get_loaded_filaments(self):
+        return -1
+
+
+class _PluginManager:
+    def send_plugin_message(self, identifier, message):
+        pass
+
+
+class HardwareStateTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.data_folder = self.temp_dir.name
+        self.addCleanup(lambda: get_manager(self.data_folder).close_all())
+        logger = logging.getLogger("nfv-tests")
+        init_db(self.data_folder)
+        self.nozzle = nozzle(self.data_folder, logger)
+        self.build_plate = build_plate(self.data_folder, logger)
+        self.filament = filament(self.data_folder, logger)
+        self.nozzle.add_nozzle_to_database(0.4)
+        self.nozzle.add_nozzle_to_database(0.6)
+        self.build_plate.insert_build_plate_to_database("Generic", "PLA,PETG", "1")
+        with get_manager(self.data_folder).transaction() as cursor:
+            cursor.execute("INSERT INTO current_selections (id, selection) VALUES ('build_plate', 1)")
+            cursor.execute("INSERT INTO extruders (nozzle_id, extruder_position) VALUES (1, 1)")
+        self.filament.initial_db_add(False, 300, True)
+        self.state = hardware_state(self.data_folder, logger)
+        self.addCleanup(self.state.close)
+        self.state.refresh()
+
+    def test_snapshot_mirrors_the_database(self):
+        snapshot = self.state.snapshot()
+        self.assertEqual(0.4, snapshot.get_nozzle_size_for_extruder(1))
+        self.assertIsNone(snapshot.get_nozzle_size_for_extruder(2))
+        self.assertTrue(snapshot.is_filament_compatible_with_build_plate("PETG"))
+        self.assertFalse(snapshot.is_filament_compatible_with_build_plate("ABS"))
+        self.assertEqual(300, snapshot.get_timeout())
+        self.assertFalse(snapshot.get_enable_spool_checking())
+        self.assertTrue(snapshot.get_enable_filament_type_checking())
+
+    def test_refresh_replaces_the_snapshot_as_a_whole(self):
+        before = self.state.snapshot()
+        self.filament.update_timeout(60)
+        after = self.state.refresh()
+        self.assertEqual(300, before.get_timeout())
+        self.assertEqual(60, after.get_timeout())
+        self.assertGreater(after.generation, before.generation)
+
+    def test_writes_refresh_the_snapshot(self):
+        before = self.state.generation()
+        self.build_plate.insert_build_plate_to_database("Textured", "PETG", "1")
+        snapshot = self.state.snapshot()
+        self.assertGreater(snapshot.generation, before)
+        self.assertFalse(snapshot.is_filament_compatible_with_build_plate("PLA"))
+
+    def test_existing_filament_settings_are_not_a_change(self):
+        before = self.state.generation()
+        self.filament.initial_db_add(True, 60, False)
+        self.assertEqual(before, self.state.refresh().generation)
+        self.assertEqual(300, self.state.snapshot().get_timeout())
+
+    def test_validation_reads_only_the_snapshot(self):
+        # The database classes are absent, any database read would fail the validation
+        check = validator(nozzle=None, build_plate=None, extruders=_Extruders(), spool_manager=_SpoolManager(),
+                          filament=None, printer=None, logger=logging.getLogger("nfv-tests"),
+                          plugin_manager=_PluginManager(), identifier="nfv", printer_profile_manager=_Profiles(),
+                          hardware_state=self.state)
+        path = Path(self.data_folder) / "print.gcode"
+        path.write_text(VALID_GCODE, encoding="utf-8")
+        self.assertTrue(check.check_print(str(path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import logging
+import threading
+import unittest
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.constants import library_validation_state
+    from octoprint_nfv.library_validation import library_validation
+
+
+class _Validator:
+    def __init__(self):
+        self.snapshots = 0
+        self.validated = []
+        self._lock = threading.Lock()
+
+    def capture_snapshot(self):
+        self.snapshots += 1
+        return "snapshot"
+
+    def explain_metadata(self, gcode_info, snapshot):
+        with self._lock:
+            self.validated.append((gcode_info["path"], snapshot, threading.current_thread().name))
+        if gcode_info["path"].endswith("petg.gcode"):
+            return False, ["The selected build plate is incompatible with extruder 1's filament."]
+        return True, []
+
+
+class _MetadataCache:
+    def __init__(self):
+        self.parsed = []
+
+    def get_or_parse(self, path):
+        self.parsed.append((path, threading.current_thread().name))
+        if path.endswith("broken.gcode"):
+            raise OSError("unreadable")
+        if path.endswith("corrupt.gcode"):
+            raise RuntimeError("parser bug")
+        return {"path": path}
+
+
+def make_job(files, validator=None, messages=None, cache=None):
+    messages = [] if messages is None else messages
+    return library_validation(1, [(path, f"/disk/{path}") for path in files], validator or _Validator(),
+                              cache or _MetadataCache(), messages.append, logging.getLogger("nfv-tests"))
+
+
+class LibraryValidationTests(unittest.TestCase):
+    def test_every_file_is_validated_against_one_snapshot(self):
+        validator = _Validator()
+        messages = []
+        job = make_job(["a/pla.gcode", "a/petg.gcode", "b/pla.gcode"], validator, messages)
+        job.run()
+
+        self.assertEqual(1, validator.snapshots)
+        self.assertEqual({"snapshot"}, {snapshot for _, snapshot, _ in validator.validated})
+        status = job.status()
+        self.assertEqual(library_validation_state.done, status["state"])
+        self.assertEqual((3, 3, 2), (status["done"], status["total"], status["printable"]))
+        verdicts = {result["path"]: result for result in status["results"]}
+        self.assertFalse(verdicts["a/petg.gcode"]["printable"])
+        self.assertEqual(1, len(verdicts["a/petg.gcode"]["reasons"]))
+
+    def test_files_are_parsed_and_checked_on_the_job_workers(self):
+        validator = _Validator()
+        cache = _MetadataCache()
+        make_job(["pla.gcode", "petg.gcode"], validator, cache=cache).run()
+        threads = {thread for _, thread in cache.parsed} | {thread for _, _, thread in validator.validated}
+        self.assertTrue(all(thread.startswith("nfv-library") for thread in threads))
+
+    def test_progress_messages_carry_each_verdict_once(self):
+        messages = []
+        job = make_job(["pla.gcode", "petg.gcode"], messages=messages)
+        job.run()
+        self.assertEqual(library_validation_state.done, messages[-1]["state"])
+        self.assertEqual(["petg.gcode", "pla.gcode"],
+                         sorted(result["path"] for message in messages for result in message["results"]))
+
+    def test_a_failing_file_does_not_stop_the_job(self):
+        job = make_job(["broken.gcode", "pla.gcode"])
+        job.run()
+        verdicts = {result["path"]: result for result in job.status()["results"]}
+        self.assertFalse(verdicts["broken.gcode"]["printable"])
+        self.assertIn("unreadable", verdicts["broken.gcode"]["reasons"][0])
+        self.assertTrue(verdicts["pla.gcode"]["printable"])
+        self.assertEqual(library_validation_state.done, job.state)
+
+    def test_an_unexpected_parse_error_fails_only_that_file(self):
+        job = make_job(["corrupt.gcode", "pla.gcode"])
+        with self.assertLogs("nfv-tests", level="ERROR"):
+            job.run()
+        verdicts = {result["path"]: result for result in job.status()["results"]}
+        self.assertFalse(verdicts["corrupt.gcode"]["printable"])
+        self.assertIn("parser bug", verdicts["corrupt.gcode"]["reasons"][0])
+        self.assertTrue(verdicts["pla.gcode"]["printable"])
+        self.assertEqual(library_validation_state.done, job.state)
+
+    def test_cancelled_job_skips_the_remaining_files(self):
+        validator = _Validator()
+        job = make_job(["pla.gcode", "petg.gcode"], validator)
+        job.cancel()
+        job.run()
+        self.assertEqual([], validator.validated)
+        self.assertEqual(library_validation_state.cancelled, job.state)
+        self.assertEqual(0, job.status()["printable"])
+
+
+if __name__ == "__main__":
+    unittest.main()
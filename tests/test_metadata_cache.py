@@ -0,0 +1,96 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.metadata_cache import METADATA_DATABASE_FILE, metadata_cache
+
+
+class _Parser:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        return {"printer_model": Path(path).read_text(encoding="utf-8").strip(), "nozzle_size": ["0.4"]}
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.data_folder = os.path.join(self.temp_dir.name, "data")
+        self.parser = _Parser()
+        self.cache = self.make_cache()
+
+    def make_cache(self, **limits):
+        return metadata_cache(self.data_folder, logging.getLogger("nfv-tests"), **limits)
+
+    def write_gcode(self, name, content):
+        path = Path(self.temp_dir.name) / name
+        path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def test_unchanged_file_is_parsed_once_across_restarts(self):
+        path = self.write_gcode("a.gcode", "MK4")
+        self.assertEqual("MK4", self.cache.get_or_parse(path, self.parser)["printer_model"])
+        self.assertEqual("MK4", self.make_cache().get_or_parse(path, self.parser)["printer_model"])
+        self.assertEqual(1, self.parser.calls)
+
+    def test_changed_file_is_parsed_again(self):
+        path = self.write_gcode("a.gcode", "MK4")
+        self.cache.get_or_parse(path, self.parser)
+        self.write_gcode("a.gcode", "MK3S+")
+        self.assertEqual("MK3S+", self.cache.get_or_parse(path, self.parser)["printer_model"])
+        self.assertEqual(2, self.parser.calls)
+
+    def test_deleted_file_is_dropped(self):
+        path = self.write_gcode("a.gcode", "MK4")
+        self.cache.get_or_parse(path, self.parser)
+        os.remove(path)
+        self.assertIsNone(self.cache.get(path))
+        self.write_gcode("a.gcode", "MK4")
+        self.assertIsNone(self.cache.get(path))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        paths = [self.write_gcode(f"{name}.gcode", name) for name in ("a", "b", "c")]
+        cache.get_or_parse(paths[0], self.parser)
+        cache.get_or_parse(paths[1], self.parser)
+        cache.get_or_parse(paths[0], self.parser)
+        cache.get_or_parse(paths[2], self.parser)
+        self.assertIsNotNone(cache.get(paths[0]))
+        self.assertIsNone(cache.get(paths[1]))
+
+    def test_hits_are_written_in_batches(self):
+        path = self.write_gcode("a.gcode", "MK4")
+        self.cache.get_or_parse(path, self.parser)
+        stored = self.last_used(path)
+        self.assertIsNotNone(self.cache.get(path))
+        self.assertEqual(stored, self.last_used(path))
+        self.cache.flush()
+        self.assertLess(stored, self.last_used(path))
+
+    def last_used(self, path):
+        con = sqlite3.connect(os.path.join(self.data_folder, METADATA_DATABASE_FILE))
+        try:
+            return con.execute("SELECT last_used FROM gcode_metadata WHERE path = ?", (path,)).fetchone()[0]
+        finally:
+            con.close()
+
+    def test_byte_limit_bounds_the_cache(self):
+        cache = self.make_cache(max_bytes=100)
+        paths = [self.write_gcode(f"{name}.gcode", name * 20) for name in ("a", "b")]
+        cache.get_or_parse(paths[0], self.parser)
+        cache.get_or_parse(paths[1], self.parser)
+        self.assertIsNone(cache.get(paths[0]))
+        self.assertIsNotNone(cache.get(paths[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import logging
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from pathlib import Path
+
+from octoprint_nfv.parse_worker import parse_worker_pool
+from octoprint_nfv.validate import parse_gcode
+
+VALID_GCODE = """; nozzle_diameter = 0.4
+; filament_type = PLA
+; filament used [mm] = 100.0
+; printer_model = Test Printer
+"""
+
+
+def _plugin_stack_modules():
+    return sorted(name for name in sys.modules if name.split(".")[0] in ("flask", "flask_login", "octoprint"))
+
+
+class ParseWorkerTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = str(Path(self.temp_dir.name) / "print.gcode")
+        Path(self.path).write_text(VALID_GCODE, encoding="utf-8")
+        # The default spawn context, the workers import the package like they do in OctoPrint
+        self.pool = parse_worker_pool(logging.getLogger("nfv-tests"), timeout=10)
+        self.addCleanup(self.pool.close)
+
+    def test_worker_returns_the_metadata(self):
+        self.assertEqual(parse_gcode(self.path), self.pool.parse(self.path))
+        self.assertEqual(1, self.pool.stats()["worker_parses"])
+        self.assertEqual({}, self.pool._futures)
+
+    def test_worker_does_not_load_the_plugin_stack(self):
+        self.pool.parse(self.path)
+        loaded = self.pool._get_executor().submit(_plugin_stack_modules).result(timeout=10)
+        self.assertEqual([], loaded)
+
+    def test_parse_errors_reach_the_caller(self):
+        with self.assertRaises(OSError):
+            self.pool.parse(str(Path(self.temp_dir.name) / "missing.gcode"))
+        self.assertEqual(0, self.pool.stats()["fallbacks"])
+
+    def test_crashed_worker_falls_back_and_restarts(self):
+        self.pool.parse(self.path)
+        for process in self.pool._executor._processes.values():
+            process.kill()
+            process.join()
+        self.assertEqual(parse_gcode(self.path), self.pool.parse(self.path))
+        self.assertEqual(parse_gcode(self.path), self.pool.parse(self.path))
+        stats = self.pool.stats()
+        self.assertEqual(1, stats["restarts"])
+        self.assertEqual(2, stats["worker_parses"])
+
+    def test_close_cancels_the_queued_parses(self):
+        queued = Future()
+        self.pool._futures[queued] = self.pool._get_executor()
+        self.pool.close()
+        self.assertTrue(queued.cancelled())
+
+    def test_closed_pool_parses_in_process(self):
+        self.pool.close()
+        self.assertEqual(parse_gcode(self.path), self.pool.parse(self.path))
+        self.assertEqual(1, self.pool.stats()["fallbacks"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
+import io
 import logging
 import sys
 import tempfile
+import threading
+import time
 import types
 import unittest
 from pathlib import Path
@@ -21,7 +24,7 @@ def _install_octoprint_stubs():
 
     plugin = types.ModuleType("octoprint.plugin")
     for name in ("StartupPlugin", "SettingsPlugin", "AssetPlugin", "TemplatePlugin",
-                 "SimpleApiPlugin", "EventHandlerPlugin"):
+                 "SimpleApiPlugin", "EventHandlerPlugin", "ShutdownPlugin"):
         setattr(plugin, name, type(name, (), {}))
 
     octoprint = types.ModuleType("octoprint")
@@ -31,17 +34,41 @@ def _install_octoprint_stubs():
 
     events = types.ModuleType("octoprint.events")
     events.Events = types.SimpleNamespace(
+        PRINT_CANCELLING="PrintCancelling",
         PRINT_CANCELLED="PrintCancelled",
         PRINT_DONE="PrintDone",
         PRINT_FAILED="PrintFailed",
         CONNECTED="Connected",
+        FILE_ADDED="FileAdded",
+        FILE_SELECTED="FileSelected",
+        FILE_DESELECTED="FileDeselected",
+        FILE_REMOVED="FileRemoved",
+        FOLDER_REMOVED="FolderRemoved",
     )
     sys.modules.setdefault("octoprint.events", events)
 
     filemanager = types.ModuleType("octoprint.filemanager")
     filemanager.FileDestinations = types.SimpleNamespace(LOCAL="local")
+    filemanager.valid_file_type = lambda path, type=None: path.endswith(".gcode")
     sys.modules.setdefault("octoprint.filemanager", filemanager)
 
+    class LineProcessorStream:
+        def __init__(self, input_stream):
+            self.input_stream = input_stream
+
+        def read(self, size=-1):
+            return b"".join(self.process_line(line) for line in self.input_stream.readlines())
+
+    class StreamWrapper:
+        def __init__(self, filename, *streams):
+            self.filename = filename
+            self.streams = streams
+
+    filemanager_util = types.ModuleType("octoprint.filemanager.util")
+    filemanager_util.LineProcessorStream = LineProcessorStream
+    filemanager_util.StreamWrapper = StreamWrapper
+    sys.modules.setdefault("octoprint.filemanager.util", filemanager_util)
+
     server = types.ModuleType("octoprint.server")
     server.app = types.SimpleNamespace()
     sys.modules.setdefault("octoprint.server", server)
@@ -49,20 +76,33 @@ def _install_octoprint_stubs():
 
 _install_octoprint_stubs()
 
-from octoprint_nfv import Nozzle_filament_validatorPlugin
+import octoprint_nfv.plugin as plugin_module
+from octoprint_nfv.plugin import Nozzle_filament_validatorPlugin
+from octoprint_nfv.hardware_state import hardware_snapshot
+from octoprint_nfv.printability_index import printability_index
+from octoprint_nfv.printer_profile import printer_profile_cache
+from octoprint_nfv.spoolManager import SpoolManagerIntegration, circuit_breaker
+from octoprint_nfv.preprocessor import upload_metadata_capture
+from octoprint_nfv.validate import parse_gcode
 
 
 class _CurrentFile:
     def __init__(self, path):
         self.path = path
+        self.lookups = 0
 
     def getFilename(self):
+        self.lookups += 1
         return self.path
 
 
 class _Comm:
     def __init__(self, path):
         self._currentFile = _CurrentFile(path)
+        self.sent = []
+
+    def sendCommand(self, cmd, cmd_type=None, part_of_job=False, tags=None):
+        self.sent.append((cmd, part_of_job))
 
     def isSdFileSelected(self):
         return False
@@ -72,15 +112,59 @@ class _Validator:
     def __init__(self, result):
         self.result = result
         self.calls = 0
+        self.modes = []
 
-    def check_print(self, path):
+    def check_print(self, path, interactive=True):
         self.calls += 1
+        self.modes.append(interactive)
         return self.result
 
+    def update_filament_wait_status(self, state):
+        pass
+
+
+class _PromptingValidator(_Validator):
+    """Opens a prompt and blocks until the test decides."""
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.decision = threading.Event()
+        self.finished = threading.Event()
+        self.statuses = []
+
+    def check_print(self, path, interactive=True):
+        self.calls += 1
+        if not interactive:
+            # Anything that would prompt fails without an operator
+            return False
+        self.decision.wait(5)
+        self.finished.set()
+        return self.result
+
+    def update_filament_wait_status(self, state):
+        self.statuses.append(state)
+        self.decision.set()
+
+
+class _SlowPrevalidationValidator(_Validator):
+    """Blocks the first validation, the speculative one, until the test releases it."""
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def check_print(self, path, interactive=True):
+        if not self.started.is_set():
+            self.started.set()
+            self.release.wait(5)
+        return super().check_print(path, interactive)
+
 
 class _Printer:
     def __init__(self):
         self.cancel_calls = 0
+        self.holds = []
 
     def cancel_print(self):
         self.cancel_calls += 1
@@ -92,6 +176,122 @@ class _Printer:
     def get_current_job(self):
         return {}
 
+    def set_job_on_hold(self, value, blocking=True):
+        self.holds.append(value)
+
+
+class _PluginManager:
+    def __init__(self):
+        self.messages = []
+
+    def send_plugin_message(self, identifier, message):
+        self.messages.append(message)
+
+
+class _Upload:
+    filename = "print.gcode"
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self):
+        return io.BytesIO(self.content)
+
+
+class _FileManager:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path_on_disk(self, storage, path):
+        return str(Path(self.directory) / path)
+
+
+class _MetadataCache:
+    def __init__(self):
+        self.entries = {}
+        self.parsed = []
+
+    def put(self, path, metadata):
+        self.entries[path] = metadata
+
+    def get_or_parse(self, path):
+        if path not in self.entries:
+            self.parsed.append(path)
+            self.entries[path] = parse_gcode(path)
+        return self.entries[path]
+
+
+class _PassingValidator:
+    def explain_metadata(self, gcode_info, snapshot):
+        return True, []
+
+
+UPLOAD_CONTENT = ("; nozzle_diameter = 0.6\n" + "G1 X1\n" * 1500
+                  + "; nozzle_diameter = 0.4\n; filament_type = PETG\n; printer_model = MK4\n").encode()
+
+
+class UploadCaptureTests(unittest.TestCase):
+    def make_plugin(self, directory):
+        plugin = Nozzle_filament_validatorPlugin()
+        plugin._logger = logging.getLogger("nfv-preflight-tests")
+        plugin._upload_capture = upload_metadata_capture(plugin._logger)
+        plugin._file_manager = _FileManager(directory)
+        plugin.metadata_cache = _MetadataCache()
+        plugin.printability_index = printability_index(_PassingValidator(), plugin.metadata_cache, plugin._logger)
+        return plugin
+
+    def test_metadata_is_captured_while_the_upload_is_written(self):
+        content = UPLOAD_CONTENT
+        with tempfile.TemporaryDirectory() as directory:
+            plugin = self.make_plugin(directory)
+
+            self.assertIs(plugin.capture_upload_metadata("notes.txt", _Upload(b"")).__class__, _Upload)
+            wrapped = plugin.capture_upload_metadata("print.gcode", _Upload(content))
+            written = wrapped.streams[0].read()
+            Path(directory, "print.gcode").write_bytes(written)
+            plugin.on_event("FileAdded", {"storage": "local", "path": "print.gcode"})
+            plugin._index_executor.submit(lambda: None).result()
+
+            path = str(Path(directory) / "print.gcode")
+            self.assertEqual(content, written)
+            self.assertEqual(parse_gcode(path), plugin.metadata_cache.entries[path])
+            self.assertEqual(["0.4"], plugin.metadata_cache.entries[path]["nozzle_size"])
+            self.assertEqual([], plugin.metadata_cache.parsed)
+            self.assertEqual(1, plugin.printability_index.stats()["files"])
+
+    def test_index_is_maintained_while_a_prevalidation_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            plugin = self.make_plugin(directory)
+            Path(directory, "print.gcode").write_bytes(UPLOAD_CONTENT)
+            release = threading.Event()
+            self.addCleanup(release.set)
+            plugin._prevalidation_executor.submit(release.wait)
+            plugin.on_event("FileAdded", {"storage": "local", "path": "print.gcode"})
+            plugin._index_executor.submit(lambda: None).result(timeout=5)
+            self.assertEqual(1, plugin.printability_index.stats()["files"])
+
+    def test_file_rewritten_after_the_capture_is_parsed_from_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            plugin = self.make_plugin(directory)
+            wrapped = plugin.capture_upload_metadata("print.gcode", _Upload(UPLOAD_CONTENT))
+            # A later preprocessor changed the nozzle without changing the size of the file
+            written = wrapped.streams[0].read().replace(b"diameter = 0.4", b"diameter = 0.6")
+            Path(directory, "print.gcode").write_bytes(written)
+            plugin.on_event("FileAdded", {"storage": "local", "path": "print.gcode"})
+            plugin._index_executor.submit(lambda: None).result()
+
+            path = str(Path(directory) / "print.gcode")
+            self.assertEqual([path], plugin.metadata_cache.parsed)
+            self.assertEqual(["0.6"], plugin.metadata_cache.entries[path]["nozzle_size"])
+
+
+def wait_for_gate(test, plugin, state):
+    for _ in range(500):
+        if plugin._gate[0] == state:
+            return
+        threading.Event().wait(0.01)
+    test.fail(f"the gate never became {state}")
+
 
 class PreflightGateTests(unittest.TestCase):
     def make_plugin(self, validation_result):
@@ -99,23 +299,27 @@ class PreflightGateTests(unittest.TestCase):
         plugin.validator = _Validator(validation_result)
         plugin._printer = _Printer()
         plugin._logger = logging.getLogger("nfv-preflight-tests")
+        plugin._plugin_manager = _PluginManager()
+        plugin._identifier = "nfv"
+        plugin._spool_manager = SpoolManagerIntegration(None, plugin._logger)
         return plugin
 
     def test_failure_suppresses_start_and_first_file_command(self):
-        with tempfile.TemporaryDirectory() as directory:
-            path = str(Path(directory) / "print.gcode")
-            comm = _Comm(path)
-            plugin = self.make_plugin(False)
+        comm = _Comm("print.gcode")
+        plugin = self.make_plugin(False)
 
-            start_result = plugin.validate_before_queuing(
-                comm, "queuing", "M110 N0", None, "M110", tags={"source:job"})
-            file_result = plugin.validate_before_queuing(
-                comm, "queuing", "G28", None, "G28", tags={"source:file"})
+        start_result = plugin.validate_before_queuing(
+            comm, "queuing", "M110 N0", None, "M110", tags={"source:job"})
+        wait_for_gate(self, plugin, "blocked")
+        file_result = plugin.validate_before_queuing(
+            comm, "queuing", "G28", None, "G28", tags={"source:file"})
 
-            self.assertEqual((None,), start_result)
-            self.assertEqual((None,), file_result)
-            self.assertEqual(1, plugin.validator.calls)
-            self.assertEqual(2, plugin._printer.cancel_calls)
+        self.assertEqual((None,), start_result)
+        self.assertEqual((None,), file_result)
+        self.assertEqual([False, True], plugin.validator.modes)
+        self.assertEqual(2, plugin._printer.cancel_calls)
+        self.assertEqual([True, False], plugin._printer.holds)
+        self.assertEqual([], comm.sent)
 
     def test_cancellation_commands_are_not_suppressed(self):
         plugin = self.make_plugin(False)
@@ -135,6 +339,324 @@ class PreflightGateTests(unittest.TestCase):
         self.assertEqual(1, plugin.validator.calls)
         self.assertEqual(0, plugin._printer.cancel_calls)
 
+    def test_passed_gate_skips_path_resolution_for_later_commands(self):
+        plugin = self.make_plugin(True)
+        comm = _Comm("print.gcode")
+        self.assertIsNone(plugin.validate_before_queuing(
+            comm, "queuing", "M110 N0", None, "M110", tags={"source:job"}))
+        lookups = comm._currentFile.lookups
+        for _ in range(100):
+            self.assertIsNone(plugin.validate_before_queuing(
+                comm, "queuing", "G1 X1", None, "G1", tags={"source:file"}))
+        self.assertEqual(lookups, comm._currentFile.lookups)
+        self.assertEqual(1, plugin.validator.calls)
+        self.assertEqual([], plugin._printer.holds)
+
+    def test_gate_resets_on_job_lifecycle_events(self):
+        plugin = self.make_plugin(True)
+        comm = _Comm("print.gcode")
+        plugin.validate_before_queuing(comm, "queuing", "M110 N0", None, "M110", tags={"source:job"})
+        plugin.on_event("PrintDone", {})
+        self.assertIsNone(plugin.validate_before_queuing(
+            comm, "queuing", "M110 N0", None, "M110", tags={"source:job"}))
+        self.assertEqual(2, plugin.validator.calls)
+
+    def test_new_job_is_validated_even_without_an_end_event(self):
+        plugin = self.make_plugin(True)
+        plugin.validate_before_queuing(
+            _Comm("print.gcode"), "queuing", "M110 N0", None, "M110", tags={"source:job"})
+        plugin.validate_before_queuing(
+            _Comm("print.gcode"), "queuing", "M110 N0", None, "M110", tags={"source:job"})
+        self.assertEqual(2, plugin.validator.calls)
+
+
+class PromptTests(unittest.TestCase):
+    def make_plugin(self, validation_result):
+        plugin = PreflightGateTests.make_plugin(self, validation_result)
+        plugin.validator = _PromptingValidator(validation_result)
+        return plugin
+
+    def queue_job(self, plugin, comm):
+        return [plugin.validate_before_queuing(comm, "queuing", cmd, None, cmd.split()[0], tags=tags)
+                for cmd, tags in (("M110 N0", {"source:job"}), ("M105", {"trigger:comm.poll_temperature"}))]
+
+    def test_prompt_holds_the_first_command_and_approval_releases_it(self):
+        plugin = self.make_plugin(True)
+        comm = _Comm("print.gcode")
+        self.assertEqual([(None,), None], self.queue_job(plugin, comm))
+        self.assertEqual([True], plugin._printer.holds)
+
+        plugin.validator.decision.set()
+        wait_for_gate(self, plugin, "passed")
+        self.assertEqual([("M110 N0", True)], comm.sent)
+        self.assertEqual([True, False], plugin._printer.holds)
+        self.assertEqual(0, plugin._printer.cancel_calls)
+        self.assertIsNone(plugin.validate_before_queuing(
+            comm, "queuing", "M110 N0", None, "M110", tags={"source:job"}))
+
+    def test_prompt_rejection_cancels_the_job(self):
+        plugin = self.make_plugin(False)
+        comm = _Comm("print.gcode")
+        self.queue_job(plugin, comm)
+        plugin.validator.decision.set()
+        wait_for_gate(self, plugin, "blocked")
+
+        self.assertEqual(1, plugin._printer.cancel_calls)
+        self.assertEqual([True, False], plugin._printer.holds)
+        self.assertEqual([], comm.sent)
+        plugin.on_event("PrintCancelled", {})
+        self.assertEqual("idle", plugin._gate[0])
+
+    def test_cancelling_the_held_job_releases_it_and_the_prompt(self):
+        plugin = self.make_plugin(True)
+        comm = _Comm("print.gcode")
+        self.queue_job(plugin, comm)
+        plugin.on_event("PrintCancelling", {})
+        plugin.validator.finished.wait(5)
+
+        self.assertIn("cancel", plugin.validator.statuses)
+        self.assertEqual([True, False], plugin._printer.holds)
+        self.assertEqual("blocked", plugin._gate[0])
+        self.assertEqual([], comm.sent)
+        self.assertEqual(0, plugin._printer.cancel_calls)
+
+    def test_new_job_releases_the_waiting_prompt(self):
+        plugin = self.make_plugin(True)
+        comm = _Comm("print.gcode")
+        self.queue_job(plugin, comm)
+        other = _Comm("other.gcode")
+        plugin.validate_before_queuing(other, "queuing", "M110 N0", None, "M110", tags={"source:job"})
+        wait_for_gate(self, plugin, "passed")
+
+        self.assertIn("cancel", plugin.validator.statuses)
+        self.assertEqual([], comm.sent)
+        self.assertEqual([("M110 N0", True)], other.sent)
+        self.assertEqual([True, False], plugin._printer.holds)
+
+
+class PrevalidationTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        Path(self.temp_dir.name, "print.gcode").write_text("G28\n", encoding="utf-8")
+        self.path = str(Path(self.temp_dir.name) / "print.gcode")
+
+    def make_plugin(self, validation_result):
+        plugin = PreflightGateTests.make_plugin(self, validation_result)
+        plugin._file_manager = _FileManager(self.temp_dir.name)
+        return plugin
+
+    def select_and_start(self, plugin):
+        plugin.on_event("FileSelected", {"origin": "local", "path": "print.gcode"})
+        plugin._prevalidation.result()
+        return plugin.validate_before_queuing(
+            _Comm(self.path), "queuing", "M110 N0", None, "M110", tags={"source:job"})
+
+    def test_passing_prevalidation_is_used_by_the_first_job_command(self):
+        plugin = self.make_plugin(True)
+        self.assertIsNone(self.select_and_start(plugin))
+        self.assertEqual([False], plugin.validator.modes)
+        self.assertEqual(0, plugin._printer.cancel_calls)
+
+    def test_first_job_command_does_not_wait_for_a_running_prevalidation(self):
+        plugin = self.make_plugin(True)
+        plugin.validator = _SlowPrevalidationValidator(True)
+        self.addCleanup(plugin.validator.release.set)
+        plugin.on_event("FileSelected", {"origin": "local", "path": "print.gcode"})
+        self.assertTrue(plugin.validator.started.wait(5))
+        started = time.monotonic()
+        self.assertIsNone(plugin.validate_before_queuing(
+            _Comm(self.path), "queuing", "M110 N0", None, "M110", tags={"source:job"}))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(0, plugin._printer.cancel_calls)
+
+    def test_state_change_after_selection_discards_the_verdict(self):
+        plugin = self.make_plugin(True)
+        plugin.on_event("FileSelected", {"origin": "local", "path": "print.gcode"})
+        plugin._prevalidation.result()
+        plugin.on_event("plugin_spoolmanager_spool_selected", {})
+        self.assertIsNone(plugin.validate_before_queuing(
+            _Comm(self.path), "queuing", "M110 N0", None, "M110", tags={"source:job"}))
+        self.assertEqual([False, False], plugin.validator.modes)
+
+    def test_failing_prevalidation_validates_interactively(self):
+        plugin = self.make_plugin(False)
+        self.assertEqual((None,), self.select_and_start(plugin))
+        wait_for_gate(self, plugin, "blocked")
+        self.assertEqual([False, False, True], plugin.validator.modes)
+
+
+class _HardwareState:
+    def __init__(self):
+        self.current = hardware_snapshot({1: 0.4}, {1: 1}, {1: ("Generic", ["PLA", " PETG"])}, 1,
+                                         {"timeout": 300, "enable_spool_checking": 0}, 4)
+
+    def snapshot(self):
+        return self.current
+
+
+class _ProfileManager:
+    def __init__(self):
+        self.reads = 0
+
+    def get_current_or_default(self):
+        self.reads += 1
+        return {"model": "MK4", "extruder": {"count": 1, "sharedNozzle": False}}
+
+
+class StateViewTests(unittest.TestCase):
+    def setUp(self):
+        self.plugin = Nozzle_filament_validatorPlugin()
+        self.plugin.hardware_state = _HardwareState()
+        self.plugin._printer_profile_manager = _ProfileManager()
+        self.plugin.printer_profile = printer_profile_cache(self.plugin._printer_profile_manager)
+
+    def test_view_is_built_from_the_snapshot(self):
+        etag, state, body = self.plugin._get_state_view()
+        self.assertEqual([{"id": 1, "name": "Generic", "compatible_filaments": ["PLA", "PETG"]}], state["build_plates"])
+        self.assertEqual("Generic", state["currentBuildPlate"])
+        self.assertEqual("False", state["check_spool_id"])
+        self.assertEqual(4, state["state_generation"])
+
+    def test_view_is_reused_until_the_state_changes(self):
+        etag, state, body = self.plugin._get_state_view()
+        self.assertIs(body, self.plugin._get_state_view()[2])
+        self.plugin.hardware_state.current = hardware_snapshot({1: 0.6}, {1: 1}, {}, None, {}, 5)
+        self.assertNotEqual(etag, self.plugin._get_state_view()[0])
+        self.assertEqual(1, self.plugin._printer_profile_manager.reads)
+
+    def test_profile_event_reloads_the_profile(self):
+        self.plugin._get_state_view()
+        self.plugin._schedule_extruder_reconciliation = lambda: None
+        self.plugin.on_event("PrinterProfileModified", {})
+        self.plugin._get_state_view()
+        self.assertEqual(2, self.plugin._printer_profile_manager.reads)
+
+
+class _Extruders:
+    def __init__(self):
+        self.updated = threading.Event()
+        self.updates = 0
+
+    def update_data(self):
+        self.updates += 1
+        self.updated.set()
+
+
+class ExtruderReconciliationTests(unittest.TestCase):
+    def test_profile_event_burst_reconciles_once(self):
+        plugin = Nozzle_filament_validatorPlugin()
+        plugin.extruders = _Extruders()
+        plugin.printer_profile = printer_profile_cache(_ProfileManager())
+        plugin._push_state_delta = lambda: None
+        delay = plugin_module.EXTRUDER_RECONCILE_DELAY
+        plugin_module.EXTRUDER_RECONCILE_DELAY = 0.05
+        self.addCleanup(setattr, plugin_module, "EXTRUDER_RECONCILE_DELAY", delay)
+
+        for _ in range(5):
+            plugin.on_event("PrinterProfileModified", {})
+        self.assertTrue(plugin.extruders.updated.wait(2))
+        self.assertEqual(1, plugin.extruders.updates)
+        self.assertIsNone(plugin._reconcile_timer)
+
+
+class _SpoolManagerPlugin:
+    def __init__(self):
+        self.calls = 0
+        self.spools = [{"material": "PLA", "colorName": "Red", "color": "#f00", "spoolName": "red",
+                        "databaseId": 3}, None]
+
+    def api_getSelectedSpoolInformations(self):
+        self.calls += 1
+        return self.spools
+
+
+class SpoolSelectionTests(unittest.TestCase):
+    def setUp(self):
+        self.impl = _SpoolManagerPlugin()
+        self.spool_manager = SpoolManagerIntegration(self.impl, logging.getLogger("nfv-preflight-tests"))
+
+    def test_one_fetch_serves_every_lookup(self):
+        self.assertEqual(["PLA", None], self.spool_manager.get_loaded_filaments())
+        self.assertEqual(["red", None], self.spool_manager.get_names())
+        self.assertEqual(["3", None], self.spool_manager.get_db_id())
+        self.assertEqual(1, self.impl.calls)
+
+    def test_spool_manager_event_discards_the_selection(self):
+        plugin = Nozzle_filament_validatorPlugin()
+        plugin._spool_manager = self.spool_manager
+        self.spool_manager.get_names()
+        self.impl.spools = [None]
+        plugin.on_event("plugin_spoolmanager_spool_selected", {})
+        self.assertEqual([None], self.spool_manager.get_names())
+        self.assertEqual(2, self.impl.calls)
+
+    def test_selection_expires(self):
+        spool_manager = SpoolManagerIntegration(self.impl, logging.getLogger("nfv-preflight-tests"), ttl=0)
+        spool_manager.get_names()
+        spool_manager.get_names()
+        self.assertEqual(2, self.impl.calls)
+
+
+class _SlowSpoolManagerPlugin(_SpoolManagerPlugin):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def api_getSelectedSpoolInformations(self):
+        self.calls += 1
+        self.release.wait(2)
+        return self.spools
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.impl = _SlowSpoolManagerPlugin()
+        self.addCleanup(self.impl.release.set)
+        self.spool_manager = SpoolManagerIntegration(self.impl, logging.getLogger("nfv-preflight-tests"), ttl=0,
+                                                     deadline=0.02, breaker=circuit_breaker(2, reset_timeout=60))
+        self.addCleanup(self.spool_manager.close)
+
+    def test_slow_calls_fall_back_and_open_the_breaker(self):
+        self.assertEqual(-2, self.spool_manager.get_loaded_filaments())
+        self.assertEqual(-2, self.spool_manager.get_loaded_filaments())
+        self.assertEqual(-2, self.spool_manager.get_loaded_filaments())
+        stats = self.spool_manager.stats()
+        self.assertEqual("open", stats["state"])
+        self.assertEqual(2, stats["timeouts"])
+        self.assertEqual(1, stats["rejected"])
+        self.assertEqual(2, self.impl.calls)
+
+    def test_trial_call_closes_the_breaker(self):
+        breaker = circuit_breaker(1, reset_timeout=0)
+        breaker.record(0.5, failed=True, timed_out=True)
+        self.assertEqual("open", breaker.state)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(0.001, failed=False)
+        self.assertEqual("closed", breaker.state)
+
+
+
+class _LibraryFileManager(_FileManager):
+    def list_files(self, destination, path=None, recursive=False):
+        self.listed = (destination, path, recursive)
+        return {"local": {
+            "print.gcode": {"type": "machinecode", "path": "print.gcode"},
+            "notes.txt": {"type": "other", "path": "notes.txt"},
+            "parts": {"type": "folder", "path": "parts", "children": {
+                "bracket.gcode": {"type": "machinecode", "path": "parts/bracket.gcode"},
+            }},
+        }}
+
+
+class LibraryValidationTests(unittest.TestCase):
+    def test_gcode_files_of_sub_folders_are_listed(self):
+        plugin = Nozzle_filament_validatorPlugin()
+        plugin._file_manager = _LibraryFileManager("/library")
+        self.assertEqual(["parts/bracket.gcode", "print.gcode"], plugin._list_library_files())
+        self.assertEqual(("local", None, True), plugin._file_manager.listed)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,88 @@
+import logging
+import unittest
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.printability_index import printability_index, requirement_facets
+    from octoprint_nfv.rules import validation_snapshot
+    from octoprint_nfv.validate import validator
+
+
+def make_metadata(nozzles=("0.4",), filament_types=("PLA",), filament_used=("100.0",)):
+    return dict(printer_model="MK4", skip_validation=False, single_extruder_multi_material=False,
+                nozzle_size=list(nozzles), filament_type=list(filament_types), filament_used=list(filament_used),
+                filament_notes=None)
+
+
+def make_snapshot(**fields):
+    values = dict(printer_model="MK4", extruder_count=2, nozzle_sizes=(0.4, 0.4), build_plate_filaments=("PLA",),
+                  check_filament_types=True, loaded_filaments=("PLA", "PLA"), loaded_filaments_error=None,
+                  check_spool_ids=False, spool_names=(), timeout=0)
+    values.update(fields)
+    return validation_snapshot(**values)
+
+
+class _MetadataCache:
+    def __init__(self, entries):
+        self.entries = entries
+        self.reads = 0
+
+    def get_or_parse(self, path):
+        self.reads += 1
+        return self.entries[path]
+
+
+class PrintabilityIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.validator = validator(None, None, None, None, None, None, logging.getLogger("nfv-tests"), None, "nfv",
+                                   None)
+        self.addCleanup(self.validator.close)
+        # Both tools of the printer, the first file only uses the second
+        self.metadata_cache = _MetadataCache({
+            "/disk/second.gcode": make_metadata(("0.4", "0.4"), ("PLA", "PLA"), ("0", "100.0")),
+            "/disk/first.gcode": make_metadata(("0.4", "0.4"), ("PLA", "PLA"), ("100.0", "0")),
+            "/disk/broken.gcode": make_metadata(filament_used=()),
+        })
+        self.index = printability_index(self.validator, self.metadata_cache, logging.getLogger("nfv-tests"))
+        for name in ("second", "first", "broken"):
+            self.index.update_file(f"prints/{name}.gcode", f"/disk/{name}.gcode")
+        self.index.refresh(make_snapshot())
+
+    def test_verdicts_are_computed_from_the_requirements(self):
+        files = self.index.query()["files"]
+        self.assertTrue(files["prints/first.gcode"]["printable"])
+        self.assertTrue(files["prints/second.gcode"]["printable"])
+        self.assertFalse(files["prints/broken.gcode"]["printable"])
+        self.assertIn("Required slicer metadata", files["prints/broken.gcode"]["reasons"][0])
+
+    def test_only_files_using_a_changed_tool_are_recomputed(self):
+        evaluations = self.index.evaluations
+        changed = self.index.refresh(make_snapshot(nozzle_sizes=(0.6, 0.4)))
+        self.assertEqual(["prints/first.gcode"], list(changed))
+        self.assertFalse(changed["prints/first.gcode"]["printable"])
+        self.assertEqual(evaluations + 1, self.index.evaluations)
+        self.assertEqual(3, self.metadata_cache.reads)
+
+    def test_shared_facets_recompute_every_dependent_file(self):
+        changed = self.index.refresh(make_snapshot(build_plate_filaments=("PETG",)))
+        self.assertEqual({"prints/first.gcode", "prints/second.gcode"}, set(changed))
+
+    def test_unchanged_state_recomputes_nothing(self):
+        evaluations = self.index.evaluations
+        self.assertEqual({}, self.index.refresh(make_snapshot()))
+        self.assertEqual(evaluations, self.index.evaluations)
+
+    def test_removed_folder_leaves_the_index(self):
+        self.index.remove_folder("prints")
+        self.assertEqual({}, self.index.query()["files"])
+        self.assertEqual(0, self.index.stats()["facets"])
+
+    def test_incomplete_or_skipped_files_do_not_depend_on_the_state(self):
+        self.assertEqual(frozenset(), requirement_facets(make_metadata(filament_used=())))
+        self.assertEqual(frozenset(), requirement_facets(dict(make_metadata(), skip_validation=True)))
+        self.assertIn(("nozzle", 0), requirement_facets(make_metadata()))
+
+
+if __name__ == "__main__":
+    unittest.main()
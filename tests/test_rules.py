@@ -0,0 +1,52 @@
+import unittest
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv import rules
+
+
+def make_snapshot(**fields):
+    values = dict(printer_model="MK4", extruder_count=5, nozzle_sizes=(0.4,) * 5, build_plate_filaments=("PLA",),
+                  check_filament_types=True, loaded_filaments=["PLA"] * 5, loaded_filaments_error=None,
+                  check_spool_ids=False, spool_names=(), timeout=0)
+    values.update(fields)
+    return rules.validation_snapshot(**values)
+
+
+class RuleTests(unittest.TestCase):
+    def test_all_tools_pass_in_one_evaluation(self):
+        evaluation = rules.evaluate_tools(make_snapshot(), range(5), ["0.4"] * 5, ["PLA"] * 5, ["PLA"] * 5, False)
+        self.assertIsNone(evaluation.failure)
+        self.assertEqual([], evaluation.findings)
+        self.assertTrue(evaluation.nozzle_passed and evaluation.filament_passed)
+
+    def test_evaluation_stops_at_the_first_failing_tool(self):
+        snapshot = make_snapshot(nozzle_sizes=(0.4, 0.4, 0.6, 0.4, 0.6))
+        evaluation = rules.evaluate_tools(snapshot, range(5), ["0.4"] * 5, ["PLA"] * 5, ["PLA"] * 5, False)
+        self.assertEqual("The installed nozzle does not match the GCODE on extruder 3.", evaluation.failure)
+        self.assertEqual(1, len(evaluation.findings))
+
+    def test_unavailable_spool_manager_skips_the_type_comparison(self):
+        loaded = rules.normalize_loaded_filaments(-1, 2)
+        evaluation = rules.evaluate_tools(make_snapshot(), [0, 1], ["0.4"] * 2, ["PETG", "PLA"], loaded, False)
+        self.assertEqual("The selected build plate is incompatible with extruder 1's filament.", evaluation.failure)
+
+    def test_input_shaping_profile_accepts_its_base_model(self):
+        self.assertTrue(rules.check_printer_model("MK4", "MK4IS")[0])
+        passed, findings = rules.check_printer_model("MK3S", "MK4IS")
+        self.assertFalse(passed)
+        self.assertEqual(2, len(findings))
+
+    def test_printer_model_is_normalized_once(self):
+        self.assertEqual(("mk4is", "mk4", True), rules.normalize_printer_model("MK4IS"))
+        self.assertEqual(("mk3smmu3", "mk3smmu3", False), rules.normalize_printer_model("MK3SMMU3"))
+        self.assertIs(rules.normalize_printer_model("MK4IS"), rules.normalize_printer_model("MK4IS"))
+
+    def test_rules_are_deterministic(self):
+        arguments = (make_snapshot(), range(5), ["0.4"] * 5, ["PLA", "ABS", "PLA", "PLA", "PLA"], ["PLA"] * 5, False)
+        self.assertEqual(rules.evaluate_tools(*arguments), rules.evaluate_tools(*arguments))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from plugin_modules import plugin_modules
+
+with plugin_modules():
+    from octoprint_nfv.hardware_state import hardware_snapshot
+    from octoprint_nfv.printer_profile import build_profile_view
+    from octoprint_nfv.state_view import build_state_view, diff_state_views
+
+PROFILE = build_profile_view({"model": "MK4", "extruder": {"count": 2, "sharedNozzle": False}})
+
+
+def make_view(nozzles=None, extruders=None, current_build_plate=1, generation=1):
+    snapshot = hardware_snapshot(nozzles or {1: 0.4, 2: 0.6}, extruders or {1: 1, 2: 1},
+                                 {1: ("Generic", ["PLA", "PETG"]), 2: ("Textured", ["PETG"])}, current_build_plate,
+                                 {"timeout": 300, "enable_spool_checking": 0}, generation)
+    return build_state_view(snapshot, PROFILE)
+
+
+class StateDeltaTests(unittest.TestCase):
+    def test_unchanged_state_has_no_delta(self):
+        self.assertIsNone(diff_state_views(make_view(), make_view()))
+
+    def test_delta_names_the_changed_and_removed_items(self):
+        delta = diff_state_views(make_view(), make_view(nozzles={1: 0.4, 3: 0.8}, extruders={1: 1, 2: 3},
+                                                        generation=2))
+        self.assertEqual(1, delta["base"])
+        self.assertEqual(2, delta["generation"])
+        self.assertEqual({"changed": [{"id": 3, "size": 0.8}], "removed": [2]}, delta["items"]["nozzles"])
+        self.assertEqual({"changed": [{"extruderPosition": 2, "nozzleId": 3}], "removed": []},
+                         delta["items"]["extruders"])
+        self.assertNotIn("build_plates", delta["items"])
+        self.assertEqual({}, delta["values"])
+
+    def test_delta_carries_changed_values(self):
+        delta = diff_state_views(make_view(), make_view(current_build_plate=2, generation=2))
+        self.assertEqual({"currentBuildPlate": "Textured", "currentBuildPlateFilaments": ["PETG"]}, delta["values"])
+        self.assertEqual({}, delta["items"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,15 @@
 import logging
-import sys
 import tempfile
 import threading
-import types
+import time
 import unittest
 from pathlib import Path
 
-# Load the pure validation module without executing the OctoPrint-dependent
-# package initializer. OctoPrint itself is intentionally not a test dependency.
-package_root = Path(__file__).resolve().parents[1] / "octoprint_nfv"
-package = types.ModuleType("octoprint_nfv")
-package.__path__ = [str(package_root)]
-sys.modules.setdefault("octoprint_nfv", package)
+from plugin_modules import plugin_modules
 
-from octoprint_nfv.validate import parse_gcode, validator
+with plugin_modules():
+    import octoprint_nfv.validate as validate_module
+    from octoprint_nfv.validate import extract_metadata, parse_gcode, read_tail, validator
 
 
 VALID_GCODE = """; nozzle_diameter = 0.4
@@ -25,8 +21,8 @@ G28
 
 
 class _BuildPlate:
-    def is_filament_compatible_with_build_plate(self, filament_type):
-        return filament_type == "PLA"
+    def get_current_build_plate_filaments(self):
+        return ["PLA"]
 
 
 class _Extruders:
@@ -41,6 +37,9 @@ class _SpoolManager:
     def get_loaded_filaments(self):
         return -1
 
+    def invalidate(self):
+        pass
+
 
 class _Filament:
     def get_enable_spool_checking(self):
@@ -58,11 +57,51 @@ class _InteractiveFilament(_Filament):
         return 1
 
 
+class _SpoolCheckingFilament(_InteractiveFilament):
+    def get_enable_spool_checking(self):
+        return True
+
+
+class _NamedSpoolManager(_SpoolManager):
+    def __init__(self, names):
+        self.names = names
+
+    def get_names(self):
+        return self.names
+
+
 class _TypesDisabledFilament(_Filament):
     def get_enable_filament_type_checking(self):
         return False
 
 
+class _SlowSpoolManager(_SpoolManager):
+    def get_loaded_filaments(self):
+        time.sleep(0.2)
+        return ["PLA"]
+
+
+class _SlowMetadataCache:
+    def get_or_parse(self, path):
+        time.sleep(0.2)
+        return parse_gcode(path)
+
+
+class _CountingMetadataCache:
+    def __init__(self):
+        self.parses = 0
+
+    def get_or_parse(self, path):
+        self.parses += 1
+        return parse_gcode(path)
+
+
+class _SlowNamedSpoolManager(_NamedSpoolManager):
+    def get_names(self):
+        time.sleep(0.2)
+        return self.names
+
+
 class _WrongTypeSpoolManager:
     def get_loaded_filaments(self):
         return ["ABS"]
@@ -111,6 +150,7 @@ class ValidatorTests(unittest.TestCase):
             identifier="nfv",
             printer_profile_manager=_Profiles(),
         )
+        self.addCleanup(self.validator.close)
 
     def write_gcode(self, content):
         path = Path(self.temp_dir.name) / "print.gcode"
@@ -122,6 +162,65 @@ class ValidatorTests(unittest.TestCase):
         self.assertEqual(["0.4"], info["nozzle_size"])
         self.assertEqual(["PLA"], info["filament_type"])
 
+    def test_read_tail_returns_the_last_lines_across_blocks(self):
+        path = self.write_gcode("".join(f"G1 X{i}\n" for i in range(50)))
+        self.assertEqual("".join(f"G1 X{i}\n" for i in range(41, 50)), read_tail(path, 10, block_size=7))
+        self.assertEqual("".join(f"G1 X{i}\n" for i in range(50)), read_tail(path, 100, block_size=7))
+
+    def test_parse_only_reads_metadata_from_the_tail(self):
+        header = "; nozzle_diameter = 0.6\n"
+        body = "G1 X1 Y1\n" * 2000
+        info = parse_gcode(self.write_gcode(header + body + VALID_GCODE))
+        self.assertEqual(["0.4"], info["nozzle_size"])
+        info = parse_gcode(self.write_gcode(header + body))
+        self.assertIsNone(info["nozzle_size"])
+
+    def test_extract_metadata_matches_keys_in_a_single_pass(self):
+        info = extract_metadata([
+            "G1 X1 ; nozzle_diameter = 0.8",
+            ";NOZZLE_DIAMETER= 0.4, 0.6",
+            "; nozzle_diameter = 0.25",
+            "; filament_notes =",
+            "; filament_type = PLA;PETG",
+            "; single_extruder_multi_material = 1",
+            ";  skip_validation  ",
+        ])
+        self.assertEqual(["0.4", "0.6"], info["nozzle_size"])
+        self.assertEqual(["PLA", "PETG"], info["filament_type"])
+        self.assertIsNone(info["filament_notes"])
+        self.assertTrue(info["single_extruder_multi_material"])
+        self.assertTrue(info["skip_validation"])
+
+    def test_inputs_are_gathered_concurrently(self):
+        self.validator._spool_manager = _SlowSpoolManager()
+        self.validator._metadata_cache = _SlowMetadataCache()
+        started = time.monotonic()
+        self.assertTrue(self.validator.check_print(self.write_gcode(VALID_GCODE)))
+        self.assertLess(time.monotonic() - started, 0.35)
+
+    def test_slow_parse_is_reported_as_a_timeout(self):
+        self.validator._metadata_cache = _SlowMetadataCache()
+        deadline = validate_module.GATHER_DEADLINE
+        validate_module.GATHER_DEADLINE = 0.05
+        self.addCleanup(setattr, validate_module, "GATHER_DEADLINE", deadline)
+        passed, reasons = self.validator.explain_print(self.write_gcode(VALID_GCODE))
+        self.assertFalse(passed)
+        self.assertIn("could not be parsed in time", reasons[0])
+
+    def test_slow_spool_names_are_not_a_filament_type_error(self):
+        self.validator._filament = _TypesDisabledFilament()
+        self.validator._spool_manager = _SlowNamedSpoolManager(["Red"])
+        self.validator._filament.get_enable_spool_checking = lambda: True
+        deadline = validate_module.GATHER_DEADLINE
+        validate_module.GATHER_DEADLINE = 0.05
+        self.addCleanup(setattr, validate_module, "GATHER_DEADLINE", deadline)
+        snapshots = []
+        capture_snapshot = self.validator.capture_snapshot
+        self.validator.capture_snapshot = lambda *args: snapshots.append(capture_snapshot(*args)) or snapshots[-1]
+        self.validator.explain_print(self.write_gcode(VALID_GCODE))
+        self.assertIsNone(snapshots[0].loaded_filaments_error)
+        self.assertEqual(-1, snapshots[0].loaded_filaments)
+
     def test_valid_file_passes_without_spool_manager(self):
         self.assertTrue(self.validator.check_print(self.write_gcode(VALID_GCODE)))
         self.assertFalse(self.printer.cancelled)
@@ -138,6 +237,21 @@ class ValidatorTests(unittest.TestCase):
         self.assertTrue(any("malformed numeric value" in message[1]["msg"]
                             for message in self.plugin_manager.messages))
 
+    def test_non_interactive_validation_never_alerts_or_prompts(self):
+        self.validator._filament = _InteractiveFilament()
+        self.assertFalse(self.validator.check_print(self.write_gcode("G28\n"), interactive=False))
+        self.assertTrue(self.validator.check_print(self.write_gcode(VALID_GCODE), interactive=False))
+        self.assertEqual([], self.plugin_manager.messages)
+        self.assertIsNone(self.validator.get_active_prompt())
+
+    def test_explain_print_collects_the_failed_checks(self):
+        snapshot = self.validator.capture_snapshot()
+        passed, reasons = self.validator.explain_print(self.write_gcode("G28\n"), snapshot)
+        self.assertFalse(passed)
+        self.assertTrue(reasons and "Required slicer metadata" in reasons[0])
+        self.assertEqual((True, []), self.validator.explain_print(self.write_gcode(VALID_GCODE), snapshot))
+        self.assertEqual([], self.plugin_manager.messages)
+
     def test_explicit_override_allows_missing_metadata(self):
         self.validator._filament = _InteractiveFilament()
         timer = threading.Timer(0.02, lambda: self.validator.update_filament_wait_status("ok"))
@@ -145,6 +259,75 @@ class ValidatorTests(unittest.TestCase):
         self.addCleanup(timer.cancel)
         self.assertTrue(self.validator.check_print(self.write_gcode("G28\n")))
 
+    def test_answer_wakes_the_waiting_prompt_immediately(self):
+        self.validator.update_filament_wait_status("waiting")
+        timer = threading.Timer(0.02, lambda: self.validator.update_filament_wait_status("ok"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.monotonic()
+        self.assertEqual("ok", self.validator.wait_for_filament_decision(10))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_expired_wait_is_cancelled(self):
+        self.validator.update_filament_wait_status("waiting")
+        self.validator.set_active_prompt("switch_spools", "spool, 0, None Selected, 0", 10)
+        self.assertIsNone(self.validator.wait_for_filament_decision(0.01))
+        self.assertEqual("cancel", self.validator.filament_wait_status)
+        self.assertIsNone(self.validator.get_active_prompt())
+
+    def test_spool_mismatches_of_all_tools_share_one_prompt(self):
+        self.validator._filament = _SpoolCheckingFilament()
+        self.validator._spool_manager = _NamedSpoolManager(["Red", "Blue", None])
+        gcode_info = {"filament_notes": ["[sm_name = Red]", "[sm_name = White]", "[sm_name = Black]"]}
+        timer = threading.Timer(0.02, lambda: self.validator.update_filament_wait_status("ok"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertEqual((True, True), self.validator.check_spool_ids([0, 1, 2], gcode_info))
+        prompts = [message for _, message in self.plugin_manager.messages if message["type"] == "switch_spools"]
+        self.assertEqual(1, len(prompts))
+        self.assertEqual([{"spool_id": "White", "index": 1, "current": "Blue"},
+                          {"spool_id": "Black", "index": 2, "current": None}], prompts[0]["mismatches"])
+
+    def test_matching_spools_do_not_prompt(self):
+        self.validator._filament = _SpoolCheckingFilament()
+        self.validator._spool_manager = _NamedSpoolManager(["Red"])
+        self.assertEqual((True, True), self.validator.check_spool_ids([0], {"filament_notes": ["[sm_name = Red]"]}))
+        self.assertEqual([], self.plugin_manager.messages)
+
+    def test_repeat_validation_reuses_the_passing_verdict(self):
+        path = self.write_gcode(VALID_GCODE)
+        self.assertTrue(self.validator.check_print(path))
+        self.validator.get_gcode_info = None
+        self.assertTrue(self.validator.check_print(path))
+        self.assertEqual(1, self.validator.verdicts.hits)
+
+    def test_reused_verdict_does_not_parse_the_file(self):
+        self.validator._metadata_cache = _CountingMetadataCache()
+        path = self.write_gcode(VALID_GCODE)
+        self.assertTrue(self.validator.check_print(path))
+        self.assertTrue(self.validator.check_print(path))
+        self.assertEqual(1, self.validator._metadata_cache.parses)
+
+    def test_changed_state_or_file_is_validated_again(self):
+        path = self.write_gcode(VALID_GCODE)
+        self.assertTrue(self.validator.check_print(path))
+        self.validator._spool_manager = _WrongTypeSpoolManager()
+        self.assertFalse(self.validator.check_print(path, interactive=False))
+        self.validator._spool_manager = _SpoolManager()
+        path = self.write_gcode(VALID_GCODE + "; filament_type = ABS\n")
+        self.assertTrue(self.validator.check_print(path))
+        self.assertEqual(0, self.validator.verdicts.hits)
+
+    def test_operator_approval_is_not_reused(self):
+        self.validator._filament = _InteractiveFilament()
+        path = self.write_gcode("G28\n")
+        timer = threading.Timer(0.02, lambda: self.validator.update_filament_wait_status("ok"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertTrue(self.validator.check_print(path))
+        self.assertFalse(self.validator.check_print(path, interactive=False))
+
     def test_filament_type_toggle_is_independent_of_spool_name_toggle(self):
         self.validator._filament = _TypesDisabledFilament()
         self.validator._spool_manager = _WrongTypeSpoolManager()